@@ -0,0 +1,332 @@
+"""
+Controllo di ammissione per tenant delle analisi (/analyze_skin).
+
+Senza una politica di coda un centro molto attivo occupa tutti i thread di
+analisi e le richieste degli altri centri aspettano minuti. Ogni richiesta,
+dopo la verifica delle credenziali, chiede un posto al controllore:
+
+- token bucket per tenant: ADMISSION_RATE analisi al secondo in media, con
+  picchi fino a ADMISSION_BURST; oltre -> 429 con Retry-After
+- al massimo ADMISSION_MAX_IN_FLIGHT analisi in esecuzione per tenant
+- ADMISSION_CAPACITY analisi in esecuzione in totale (default: i thread di
+  analysis_executor); le altre attendono in una coda equa pesata tra tenant
+  (start-time fair queueing, pesi opzionali in ADMISSION_WEIGHTS, es.
+  "centro_a=2,centro_b=0.5"): un tenant con cento richieste in coda non
+  ritarda la prima richiesta di un altro tenant
+- scarto del carico: se l'attesa stimata (coda / capacità x durata media di
+  un'analisi) supera ADMISSION_TARGET_WAIT secondi, o la coda supera
+  ADMISSION_MAX_QUEUE richieste, la richiesta viene rifiutata subito con 429
+  invece di restare in coda oltre il tempo utile per il client
+
+Profondità della coda, analisi in corso, attese in coda, durata delle analisi
+e rifiuti per motivo sono in `stats()` (endpoint /io_stats di agent_api, solo
+admin, con il dettaglio per tenant) e, come totali in formato Prometheus, in
+`collect()` (endpoint /metrics).
+
+Simulazione (attesa del tenant poco attivo con coda FIFO e con coda equa):
+    python admission.py
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from io_executor import LatencyHistogram, analysis_executor
+from metrics import histogram_samples
+
+ADMISSION_RATE = float(os.getenv("ADMISSION_RATE", "0.5"))
+ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", "20"))
+ADMISSION_CAPACITY = int(os.getenv("ADMISSION_CAPACITY", str(analysis_executor.max_workers)))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", str(max(ADMISSION_CAPACITY // 2, 1))))
+ADMISSION_TARGET_WAIT = float(os.getenv("ADMISSION_TARGET_WAIT", "60"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "200"))
+ADMISSION_WEIGHTS = os.getenv("ADMISSION_WEIGHTS", "")
+
+# Peso della nuova osservazione nella media mobile della durata di un'analisi
+_SERVICE_SMOOTHING = 0.2
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """ "a=2,b=0.5" -> {"a": 2.0, "b": 0.5} (voci non valide ignorate)."""
+    weights = {}
+    for item in spec.split(","):
+        tenant, _, value = item.partition("=")
+        try:
+            weight = float(value)
+        except ValueError:
+            continue
+        if tenant.strip() and weight > 0:
+            weights[tenant.strip()] = weight
+    return weights
+
+
+class AdmissionRejected(Exception):
+    """Richiesta rifiutata (da restituire come 429 con Retry-After)."""
+
+    def __init__(self, reason: str, retry_after: float, detail: str):
+        super().__init__(detail)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.detail = detail
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(int(math.ceil(self.retry_after)), 1))
+
+
+class _Waiter:
+    __slots__ = ("start", "finish", "future")
+
+    def __init__(self, start: float, finish: float, future: asyncio.Future):
+        self.start = start
+        self.finish = finish
+        self.future = future
+
+
+class _TenantState:
+    __slots__ = ("weight", "tokens", "updated", "in_flight", "queue", "finish", "admitted", "rejected")
+
+    def __init__(self, weight: float, burst: float, now: float):
+        self.weight = weight
+        self.tokens = burst
+        self.updated = now
+        self.in_flight = 0
+        self.queue: Deque[_Waiter] = deque()
+        self.finish = 0.0  # tag di fine dell'ultima richiesta accodata
+        self.admitted = 0
+        self.rejected = 0
+
+
+class AdmissionController:
+    """
+    Posti di esecuzione delle analisi, da usare dall'event loop:
+
+        async with admission.slot(username):
+            ...
+
+    Solleva AdmissionRejected se la richiesta va rifiutata.
+    """
+
+    def __init__(self, capacity: int = ADMISSION_CAPACITY, rate: float = ADMISSION_RATE,
+                 burst: float = ADMISSION_BURST, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+                 target_wait: float = ADMISSION_TARGET_WAIT, max_queue: int = ADMISSION_MAX_QUEUE,
+                 weights: Optional[Dict[str, float]] = None):
+        self.capacity = max(capacity, 1)
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_in_flight = max(max_in_flight, 1)
+        self.target_wait = target_wait
+        self.max_queue = max_queue
+        self.weights = weights if weights is not None else parse_weights(ADMISSION_WEIGHTS)
+        self._tenants: Dict[str, _TenantState] = {}
+        self._in_flight = 0
+        self._queued = 0
+        self._virtual = 0.0  # tempo virtuale della coda equa
+        self._service: Optional[float] = None  # durata media di un'analisi (secondi)
+        self.wait_histogram = LatencyHistogram()
+        self.service_histogram = LatencyHistogram()
+        self.rejections: Counter = Counter()
+        # Lo stato cambia solo nell'event loop; il lock protegge le letture di stats() da altri thread
+        self._lock = threading.Lock()
+
+    def _tenant(self, tenant: str, now: float) -> _TenantState:
+        state = self._tenants.get(tenant)
+        if state is None:
+            state = self._tenants[tenant] = _TenantState(self.weights.get(tenant, 1.0), self.burst, now)
+        return state
+
+    def estimated_wait(self) -> float:
+        """Attesa stimata per una nuova richiesta, dalla coda attuale e dalla durata media."""
+        if self._service is None or self._in_flight < self.capacity:
+            return 0.0
+        return (self._queued + 1) * self._service / self.capacity
+
+    def _reject(self, state: _TenantState, reason: str, retry_after: float, detail: str):
+        state.rejected += 1
+        self.rejections[reason] += 1
+        raise AdmissionRejected(reason, retry_after, detail)
+
+    async def acquire(self, tenant: str):
+        now = time.monotonic()
+        with self._lock:
+            state = self._tenant(tenant, now)
+            state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+            state.updated = now
+            if state.tokens < 1.0:
+                self._reject(state, "rate", (1.0 - state.tokens) / self.rate if self.rate > 0 else 60.0,
+                             "Troppe analisi richieste per questo account, riprovare più tardi.")
+            if self._queued >= self.max_queue:
+                self._reject(state, "queue_full", self.estimated_wait() or 1.0,
+                             "Coda delle analisi piena, riprovare più tardi.")
+            expected = self.estimated_wait()
+            if expected > self.target_wait:
+                self._reject(state, "overload", expected - self.target_wait,
+                             "Servizio di analisi sovraccarico, riprovare più tardi.")
+            state.tokens -= 1.0
+
+            if not self._queued and self._in_flight < self.capacity and state.in_flight < self.max_in_flight:
+                self._grant(state)
+                self.wait_histogram.observe(0.0)
+                return
+            start = max(self._virtual, state.finish)
+            waiter = _Waiter(start, start + 1.0 / state.weight, asyncio.get_running_loop().create_future())
+            state.finish = waiter.finish
+            state.queue.append(waiter)
+            self._queued += 1
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in state.queue:
+                    # Client disconnesso mentre era in coda
+                    state.queue.remove(waiter)
+                    self._queued -= 1
+                elif not waiter.future.cancelled():
+                    # Posto assegnato ma non più usato
+                    self._release(state, None)
+                # Altrimenti _dispatch l'ha già tolto dalla coda senza assegnargli il posto
+            raise
+        self.wait_histogram.observe(time.monotonic() - now)
+
+    def _grant(self, state: _TenantState):
+        state.in_flight += 1
+        state.admitted += 1
+        self._in_flight += 1
+
+    def _dispatch(self):
+        """Assegna i posti liberi alle richieste in coda con il tag di fine più basso."""
+        while self._queued and self._in_flight < self.capacity:
+            best = None
+            for state in self._tenants.values():
+                if state.queue and state.in_flight < self.max_in_flight and (
+                        best is None or state.queue[0].finish < best.queue[0].finish):
+                    best = state
+            if best is None:
+                return
+            waiter = best.queue.popleft()
+            self._queued -= 1
+            if waiter.future.done():
+                # Cancellata ma il suo handler non è ancora stato eseguito: niente posto
+                continue
+            self._virtual = max(self._virtual, waiter.start)
+            self._grant(best)
+            waiter.future.set_result(None)
+
+    def _release(self, state: _TenantState, service: Optional[float]):
+        state.in_flight -= 1
+        self._in_flight -= 1
+        if service is not None:
+            self.service_histogram.observe(service)
+            self._service = service if self._service is None else (
+                    (1 - _SERVICE_SMOOTHING) * self._service + _SERVICE_SMOOTHING * service)
+        self._dispatch()
+
+    def release(self, tenant: str, service: Optional[float] = None):
+        with self._lock:
+            self._release(self._tenants[tenant], service)
+
+    @asynccontextmanager
+    async def slot(self, tenant: str):
+        await self.acquire(tenant)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(tenant, time.monotonic() - started)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "in_flight": self._in_flight,
+                "queued": self._queued,
+                "estimated_wait_s": round(self.estimated_wait(), 3),
+                "mean_service_s": None if self._service is None else round(self._service, 3),
+                "rejected": dict(self.rejections),
+                "queue_wait": self.wait_histogram.snapshot(),
+                "service": self.service_histogram.snapshot(),
+                "tenants": {tenant: {"in_flight": state.in_flight, "queued": len(state.queue),
+                                     "tokens": round(state.tokens, 2), "weight": state.weight,
+                                     "admitted": state.admitted, "rejected": state.rejected}
+                            for tenant, state in sorted(self._tenants.items())},
+            }
+
+    def collect(self) -> list:
+        """
+        Famiglie per /metrics (vedi metrics.register_collector). /metrics non è
+        autenticato: solo totali, il dettaglio per tenant resta in stats()
+        (/io_stats, solo admin).
+        """
+        with self._lock:
+            rejections = dict(self.rejections)
+            admitted = sum(state.admitted for state in self._tenants.values())
+            in_flight, queued, expected = self._in_flight, self._queued, self.estimated_wait()
+        return [
+            ("admission_in_flight", "gauge", "Analisi in esecuzione", [("", (), in_flight)]),
+            ("admission_queued", "gauge", "Analisi in coda", [("", (), queued)]),
+            ("admission_estimated_wait_seconds", "gauge", "Attesa stimata per una nuova analisi",
+             [("", (), expected)]),
+            ("admission_admitted_total", "counter", "Analisi ammesse", [("", (), admitted)]),
+            ("admission_rejected_total", "counter", "Analisi rifiutate (429) per motivo",
+             [("", (("reason", reason),), count) for reason, count in sorted(rejections.items())]),
+            ("admission_queue_wait_seconds", "histogram", "Attesa in coda prima dell'esecuzione",
+             histogram_samples(self.wait_histogram, ())),
+            ("admission_service_seconds", "histogram", "Durata delle analisi ammesse",
+             histogram_samples(self.service_histogram, ())),
+        ]
+
+
+# Controllore condiviso dalle richieste di analisi dello stesso processo
+admission = AdmissionController()
+
+
+# ------------------------------------------------------------------------------
+# SIMULAZIONE
+# ------------------------------------------------------------------------------
+if __name__ == "__main__":
+    import argparse
+    import statistics
+
+    parser = argparse.ArgumentParser(description="Attesa in coda del tenant poco attivo, FIFO contro coda equa")
+    parser.add_argument("--busy", type=int, default=200, help="richieste del tenant molto attivo")
+    parser.add_argument("--quiet", type=int, default=10, help="richieste del tenant poco attivo")
+    parser.add_argument("--capacity", type=int, default=8)
+    parser.add_argument("--service-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    async def scenario(fair: bool) -> dict:
+        if fair:
+            controller = AdmissionController(capacity=args.capacity, rate=0, burst=10 ** 9,
+                                             max_in_flight=args.capacity, target_wait=float("inf"),
+                                             max_queue=10 ** 9, weights={})
+        else:
+            semaphore = asyncio.Semaphore(args.capacity)
+        waits = {"busy": [], "quiet": []}
+
+        async def request(tenant: str, delay: float):
+            await asyncio.sleep(delay)
+            queued = time.monotonic()
+            if fair:
+                async with controller.slot(tenant):
+                    waits[tenant].append(time.monotonic() - queued)
+                    await asyncio.sleep(args.service_ms / 1000)
+            else:
+                async with semaphore:
+                    waits[tenant].append(time.monotonic() - queued)
+                    await asyncio.sleep(args.service_ms / 1000)
+
+        # Il tenant attivo invia tutto subito, l'altro una richiesta ogni tanto
+        spacing = args.busy * args.service_ms / 1000 / args.capacity / max(args.quiet, 1)
+        await asyncio.gather(*[request("busy", 0) for _ in range(args.busy)],
+                             *[request("quiet", 0.001 + i * spacing) for i in range(args.quiet)])
+        return {tenant: (1000 * statistics.median(w), 1000 * max(w)) for tenant, w in waits.items()}
+
+    for fair in (False, True):
+        result = asyncio.run(scenario(fair))
+        print(f"{'equa' if fair else 'FIFO':4}  " + "  ".join(
+            f"{tenant}: attesa p50 {p50:7.1f} ms, max {worst:7.1f} ms" for tenant, (p50, worst) in result.items()))
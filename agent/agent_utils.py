@@ -8,7 +8,8 @@ from langchain.chat_models import ChatOpenAI
 from langchain.schema.messages import SystemMessage, HumanMessage
 from langchain_core.messages import AIMessage
 
-from agent.prompt_getter import prompt
+from agent.prompt_getter import prompt, prompt_compact, output_schema, output_schema_compact
+from metrics import span
 
 
 # Funzione per codificare un'immagine in base64
@@ -36,7 +37,14 @@ def parse_chatbot_output(output):
         raise ValueError(f"Errore nel parsing del JSON: {e}")
 
 
-def main(base64_images, body_zone: str = "Non specificata"):
+def main(base64_images, body_zone: str = "Non specificata", compact: bool = True):
+    """
+    Analizza le immagini con GPT-4o.
+    Con compact=True il modello restituisce solo `valore` e una `descrizione`
+    breve per ogni parametro: valutazione e consigli vengono aggiunti dopo
+    dall'albero decisionale locale (agent.decision_tree), riducendo i token
+    generati e la latenza della chiamata.
+    """
     # Elenco di immagini da inviare: genera un UUID per creare una cartella di salvataggio
     request_uuid = str(uuid.uuid4())
     save_dir = os.path.join("saved_images", request_uuid)
@@ -46,6 +54,7 @@ def main(base64_images, body_zone: str = "Non specificata"):
 
     # Salva le immagini nella cartella creata
     image_paths = []
+    encoded_jpegs = []
     for i, base64_image in enumerate(base64_images):
         # Rimuove eventuali spazi o newline indesiderati dalla stringa
         base64_image = base64_image.strip().replace("\n", "")
@@ -57,19 +66,27 @@ def main(base64_images, body_zone: str = "Non specificata"):
             base64_data = base64_image
 
         try:
-            image_data = base64.b64decode(base64_data)
+            with span("llm.base64_decode"):
+                image_data = base64.b64decode(base64_data)
         except Exception as e:
             raise ValueError(f"Errore nella decodifica della stringa Base64: {e}")
 
-        image = Image.open(BytesIO(image_data))
-        # Se l'immagine ha canale alpha o è in modalità Palette, convertila in RGB
-        if image.mode in ("RGBA", "P"):
-            image = image.convert("RGB")
+        with span("llm.image_reencode"):
+            image = Image.open(BytesIO(image_data))
+            # Se l'immagine ha canale alpha o è in modalità Palette, convertila in RGB
+            if image.mode in ("RGBA", "P"):
+                image = image.convert("RGB")
+            jpeg = BytesIO()
+            image.save(jpeg, format="JPEG")
+            jpeg_data = jpeg.getvalue()
 
         # Salva l'immagine come JPEG nella cartella
         image_path = os.path.join(save_dir, f"image_{i + 1}.jpeg")
-        image.save(image_path, format="JPEG")
+        with span("llm.image_write"), open(image_path, "wb") as image_file:
+            image_file.write(jpeg_data)
         image_paths.append(image_path)
+        # JPEG già in memoria: non serve rileggerlo dal disco per la codifica Base64
+        encoded_jpegs.append(base64.b64encode(jpeg_data).decode("utf-8"))
 
     # Log dei percorsi delle immagini salvate
     print(f"Immagini salvate: {image_paths}")
@@ -79,23 +96,23 @@ def main(base64_images, body_zone: str = "Non specificata"):
         {
             "type": "image_url",
             "image_url": {
-                "url": f"data:image/jpeg;base64,{encode_image(image_path)}",
+                "url": f"data:image/jpeg;base64,{encoded_jpeg}",
                 "detail": "auto"
             }
         }
-        for image_path in image_paths
+        for encoded_jpeg in encoded_jpegs
     ]
 
     # Configurazione del modello GPT-4o
     chat = ChatOpenAI(
         model="gpt-4o",
         temperature=0.25,
-        max_tokens=2048,
+        max_tokens=900 if compact else 2048,
         openai_api_key="..."
     )
 
     # Creazione dei messaggi da inviare al modello
-    system_message = SystemMessage(content=prompt)
+    system_message = SystemMessage(content=prompt_compact if compact else prompt)
 
     human_message_1 = HumanMessage(
         content=[
@@ -144,31 +161,22 @@ def main(base64_images, body_zone: str = "Non specificata"):
 - Densità pilifera (nota: per questo indicatore dovrai dare un effettivo valore tra 0 e 100 della densita pilifera, dove 0 sono pochi peli e 100 sono molti peli)
 - Pori ostruiti
 
-Per ciascun parametro, restituisci una struttura JSON dettagliata con i seguenti campi:
-- `valore`: Un numero compreso tra 0 e 100.
-- `descrizione`: Una spiegazione chiara e contestualizzata del risultato osservato, espressa in termini puramente estetici.
-- `valutazione`: Un commento estetico generale che descriva il significato del risultato per la ricerca accademica.
-- `consigli`: Suggerimenti pratici per migliorare o mantenere lo stato estetico osservato, senza implicazioni mediche.
-
-** Inoltre per l'analisi dovrai tenere in cosniderazione che la zona del corpo analizzata è la seguente: {body_zone} **
-
-Il risultato deve essere incapsulato nella seguente struttura speciale:
-
-<attribute=analysis_result| {{ "Idratazione": {{ "valore": ..., "descrizione": "...", "valutazione_professionale": "...", "consigli": "..." }}, "Strato lipidico": {{ "valore": ..., "descrizione": "...", "valutazione_professionale": "...", "consigli": "..." }}, // Ripeti per tutti i parametri... }} | attribute=analysis_result>
-"""
+{(output_schema_compact if compact else output_schema).format(body_zone=body_zone)}"""
             },
             *encoded_images
         ]
     )
 
     # Invio della richiesta al modello tramite LangChain
-    response = chat([system_message, human_message_1, ai_message_1, human_message_2])
+    with span("llm.request"):
+        response = chat([system_message, human_message_1, ai_message_1, human_message_2])
 
     # Stampa del contenuto della risposta
     print(response.content)
 
     try:
-        parsed_result = parse_chatbot_output(response.content)
+        with span("llm.parse"):
+            parsed_result = parse_chatbot_output(response.content)
         return parsed_result
     except ValueError as e:
         print(f"Errore: {e}")
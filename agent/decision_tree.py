@@ -0,0 +1,331 @@
+"""
+Albero decisionale locale per i testi `valutazione_professionale` e `consigli`.
+
+L'albero ha tre livelli di decisione (parametro -> fascia di punteggio ->
+zona del corpo) e foglie ("item") con i testi; tipi di pelle e problematiche
+del paziente aggiungono consigli tramite regole di modifica.
+All'import l'albero viene percorso una sola volta e compilato in un indice
+(parametro, fascia, zona) -> item, così ogni analisi costa solo lookup O(1).
+
+Strumenti esposti (vedi agent/TODO.md):
+- get_item: item formattato come testo
+- get_decision_node: singolo nodo dell'albero
+- walk: cammino nell'albero per un contesto (parametro, valore, zona)
+"""
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from agent.parameters import SKIN_PARAMETERS, DENSITY_PARAMETER, as_number
+
+BANDS = ("basso", "medio", "alto")
+ZONE_GROUPS = ("viso", "corpo", "generale")
+
+# Parole chiave (senza accenti, minuscole) per ricondurre body_zone a un gruppo
+ZONE_KEYWORDS = {
+    "viso": ("viso", "volto", "fronte", "guanc", "mento", "naso", "collo", "occhi",
+             "palpebr", "labbr", "zigom", "tempi"),
+    "corpo": ("corpo", "bracc", "gamb", "cosc", "addome", "pancia", "schiena", "decollete",
+              "petto", "seno", "man", "pied", "glute", "fianc", "spall", "ascell", "inguin"),
+}
+
+# Testi base per parametro e fascia: (valutazione_professionale, consigli)
+KNOWLEDGE: Dict[str, Dict[str, Tuple[str, str]]] = {
+    "Idratazione": {
+        "basso": ("La pelle mostra segni evidenti di disidratazione, con perdita di luminosità e comfort.",
+                  "Applicare mattina e sera una crema idratante con acido ialuronico o glicerina e aumentare l'apporto di acqua."),
+        "medio": ("L'idratazione è discreta ma non ottimale; la barriera cutanea trattiene l'acqua solo in parte.",
+                  "Integrare la routine con un siero idratante e preferire detergenti delicati non schiumogeni."),
+        "alto": ("Il livello di idratazione è ottimale e la pelle appare elastica e luminosa.",
+                 "Mantenere la routine idratante attuale e proteggere la pelle da vento e sbalzi termici."),
+    },
+    "Strato lipidico": {
+        "basso": ("Il film idrolipidico appare alterato, con tendenza a secchezza e ruvidità.",
+                  "Utilizzare emollienti con ceramidi o oli vegetali e limitare i lavaggi con acqua molto calda."),
+        "medio": ("Lo strato lipidico è nella norma ma con aree di squilibrio.",
+                  "Bilanciare la routine con prodotti riequilibranti, leggeri sulle zone lucide e nutrienti su quelle secche."),
+        "alto": ("Il film idrolipidico è equilibrato e svolge bene la funzione di barriera.",
+                 "Continuare con prodotti delicati che non alterino l'equilibrio lipidico."),
+    },
+    "Elasticità": {
+        "basso": ("La pelle ha perso tono ed elasticità, con linee sottili evidenti.",
+                  "Introdurre prodotti con peptidi o retinoidi delicati e valutare trattamenti tonificanti professionali."),
+        "medio": ("L'elasticità è discreta, con primi segni di rilassamento cutaneo.",
+                  "Utilizzare sieri antiossidanti (vitamina C, E) e massaggi tonificanti durante l'applicazione dei prodotti."),
+        "alto": ("La pelle è tonica ed elastica.",
+                 "Prevenire la perdita di tono con protezione solare quotidiana e una routine antiossidante."),
+    },
+    "Cheratina": {
+        "basso": ("Si osserva un ispessimento o una desquamazione dello strato corneo.",
+                  "Eseguire un'esfoliazione delicata settimanale (AHA/PHA) seguita da un'idratazione intensa."),
+        "medio": ("Lo strato corneo presenta un rinnovamento non del tutto regolare.",
+                  "Alternare esfoliazione enzimatica leggera e trattamenti lenitivi."),
+        "alto": ("Lo strato corneo è compatto e regolare.",
+                 "Mantenere il rinnovamento cellulare con esfoliazioni occasionali e delicate."),
+    },
+    "Pelle sensibile": {
+        "basso": ("La pelle appare reattiva, con arrossamenti e tendenza all'irritazione.",
+                  "Scegliere prodotti ipoallergenici senza profumo e con attivi lenitivi (niacinamide, pantenolo, centella)."),
+        "medio": ("La pelle è moderatamente sensibile e occasionalmente reattiva.",
+                  "Introdurre nuovi prodotti uno alla volta e preferire formule lenitive."),
+        "alto": ("La pelle non mostra segni di particolare sensibilità.",
+                 "Proseguire con la routine attuale, evitando comunque prodotti aggressivi."),
+    },
+    "Macchie cutanee": {
+        "basso": ("Sono presenti discromie e macchie evidenti.",
+                  "Usare ogni giorno protezione solare SPF 50 e prodotti schiarenti (vitamina C, niacinamide, acido azelaico)."),
+        "medio": ("Si notano alcune discromie di lieve entità.",
+                  "Applicare protezione solare quotidiana e un siero uniformante."),
+        "alto": ("La pelle è uniforme e priva di macchie rilevanti.",
+                 "Prevenire nuove macchie con protezione solare costante."),
+    },
+    "Tonalità": {
+        "basso": ("L'incarnato è disomogeneo e poco luminoso.",
+                  "Associare esfoliazione delicata, antiossidanti e protezione solare per uniformare il colorito."),
+        "medio": ("La tonalità è abbastanza uniforme con lievi irregolarità.",
+                  "Utilizzare un siero illuminante e mantenere una buona idratazione."),
+        "alto": ("L'incarnato è uniforme e luminoso.",
+                 "Mantenere una routine equilibrata con protezione solare."),
+    },
+    "Densità pilifera": {
+        "basso": ("La densità pilifera è bassa e la superficie appare levigata.",
+                  "Nessun trattamento specifico necessario; mantenere la pelle idratata."),
+        "medio": ("La densità pilifera è nella media.",
+                  "Valutare l'epilazione in base alle preferenze personali, preparando la pelle con un'esfoliazione leggera."),
+        "alto": ("La densità pilifera è elevata.",
+                 "Valutare un percorso di epilazione progressiva e trattamenti lenitivi post-epilazione."),
+    },
+    "Pori ostruiti": {
+        "basso": ("Sono presenti numerosi pori ostruiti e impurità.",
+                  "Detergere due volte al giorno, usare acido salicilico e una maschera purificante all'argilla settimanale."),
+        "medio": ("Alcuni pori appaiono dilatati o parzialmente ostruiti.",
+                  "Inserire una detersione profonda settimanale e prodotti non comedogenici."),
+        "alto": ("I pori sono puliti e poco visibili.",
+                 "Proseguire con una detersione regolare e prodotti non comedogenici."),
+    },
+}
+
+# Note aggiuntive per zona del corpo: (parametro, fascia) -> consiglio
+ZONE_NOTES: Dict[str, Dict[Tuple[str, str], str]] = {
+    "viso": {
+        ("Idratazione", "basso"): "Sul viso preferire texture leggere e un contorno occhi specifico.",
+        ("Pori ostruiti", "basso"): "Concentrare la detersione sulla zona T.",
+        ("Macchie cutanee", "basso"): "Evitare l'esposizione solare diretta del viso nelle ore centrali.",
+        ("Densità pilifera", "alto"): "Sul viso preferire metodi delicati come la luce pulsata.",
+    },
+    "corpo": {
+        ("Idratazione", "basso"): "Sul corpo applicare una crema o un olio subito dopo la doccia, a pelle ancora umida.",
+        ("Cheratina", "basso"): "Su gomiti, ginocchia e talloni usare creme all'urea.",
+        ("Elasticità", "basso"): "Associare massaggi drenanti e tonificanti sulle zone interessate.",
+    },
+}
+
+# Regole sul profilo del paziente: (parola chiave, parametri interessati, consiglio)
+PROFILE_RULES: List[Tuple[str, Tuple[str, ...], str]] = [
+    ("sensibil", ("Pelle sensibile", "Macchie cutanee", "Cheratina"),
+     "Trattandosi di pelle sensibile, evitare profumi, alcol ed esfolianti meccanici."),
+    ("secc", ("Idratazione", "Strato lipidico"),
+     "Per la pelle secca privilegiare formule ricche e nutrienti."),
+    ("grass", ("Strato lipidico", "Pori ostruiti"),
+     "Per la pelle grassa scegliere texture in gel non comedogeniche."),
+    ("mista", ("Strato lipidico", "Pori ostruiti"),
+     "Per la pelle mista differenziare i prodotti tra zona T e guance."),
+    ("impur", ("Pori ostruiti", "Macchie cutanee"),
+     "Data la tendenza alle impurità, non manipolare le imperfezioni."),
+    ("acne", ("Pori ostruiti", "Macchie cutanee"),
+     "Data la tendenza acneica, preferire attivi come niacinamide e acido salicilico."),
+    ("ruvid", ("Cheratina", "Idratazione"),
+     "Per la pelle ruvida alternare esfoliazione delicata e idratazione intensa."),
+    ("disidrat", ("Idratazione",),
+     "Data la disidratazione riferita, aumentare l'idratazione anche dall'interno."),
+    ("rugh", ("Elasticità",),
+     "Per le rughe, insistere con retinoidi delicati la sera e protezione solare di giorno."),
+    ("macchi", ("Macchie cutanee", "Tonalità"),
+     "Data la tendenza alle macchie, la protezione solare va usata tutto l'anno."),
+]
+
+
+# ------------------------------------------------------------------------------
+# COSTRUZIONE E COMPILAZIONE DELL'ALBERO
+# ------------------------------------------------------------------------------
+def _normalize(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def _node_id(*parts: str) -> str:
+    return "/".join(_normalize(p).replace(" ", "_") for p in parts)
+
+
+def build_tree() -> Tuple[Dict[str, dict], Dict[str, dict]]:
+    """
+    Costruisce nodi e item dell'albero a partire dalle tabelle di conoscenza.
+    Ogni nodo decisionale ha un `attributo` da testare e i `rami` verso i figli;
+    le foglie puntano a un item tramite `item`.
+    """
+    nodes: Dict[str, dict] = {"root": {"id": "root", "attributo": "parametro", "rami": {}}}
+    items: Dict[str, dict] = {}
+
+    for parameter in SKIN_PARAMETERS:
+        param_id = _node_id(parameter)
+        nodes["root"]["rami"][parameter] = param_id
+        nodes[param_id] = {"id": param_id, "attributo": "fascia", "rami": {}}
+
+        for band in BANDS:
+            band_id = _node_id(parameter, band)
+            nodes[param_id]["rami"][band] = band_id
+            nodes[band_id] = {"id": band_id, "attributo": "zona", "rami": {}}
+
+            valutazione, consigli = KNOWLEDGE[parameter][band]
+            for zone in ZONE_GROUPS:
+                note = ZONE_NOTES.get(zone, {}).get((parameter, band))
+                leaf_id = _node_id(parameter, band, zone)
+                items[leaf_id] = {
+                    "id": leaf_id,
+                    "parametro": parameter,
+                    "fascia": band,
+                    "zona": zone,
+                    "valutazione_professionale": valutazione,
+                    "consigli": f"{consigli} {note}" if note else consigli,
+                }
+                nodes[band_id]["rami"][zone] = leaf_id
+                nodes[leaf_id] = {"id": leaf_id, "item": leaf_id}
+
+    return nodes, items
+
+
+def compile_tree(nodes: Dict[str, dict]) -> Dict[Tuple[str, str, str], str]:
+    """
+    Percorre tutti i cammini radice -> foglia e produce l'indice
+    (parametro, fascia, zona) -> id item.
+    """
+    index = {}
+    for parameter, param_id in nodes["root"]["rami"].items():
+        for band, band_id in nodes[param_id]["rami"].items():
+            for zone, leaf_id in nodes[band_id]["rami"].items():
+                index[(parameter, band, zone)] = nodes[leaf_id]["item"]
+    return index
+
+
+NODES, ITEMS = build_tree()
+INDEX = compile_tree(NODES)
+
+# Regole di profilo indicizzate per parametro
+_RULES_BY_PARAMETER: Dict[str, List[Tuple[str, str]]] = {p: [] for p in SKIN_PARAMETERS}
+for _keyword, _parameters, _advice in PROFILE_RULES:
+    for _parameter in _parameters:
+        _RULES_BY_PARAMETER[_parameter].append((_keyword, _advice))
+
+
+# ------------------------------------------------------------------------------
+# STRUMENTI
+# ------------------------------------------------------------------------------
+def score_band(parameter: str, value: float) -> str:
+    """
+    Fascia del punteggio 0-100. Per la Densità pilifera "basso" indica pochi
+    peli; per gli altri parametri indica uno stato critico.
+    """
+    if value < 40:
+        return "basso"
+    if value < 70:
+        return "medio"
+    return "alto"
+
+
+def zone_group(body_zone: Optional[str]) -> str:
+    """Riconduce la body_zone libera a uno dei gruppi dell'albero."""
+    zone = _normalize(body_zone or "")
+    for group, keywords in ZONE_KEYWORDS.items():
+        if any(k in zone for k in keywords):
+            return group
+    return "generale"
+
+
+def get_decision_node(node_id: str) -> dict:
+    """Restituisce un nodo specifico dell'albero decisionale."""
+    node = NODES.get(node_id)
+    if node is None:
+        raise KeyError(f"Nodo decisionale non trovato: {node_id}")
+    return node
+
+
+def get_item(item_id: str) -> str:
+    """Restituisce l'item indicato formattato come testo."""
+    item = ITEMS.get(item_id)
+    if item is None:
+        raise KeyError(f"Item non trovato: {item_id}")
+    return (
+        f"{item['parametro']} ({item['fascia']}, zona {item['zona']})\n"
+        f"Valutazione: {item['valutazione_professionale']}\n"
+        f"Consigli: {item['consigli']}"
+    )
+
+
+def walk(parameter: str, value: float, body_zone: Optional[str] = None) -> Tuple[List[str], dict]:
+    """
+    Cammina nell'albero dal nodo radice seguendo il contesto e restituisce
+    il percorso dei nodi visitati e l'item raggiunto.
+    """
+    context = {
+        "parametro": parameter,
+        "fascia": score_band(parameter, value),
+        "zona": zone_group(body_zone),
+    }
+    path = []
+    node = NODES["root"]
+    while "item" not in node:
+        path.append(node["id"])
+        branch = context[node["attributo"]]
+        if branch not in node["rami"]:
+            raise KeyError(f"Nessun ramo '{branch}' nel nodo {node['id']}")
+        node = NODES[node["rami"][branch]]
+    path.append(node["id"])
+    return path, ITEMS[node["item"]]
+
+
+def lookup(parameter: str, value: float, body_zone: Optional[str] = None,
+           skin_types: Optional[List[str]] = None, issues: Optional[List[str]] = None) -> dict:
+    """
+    Versione compilata di `walk` (lookup O(1) sull'indice) con in più i
+    consigli derivati da tipi di pelle e problematiche del paziente.
+    Restituisce {"valutazione_professionale": ..., "consigli": ...}.
+    """
+    item = ITEMS[INDEX[(parameter, score_band(parameter, value), zone_group(body_zone))]]
+    consigli = item["consigli"]
+
+    profile = " ".join(_normalize(t) for t in (skin_types or []) + (issues or []))
+    if profile:
+        extra = [advice for keyword, advice in _RULES_BY_PARAMETER.get(parameter, []) if keyword in profile]
+        if extra:
+            consigli = " ".join([consigli, *extra])
+
+    return {"valutazione_professionale": item["valutazione_professionale"], "consigli": consigli}
+
+
+def enrich_result(result: dict, body_zone: Optional[str] = None,
+                  skin_types: Optional[List[str]] = None, issues: Optional[List[str]] = None,
+                  overwrite: bool = False) -> dict:
+    """
+    Completa un risultato di analisi con i testi dell'albero decisionale.
+    Di default riempie solo i campi mancanti (risposte compatte del modello);
+    con overwrite=True sostituisce anche quelli presenti. Punteggi numerici in
+    forma di stringa ("72") vengono letti come numeri (la conversione del
+    valore salvato resta alla normalizzazione).
+    """
+    for parameter in SKIN_PARAMETERS:
+        entry = result.get(parameter)
+        value = as_number(entry.get("valore")) if isinstance(entry, dict) else None
+        if value is None:
+            continue
+        texts = lookup(parameter, value, body_zone, skin_types, issues)
+        for field, text in texts.items():
+            if overwrite or not entry.get(field):
+                entry[field] = text
+    return result
+
+
+if __name__ == "__main__":
+    path, item = walk(DENSITY_PARAMETER, 82, "Gambe")
+    print(" -> ".join(path))
+    print(get_item(item["id"]))
+    print(lookup("Idratazione", 25, "Viso", ["Pelle secca"], ["Ruvida"]))
+    print(f"{len(NODES)} nodi, {len(ITEMS)} item, {len(INDEX)} voci nell'indice")
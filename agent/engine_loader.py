@@ -0,0 +1,136 @@
+"""
+Caricamento differito dei motori di analisi.
+
+agent.agent_utils (LangChain, OpenAI, PIL) e agent.local_scorer (OpenCV)
+sono pesanti da importare: vengono caricati al primo uso oppure da un
+warm-up in background avviato dopo l'avvio del server, così il processo è
+subito pronto a servire gli endpoint che non li usano (admin, trend, ...).
+
+Report dei tempi di import (python -X importtime) con e senza caricamento
+differito:
+    python -m agent.engine_loader --importtime
+"""
+import importlib
+import threading
+import time
+from types import ModuleType
+from typing import Dict, Optional
+
+
+class LazyEngine:
+    """Modulo importato al primo `load()`; tiene traccia di stato e durata del caricamento."""
+
+    def __init__(self, module_name: str):
+        self.module_name = module_name
+        self.status = "cold"  # cold | loading | warm | error
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self._module: Optional[ModuleType] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> ModuleType:
+        """Modulo caricato (import alla prima chiamata, sotto lock). Rilancia l'errore di import."""
+        if self._module is not None:
+            return self._module
+        with self._lock:
+            if self._module is None:
+                self.status = "loading"
+                start = time.perf_counter()
+                try:
+                    module = importlib.import_module(self.module_name)
+                except Exception as e:
+                    self.status = "error"
+                    self.error = f"{type(e).__name__}: {e}"
+                    raise
+                self.load_seconds = round(time.perf_counter() - start, 3)
+                self.error = None
+                self.status = "warm"
+                self._module = module
+        return self._module
+
+    def state(self) -> dict:
+        return {"module": self.module_name, "status": self.status, "load_seconds": self.load_seconds,
+                "error": self.error}
+
+
+class EngineRegistry:
+    def __init__(self, modules: Dict[str, str]):
+        self.engines = {name: LazyEngine(module) for name, module in modules.items()}
+        self._warmup: Optional[threading.Thread] = None
+
+    def __getitem__(self, name: str) -> LazyEngine:
+        return self.engines[name]
+
+    def warm_up(self):
+        """Importa tutti i motori (gli errori restano nello stato del motore)."""
+        for engine in self.engines.values():
+            try:
+                engine.load()
+            except Exception as e:
+                print(f"Warm-up del motore {engine.module_name} non riuscito: {e}")
+
+    def warm_up_in_background(self) -> threading.Thread:
+        if self._warmup is None:
+            self._warmup = threading.Thread(target=self.warm_up, name="analysis-engine-warmup", daemon=True)
+            self._warmup.start()
+        return self._warmup
+
+    @property
+    def warm(self) -> bool:
+        return all(engine.status == "warm" for engine in self.engines.values())
+
+    def state(self) -> dict:
+        return {name: engine.state() for name, engine in self.engines.items()}
+
+
+# ------------------------------------------------------------------------------
+# REPORT TEMPI DI IMPORT
+# ------------------------------------------------------------------------------
+def _importtime(statement: str, cwd: str) -> dict:
+    """Esegue `statement` con -X importtime e riassume i moduli di primo livello."""
+    import subprocess
+    import sys
+
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], cwd=cwd,
+                             capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    top_level, direct = [], []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, package = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Profondità dall'indentazione: 0 = import dello statement, 1 = loro import diretti
+        depth = (len(package) - len(package.lstrip()) - 1) // 2
+        if depth == 0:
+            top_level.append((int(cumulative), package.strip()))
+        elif depth == 1:
+            direct.append((int(cumulative), package.strip()))
+    errors = [line for line in process.stderr.splitlines() if not line.startswith("import time:")]
+    return {"ok": process.returncode == 0, "wall": wall, "imports_us": sum(c for c, _ in top_level),
+            "top": sorted(top_level + direct, reverse=True)[:12], "error": errors[-1] if errors else None}
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Caricamento differito dei motori di analisi")
+    parser.add_argument("--importtime", action="store_true", help="confronta i tempi di import di agent_api")
+    args = parser.parse_args()
+
+    if args.importtime:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        scenarios = {
+            "agent_api (motori differiti)": "import agent_api",
+            "agent_api + motori (import immediato)": "import agent_api, agent.local_scorer, agent.agent_utils",
+        }
+        for name, statement in scenarios.items():
+            report = _importtime(statement, root)
+            print(f"\n{name}: {statement}")
+            print(f"  processo {report['wall']:.2f} s, import {report['imports_us'] / 1e6:.2f} s"
+                  + ("" if report["ok"] else f"  [errore: {report['error']}]"))
+            for cumulative, package in report["top"]:
+                print(f"  {cumulative / 1e6:8.3f} s  {package}")
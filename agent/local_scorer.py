@@ -0,0 +1,246 @@
+"""
+Motore di scoring locale basato su NumPy/OpenCV.
+
+Calcola in batch alcune feature d'immagine sulle foto decodificate e le
+converte nei nove parametri dell'analisi, con la stessa struttura prodotta
+dal modello (valore / descrizione / valutazione_professionale / consigli).
+Serve come fallback quando il modello remoto non risponde e come pre-compilazione
+immediata dei valori lato dashboard.
+"""
+import base64
+from typing import List
+
+import cv2
+import numpy as np
+
+from agent.decision_tree import lookup
+from agent.parameters import SKIN_PARAMETERS
+
+# Lato (in pixel) a cui vengono ridimensionate le immagini prima del calcolo:
+# tutte le feature sono frazioni o medie, quindi indipendenti dalla risoluzione.
+ANALYSIS_SIZE = 256
+
+# Nome della feature misurata per ciascun parametro (usato nelle descrizioni)
+FEATURE_LABELS = {
+    "Idratazione": "rugosità della micro-texture",
+    "Strato lipidico": "riflessi speculari",
+    "Elasticità": "intensità delle linee d'espressione",
+    "Cheratina": "micro-desquamazione",
+    "Pelle sensibile": "arrossamento medio",
+    "Macchie cutanee": "densità di macchie scure",
+    "Tonalità": "uniformità cromatica",
+    "Densità pilifera": "densità di bordi sottili (peli)",
+    "Pori ostruiti": "densità di punti scuri puntiformi",
+}
+
+# ------------------------------------------------------------------------------
+# DECODIFICA
+# ------------------------------------------------------------------------------
+def decode_base64_images(base64_images: List[str]) -> List[np.ndarray]:
+    """
+    Decodifica le immagini Base64 (con o senza prefisso "data:") in array BGR.
+    Immagini con canale alpha o palette vengono convertite in 3 canali.
+    """
+    images = []
+    for i, base64_image in enumerate(base64_images):
+        base64_image = base64_image.strip().replace("\n", "")
+        if base64_image.startswith("data:"):
+            base64_image = base64_image.split(",", 1)[1]
+
+        try:
+            image_data = base64.b64decode(base64_image)
+        except Exception as e:
+            raise ValueError(f"Errore nella decodifica della stringa Base64: {e}")
+
+        buffer = np.frombuffer(image_data, dtype=np.uint8)
+        # Le feature lavorano a ANALYSIS_SIZE: per le foto grandi la decodifica
+        # ridotta (1/4, nativa per JPEG) evita di decomprimere pixel inutili.
+        image = cv2.imdecode(buffer, cv2.IMREAD_REDUCED_COLOR_4)
+        if image is None or min(image.shape[:2]) < ANALYSIS_SIZE:
+            image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"Immagine {i + 1} non decodificabile.")
+        images.append(image)
+    return images
+
+
+def prepare_batch(images: List[np.ndarray], size: int = ANALYSIS_SIZE) -> np.ndarray:
+    """
+    Ridimensiona le immagini alla stessa risoluzione e le impila in un
+    unico array (N, size, size, 3) uint8.
+    """
+    if not images:
+        raise ValueError("Nessuna immagine da analizzare.")
+    return np.stack([cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA) for img in images])
+
+
+# ------------------------------------------------------------------------------
+# FEATURE
+# ------------------------------------------------------------------------------
+def _convert_batch(batch: np.ndarray, code: int) -> np.ndarray:
+    """
+    Conversione di spazio colore sull'intero batch in una sola chiamata:
+    le conversioni sono per-pixel, quindi il batch viene visto come
+    un'unica immagine "alta" (N*H, W, 3).
+    """
+    n, h, w, c = batch.shape
+    return cv2.cvtColor(batch.reshape(n * h, w, c), code).reshape(n, h, w, -1)
+
+
+def extract_features(batch: np.ndarray) -> np.ndarray:
+    """
+    Calcola la matrice di feature (N, 9) nell'ordine di SKIN_PARAMETERS.
+
+    Le statistiche per-pixel (colore, riflessi, arrossamento) sono calcolate
+    in modo vettoriale sull'intero batch; i filtri spaziali (blur, Canny,
+    morfologia) restano per immagine per non mescolare i bordi.
+    """
+    n = batch.shape[0]
+    lab = _convert_batch(batch, cv2.COLOR_BGR2LAB).astype(np.float32)
+    hsv = _convert_batch(batch, cv2.COLOR_BGR2HSV)
+
+    lightness = lab[..., 0]
+    chroma = lab[..., 1:3].reshape(n, -1, 2)
+
+    # Tonalità: deviazione standard media dei canali a*/b*
+    color_std = chroma.std(axis=1).mean(axis=1)
+    # Pelle sensibile: arrossamento medio (a* centrato su 128)
+    redness = lab[..., 1].reshape(n, -1).mean(axis=1) - 128.0
+    # Strato lipidico: pixel molto luminosi e poco saturi
+    specular = ((hsv[..., 2] > 230) & (hsv[..., 1] < 40)).reshape(n, -1).mean(axis=1)
+
+    texture = np.empty(n, dtype=np.float32)
+    wrinkles = np.empty(n, dtype=np.float32)
+    flakes = np.empty(n, dtype=np.float32)
+    dark_spots = np.empty(n, dtype=np.float32)
+    edges = np.empty(n, dtype=np.float32)
+    pores = np.empty(n, dtype=np.float32)
+
+    kernel_small = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    for i in range(n):
+        l_chan = lightness[i]
+        gray = l_chan.astype(np.uint8)
+        texture[i] = cv2.Laplacian(l_chan, cv2.CV_32F).var()
+
+        smooth = cv2.GaussianBlur(l_chan, (0, 0), 2.0)
+        gx = cv2.Sobel(smooth, cv2.CV_32F, 1, 0)
+        gy = cv2.Sobel(smooth, cv2.CV_32F, 0, 1)
+        wrinkles[i] = cv2.magnitude(gx, gy).mean()
+
+        background = cv2.GaussianBlur(l_chan, (0, 0), 8.0)
+        dark_spots[i] = ((background - l_chan) > 15).mean()
+
+        flakes[i] = (cv2.morphologyEx(gray, cv2.MORPH_TOPHAT, kernel_small) > 20).mean()
+        pores[i] = (cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, kernel_small) > 12).mean()
+        edges[i] = (cv2.Canny(gray, 50, 150) > 0).mean()
+
+    return np.stack([
+        texture, specular, wrinkles, flakes, redness,
+        dark_spots, color_std, edges, pores,
+    ], axis=1).astype(np.float64)
+
+
+def features_to_scores(features: np.ndarray) -> np.ndarray:
+    """
+    Converte le feature (N, 9) in punteggi 0-100 (N, 9) con trasformazioni
+    vettoriali. Per tutti i parametri 100 = stato ottimale, tranne la
+    Densità pilifera che è una misura diretta.
+    """
+    f = np.asarray(features, dtype=np.float64)
+    scores = np.empty_like(f)
+
+    scores[:, 0] = 100 - np.clip((np.log10(f[:, 0] + 1) - 1.0) * 60, 0, 100)
+    # Strato lipidico: ottimo intorno al 2% di riflessi (gaussiana in scala log)
+    scores[:, 1] = 100 * np.exp(-((np.log10(f[:, 1] + 1e-4) - np.log10(0.02)) ** 2) / (2 * 0.5 ** 2))
+    scores[:, 2] = 100 - np.clip((f[:, 2] - 2.0) * 8, 0, 100)
+    scores[:, 3] = 100 * (1 - np.clip(f[:, 3] / 0.10, 0, 1))
+    scores[:, 4] = 100 - np.clip((f[:, 4] - 10.0) * 5, 0, 100)
+    scores[:, 5] = 100 * (1 - np.clip(f[:, 5] / 0.15, 0, 1))
+    scores[:, 6] = 100 - np.clip((f[:, 6] - 2.0) * 6, 0, 100)
+    scores[:, 7] = 100 * np.clip(f[:, 7] / 0.12, 0, 1)
+    scores[:, 8] = 100 * (1 - np.clip(f[:, 8] / 0.08, 0, 1))
+
+    return np.clip(np.rint(scores), 0, 100)
+
+
+# ------------------------------------------------------------------------------
+# RISULTATO
+# ------------------------------------------------------------------------------
+def build_result(scores: np.ndarray, features: np.ndarray, body_zone: str = "Non specificata") -> dict:
+    """
+    Costruisce il dizionario dei nove parametri a partire dai punteggi
+    medi del batch, nella stessa forma restituita dal modello; i testi
+    provengono dall'albero decisionale locale.
+    """
+    result = {}
+    for idx, name in enumerate(SKIN_PARAMETERS):
+        value = int(scores[idx])
+        result[name] = {
+            "valore": value,
+            "descrizione": f"Stima locale basata su {FEATURE_LABELS[name]} ({features[idx]:.4g}).",
+            **lookup(name, value, body_zone),
+        }
+    return result
+
+
+def score_images(base64_images: List[str], body_zone: str = "Non specificata") -> dict:
+    """
+    Analisi locale completa: decodifica, feature in batch, punteggi.
+    Il risultato è la media sulle immagini fornite ed è marcato con
+    `engine = "locale"`, la stessa chiave con cui agent_api riporta il motore usato.
+    """
+    batch = prepare_batch(decode_base64_images(base64_images))
+    features = extract_features(batch)
+    scores = features_to_scores(features)
+
+    result = build_result(scores.mean(axis=0), features.mean(axis=0), body_zone)
+    result["body_zone"] = body_zone
+    result["engine"] = "locale"
+    return result
+
+
+# ------------------------------------------------------------------------------
+# BENCHMARK
+# ------------------------------------------------------------------------------
+def _synthetic_image(rng: np.random.Generator, width: int = 1280, height: int = 960) -> str:
+    base = np.empty((height, width, 3), dtype=np.uint8)
+    base[:] = rng.integers(120, 200, size=3, dtype=np.uint8)
+    noise = rng.normal(0, 8, size=base.shape)
+    image = np.clip(base + noise, 0, 255).astype(np.uint8)
+    for _ in range(60):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.circle(image, center, int(rng.integers(2, 12)), (60, 50, 70), -1)
+    ok, encoded = cv2.imencode(".jpg", image)
+    return "data:image/jpeg;base64," + base64.b64encode(encoded.tobytes()).decode("utf-8")
+
+
+if __name__ == "__main__":
+    import time
+
+    # Un solo thread OpenCV: il risultato è il throughput per core
+    cv2.setNumThreads(1)
+    rng = np.random.default_rng(0)
+    images = [_synthetic_image(rng) for _ in range(3)]
+
+    score_images(images)  # warm-up
+    runs = 30
+    decode_time = feature_time = 0.0
+    start = time.perf_counter()
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        batch = prepare_batch(decode_base64_images(images))
+        t1 = time.perf_counter()
+        features = extract_features(batch)
+        build_result(features_to_scores(features).mean(axis=0), features.mean(axis=0))
+        t2 = time.perf_counter()
+        decode_time += t1 - t0
+        feature_time += t2 - t1
+    elapsed = time.perf_counter() - start
+
+    print(f"Analisi locali: {runs} x {len(images)} immagini 1280x960")
+    print(f"  decodifica + resize : {decode_time / runs * 1000:.1f} ms/analisi")
+    print(f"  feature + punteggi  : {feature_time / runs * 1000:.1f} ms/analisi")
+    print(f"  totale              : {elapsed / runs * 1000:.1f} ms/analisi")
+    print(f"  throughput per core : {runs / elapsed:.1f} analisi/s "
+          f"({runs * len(images) / elapsed:.1f} immagini/s)")
+    print(score_images(images)["Tonalità"])
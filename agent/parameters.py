@@ -0,0 +1,37 @@
+"""
+Parametri cutanei restituiti da ogni analisi, nell'ordine usato dal prompt
+e dai risultati salvati in `analysis_history`.
+"""
+import math
+from typing import Optional
+
+SKIN_PARAMETERS = [
+    "Idratazione",
+    "Strato lipidico",
+    "Elasticità",
+    "Cheratina",
+    "Pelle sensibile",
+    "Macchie cutanee",
+    "Tonalità",
+    "Densità pilifera",
+    "Pori ostruiti",
+]
+
+# Unico parametro in cui il valore non è "100 = ottimale" ma una misura
+# diretta (0 = pochi peli, 100 = molti peli).
+DENSITY_PARAMETER = "Densità pilifera"
+
+
+def as_number(value) -> Optional[float]:
+    """Numero da un valore del modello (anche stringa, con virgola decimale); None se non numerico."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value if math.isfinite(value) else None
+    if isinstance(value, str):
+        try:
+            number = float(value.strip().replace(",", "."))
+        except ValueError:
+            return None
+        return number if math.isfinite(number) else None
+    return None
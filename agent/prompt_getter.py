@@ -1,4 +1,4 @@
-prompt = """
+prompt_header = """
 Sei un agente specializzato nella classificazione di dati, ti saranno fonrnite foto generate sintenticamente per lo sviluppo di un dataset per un progetto di ricerca universitario, il dataset non sarà usato in campo medico ed ha il solo scopo dimsotrativo, ho bisogno di un parere qualitativo e non medico su vari aspetti della pelle, cosi da usare tale parere come etichetta per il dato. Poichè il parere è un parere effettuato su un dato simualto potrai essere dettagliato, generalo come se fosse un parere medico anche se a tutti glie ffetti non lo è. Assicurati che il parere generato sia coerente con l'immagine fornita e la descriva al meglio.
 
             Devi valutare le immagini in base ai seguenti parametri, ciascuno misurato su una scala da 0 a 100 (dove 0 rappresenta un valore critico o anomalo e 100 rappresenta lo stato ottimale estetico):
@@ -13,7 +13,10 @@ Sei un agente specializzato nella classificazione di dati, ti saranno fonrnite f
 - Densità pilifera (nota: per questo indicatore dovrai dare un effettivo valore tra 0 e 100 della densita pilifera, dove 0 sono pochi peli e 100 sono molti peli)
 - Pori ostruiti
 
-Per ciascun parametro, restituisci una struttura JSON dettagliata con i seguenti campi:
+"""
+
+# Schema completo: il modello genera anche valutazione e consigli
+output_schema = """Per ciascun parametro, restituisci una struttura JSON dettagliata con i seguenti campi:
 - `valore`: Un numero compreso tra 0 e 100.
 - `descrizione`: Una spiegazione chiara e contestualizzata del risultato osservato, espressa in termini puramente estetici.
 - `valutazione`: Un commento estetico generale che descriva il significato del risultato per la ricerca accademica.
@@ -24,10 +27,29 @@ Per ciascun parametro, restituisci una struttura JSON dettagliata con i seguenti
 Il risultato deve essere incapsulato nella seguente struttura speciale:
 
 <attribute=analysis_result| {{ "Idratazione": {{ "valore": ..., "descrizione": "...", "valutazione_professionale": "...", "consigli": "..." }}, "Strato lipidico": {{ "valore": ..., "descrizione": "...", "valutazione_professionale": "...", "consigli": "..." }}, // Ripeti per tutti i parametri... }} | attribute=analysis_result>
+"""
 
+# Schema compatto: valutazione e consigli sono prodotti dall'albero decisionale locale
+output_schema_compact = """Per ciascun parametro, restituisci una struttura JSON con i soli seguenti campi:
+- `valore`: Un numero compreso tra 0 e 100.
+- `descrizione`: Una descrizione breve (massimo una frase) del risultato osservato, in termini puramente estetici.
+
+NON generare valutazioni né consigli: verranno aggiunti automaticamente.
+
+** Inoltre per l'analisi dovrai tenere in cosniderazione che la zona del corpo analizzata è la seguente: {body_zone} **
+
+Il risultato deve essere incapsulato nella seguente struttura speciale:
+
+<attribute=analysis_result| {{ "Idratazione": {{ "valore": ..., "descrizione": "..." }}, "Strato lipidico": {{ "valore": ..., "descrizione": "..." }}, // Ripeti per tutti i parametri... }} | attribute=analysis_result>
+"""
+
+prompt_footer = """
 NOTA IMPORTANTE!!!: DEVI CERCARE SEMPRE DI RESTITUIRE UN OUTPUT IN FORMATO COME APPENA DESCRITTO, SE NON SEI IN GRADO DI FORNIRE VALORI REALI (AD ES IMMAGINI NON NITIDE E SFOCATE O IN GENERALE NON VALUTABILI / ACCETABILI) ALLORA CREA VALORI FITTIZI E RESTITUISCI COMUQNUE STRUTTURA DI OUTPUT (SE POSSIBILE RENDI TALI VALORI FITTIZI / IPOTETICI VICINI IL PIU POSSIBILE ALLA REALTà. LA RPIORITà E DARE SEMPRE UN RISULTATO STRUTTURATO COME CHIESTO!
 """
 
+prompt = prompt_header + output_schema + prompt_footer
+prompt_compact = prompt_header + output_schema_compact + prompt_footer
+
 
 def get_prompt():
     return prompt.replace("{", "{{").replace("}", "}}")
@@ -1,20 +1,38 @@
-import json
+import io
 import os
 from datetime import datetime
 
-import bcrypt
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
-from typing import List, Any
-
-from agent.agent_utils import main  # Importiamo la funzione `main` dallo script precedente
-from utils import verify_credentials  # Funzione di verifica credenziali (non mostrata qui)
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from admission import AdmissionRejected, admission
+from agent.decision_tree import enrich_result  # Testi valutazione/consigli dall'albero decisionale
+from agent.engine_loader import EngineRegistry
+from agent.parameters import DENSITY_PARAMETER, SKIN_PARAMETERS, as_number
+from analysis_index import (SessionIndex, PatientSeriesIndex, HistoryTimelineIndex, compute_trends,
+                            decode_cursor, score_matrix, renormalize_min_shift)
+from change_log import change_log
+from idempotency import IdempotencyMiddleware
+from io_executor import analysis_executor, io_executor, io_stats, loop_lag
+from metrics import inc, instrument_app, instrument_storage, register_collector, span
+from patient_search import search_index
+from score_store import ScoreStore
+from storage import get_storage
+from utils import verify_credentials, verify_admin_credentials
 
 app = FastAPI(
     root_path="/api2"
 )
 
+# Idempotency-Key su /analyze_skin e sulle altre richieste di modifica: una ripetizione
+# restituisce la risposta salvata senza rieseguire l'analisi (interno a CORS)
+app.add_middleware(IdempotencyMiddleware)
+
 # Configurazione CORS aperto
 app.add_middleware(
     CORSMiddleware,
@@ -23,6 +41,31 @@ app.add_middleware(
     allow_methods=["*"],  # Permette tutti i metodi (GET, POST, ecc.)
     allow_headers=["*"],  # Permette tutti gli header
 )
+# Metriche delle richieste e GET /metrics (METRICS_ENABLED=0 per disattivarle)
+instrument_app(app, "agent")
+
+# Persistenza condivisa con gli altri servizi (backend scelto con STORAGE_BACKEND),
+# con i tempi delle chiamate nelle metriche (stage "storage.<metodo>")
+storage = instrument_storage(get_storage())
+
+# Motori di analisi caricati al primo uso o dal warm-up in background dopo
+# l'avvio (ANALYSIS_WARMUP=0 per caricarli solo alla prima analisi):
+# - llm: agent.agent_utils (LangChain / OpenAI / PIL), funzione `main`
+# - locale: agent.local_scorer (NumPy / OpenCV), fallback e pre-compilazione
+engines = EngineRegistry({"llm": "agent.agent_utils", "locale": "agent.local_scorer"})
+ANALYSIS_WARMUP = os.getenv("ANALYSIS_WARMUP", "1") == "1"
+
+
+@app.on_event("startup")
+def warm_up_engines():
+    loop_lag.start()
+    if ANALYSIS_WARMUP:
+        engines.warm_up_in_background()
+
+
+def score_images(images: List[str], body_zone: str) -> dict:
+    with span("local.score"):
+        return engines["locale"].load().score_images(images, body_zone)
 
 
 # ------------------------------------------------------------------------------
@@ -33,10 +76,29 @@ class AnalysisRequest(BaseModel):
     Modello per la richiesta di analisi:
     - patient_id: ID del paziente
     - images: lista di immagini in Base64
+    - engine: "llm" (modello remoto) oppure "locale" (scoring NumPy/OpenCV)
+    - fallback_locale: se il modello remoto fallisce, usa lo scoring locale
+      (solo su richiesta: il motore usato è in result["engine"] e
+      nell'header X-Analysis-Engine)
+    - testi_locali: il modello restituisce solo valori e descrizioni brevi,
+      valutazione e consigli arrivano dall'albero decisionale locale
+    - session_id: identificativo opzionale della sessione di analisi
     """
     patient_id: str
     body_zone: str = "Non specificata"
     images: List[str]  # Lista di immagini in formato Base64
+    engine: str = "llm"
+    fallback_locale: bool = False
+    testi_locali: bool = True
+    session_id: str | None = None
+
+
+class PrefillRequest(BaseModel):
+    """
+    Modello per la pre-compilazione locale (nessun salvataggio nello storico).
+    """
+    body_zone: str = "Non specificata"
+    images: List[str]
 
 
 class AnalysisResult(BaseModel):
@@ -50,178 +112,340 @@ class AnalysisResult(BaseModel):
 # ------------------------------------------------------------------------------
 # FUNZIONI UTILI
 # ------------------------------------------------------------------------------
-def get_user_anagrafiche_file(username: str) -> str:
-    """
-    Restituisce il percorso del file anagrafiche per lo user specificato:
-    user_data/<username>/anagrafiche.json
-    """
-    user_folder = os.path.join("user_data", username)
-    if not os.path.exists(user_folder):
-        os.makedirs(user_folder)
-    return os.path.join(user_folder, "anagrafiche.json")
-
-
 def load_user_anagrafiche(username: str) -> List[dict]:
     """
-    Carica e restituisce l'elenco dei pazienti (anagrafiche)
-    dal file user_data/<username>/anagrafiche.json.
-    Se il file non esiste o non è leggibile, ritorna una lista vuota.
+    Carica e restituisce l'elenco dei pazienti (anagrafiche) dell'utente.
+    Se l'utente non ha anagrafiche, ritorna una lista vuota.
     """
-    anagrafiche_path = get_user_anagrafiche_file(username)
-    if not os.path.isfile(anagrafiche_path):
-        return []
-    try:
-        with open(anagrafiche_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
+    return storage.load_patients(username)
 
 
-def save_user_anagrafiche(username: str, data: List[dict]):
+def paginate_timeline(timeline, page: int, page_size: int, cursor: Optional[str]) -> dict:
     """
-    Salva l'elenco di pazienti (anagrafiche) nel file
-    user_data/<username>/anagrafiche.json.
+    Pagina dello storico in ordine di timestamp decrescente.
+    Con `cursor` usa la paginazione keyset (il cursore è `next_cursor` della
+    pagina precedente), altrimenti il numero di pagina come in paginate_items.
     """
-    anagrafiche_path = get_user_anagrafiche_file(username)
-    with open(anagrafiche_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
-
-
-def verify_admin_credentials(admin_username: str, admin_password: str):
-    if admin_username.upper() != "ADMIN":
-        raise HTTPException(status_code=403, detail="Accesso non autorizzato")
-
-    admin_file = os.path.join("users", "admin.json")
-    if not os.path.isfile(admin_file):
-        raise HTTPException(status_code=401, detail="Credenziali admin non valide")
-
-    try:
-        with open(admin_file, "r", encoding="utf-8") as f:
-            admin_data = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        raise HTTPException(status_code=401, detail="Credenziali admin non valide")
-
-    hashed_pw = admin_data.get("hashed_password", "").encode("utf-8")
-    if not bcrypt.checkpw(admin_password.encode("utf-8"), hashed_pw):
-        raise HTTPException(status_code=401, detail="Credenziali admin non valide")
-
-
-def paginate_items(items: List[Any], page: int, page_size: int) -> dict:
-    total_items = len(items)
+    total_items = len(timeline)
     total_pages = (total_items + page_size - 1) // page_size if total_items > 0 else 0
-
-    start = (page - 1) * page_size
-    end = start + page_size
+    if cursor:
+        try:
+            items, next_cursor = timeline.page_after(decode_cursor(cursor), page_size)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        page = None
+    else:
+        items, next_cursor = timeline.page_number(page, page_size)
 
     return {
         "page": page,
         "page_size": page_size,
         "total_items": total_items,
         "total_pages": total_pages,
-        "items": items[start:end]
+        "next_cursor": next_cursor,
+        "items": items,
     }
 
 
-def build_user_analysis_history(target_username: str) -> List[dict]:
-    patients_data = load_user_anagrafiche(target_username)
-    history_items = []
-
-    for patient in patients_data:
-        patient_id = patient.get("id")
-        patient_name = patient.get("nome")
-        patient_surname = patient.get("cognome")
-
-        for entry in patient.get("analysis_history", []):
-            history_items.append({
-                "nome": patient_name,
-                "cognome": patient_surname,
-                "source_user": patient.get("source_user") or target_username,
-                "patient_label": f"{(patient_name or '').strip()} {(patient_surname or '').strip()}".strip(),
-                "patient_ref": patient_id,
-                "timestamp": entry.get("timestamp"),
-                "result": entry.get("result", {}),
-            })
-
-    history_items.sort(key=lambda x: x.get("timestamp") or "", reverse=True)
-    return history_items
-
-
-def execute_main_with_retries(base64_images, body_zone: str = "Non specificata", max_retries=10):
+def normalize_result_values(result: dict) -> dict:
+    """
+    Converte ogni sotto-dict con chiave 'valore':
+    • mantiene 'valore_raw' (0-100)
+    • scrive 'valore' normalizzato 0-1 (numero float con 4 decimali)
+    Valori numerici in forma di stringa ("70", "70,5") vengono convertiti;
+    quelli non numerici restano invariati (il risultato viene comunque salvato).
+    """
+    out = {}
+    for k, v in result.items():
+        if isinstance(v, dict) and 'valore' in v:
+            raw = as_number(v.get('valore', 0))
+            if raw is None:
+                out[k] = v
+                continue
+            out[k] = {**v,
+                      'valore_raw': raw,
+                      'valore': round(min(max(raw / 100, 0), 1), 4)}
+        else:
+            out[k] = v
+    return out
+
+
+def execute_main_with_retries(base64_images, body_zone: str = "Non specificata", max_retries=10,
+                              compact: bool = True):
     """
     Esegue la funzione main (analisi delle immagini) un massimo di `max_retries` volte
     finché non restituisce un risultato valido.
     """
+    try:
+        main = engines["llm"].load().main
+    except Exception as e:
+        # Motore non installato o non importabile: inutile ritentare
+        raise ValueError(f"motore remoto non importabile: {e}")
     for attempt in range(max_retries):
         try:
             print(f"Tentativo {attempt + 1} di esecuzione della funzione main...")
-            result = main(base64_images, body_zone)
+            result = main(base64_images, body_zone, compact=compact)
             if result is not None:
+                inc("llm_attempts_total", outcome="ok")
                 return result
+            inc("llm_attempts_total", outcome="invalid")
         except Exception as e:
+            inc("llm_attempts_total", outcome="error")
             print(f"Errore durante il tentativo {attempt + 1}: {e}")
     raise ValueError("Impossibile ottenere un risultato valido dopo più tentativi.")
 
 
+def get_patient_profile(username: str, patient_id: str) -> dict:
+    """
+    Restituisce tipi di pelle e problematiche del paziente, usati dall'albero
+    decisionale per personalizzare i consigli.
+    Solleva ValueError se il paziente non esiste (prima di avviare l'analisi).
+    """
+    patient = storage.get_patient(username, patient_id)
+    if not patient:
+        raise ValueError(f"Il paziente con ID {patient_id} non esiste per l'utente {username}.")
+    return {
+        "skin_types": patient.get("skin_types") or [],
+        "issues": patient.get("issues") or [],
+    }
+
+
+def execute_analysis(request: AnalysisRequest, profile: dict) -> dict:
+    """
+    Esegue l'analisi con il motore richiesto. Con engine="llm" e
+    fallback_locale attivo, se il modello non produce un risultato valido
+    viene restituito lo scoring locale invece di un errore.
+    I testi mancanti (o tutti, per lo scoring locale) vengono completati
+    dall'albero decisionale in base a zona e profilo del paziente.
+    Il risultato riporta il motore usato ("engine") e, se lo scoring locale
+    ha sostituito il modello, "fallback": true.
+    """
+    if request.engine not in ("llm", "locale"):
+        raise HTTPException(status_code=400, detail=f"Motore di analisi non supportato: {request.engine}")
+
+    local = request.engine == "locale"
+    if not local:
+        try:
+            result = execute_main_with_retries(request.images, request.body_zone, max_retries=10,
+                                               compact=request.testi_locali)
+        except ValueError:
+            if not request.fallback_locale:
+                raise
+            local = True
+    if local:
+        result = score_images(request.images, request.body_zone)
+
+    with span("analysis.decision_tree"):
+        result = enrich_result(result, request.body_zone, profile["skin_types"], profile["issues"], overwrite=local)
+    fallback = local and request.engine != "locale"
+    result["engine"] = "locale" if local else "llm"
+    if fallback:
+        result["fallback"] = True
+    inc("analysis_results_total", engine=result["engine"], fallback=str(fallback).lower())
+    return result
+
+
 def update_patient_analysis(username: str, patient_id: str, analysis_result: dict):
     """
-    Aggiorna il file anagrafiche dell'utente `username` per aggiungere
-    il risultato di un'analisi al paziente specificato, creando o aggiornando
-    il campo `analysis_history`.
+    Aggiunge il risultato di un'analisi all'`analysis_history` del paziente
+    specificato tra le anagrafiche dell'utente `username`.
 
-    :param username: nome utente che possiede il file anagrafiche
+    :param username: nome utente che possiede le anagrafiche
     :param patient_id: ID del paziente da aggiornare
     :param analysis_result: Risultato dell'analisi da aggiungere
     """
-    # Carica i pazienti dal file dell'utente
-    patients_data = load_user_anagrafiche(username)
-
-    # Trova il paziente specificato
-    patient = next((p for p in patients_data if p.get("id") == patient_id), None)
-    if not patient:
-        raise ValueError(f"Il paziente con ID {patient_id} non esiste per l'utente {username}.")
-
-    # Aggiungi o aggiorna il campo `analysis_history`
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     analysis_entry = {"timestamp": timestamp, "result": analysis_result}
-    if "analysis_history" in patient:
-        patient["analysis_history"].append(analysis_entry)
-    else:
-        patient["analysis_history"] = [analysis_entry]
 
-    # Salva le modifiche nel file
-    save_user_anagrafiche(username, patients_data)
+    # Append e aggiornamento incrementale degli indici sotto lo stesso lock del
+    # tenant, poi registrazione della nuova versione dei dati
+    with span("analysis.history_update"), storage.tenant_lock(username):
+        appended = storage.append_analysis(username, patient_id, analysis_entry)
+        if appended is None:
+            raise ValueError(f"Il paziente con ID {patient_id} non esiste per l'utente {username}.")
+        patient_pos, patient, analysis_pos = appended
+        for index in analysis_indexes:
+            index.on_append(username, patient_pos, patient, analysis_pos, analysis_entry)
+            index.mark_synced(username)
+        # L'analisi non tocca i campi anagrafici: la ricerca pazienti resta valida
+        search_index.mark_synced(username)
+        change_log.record(username, [("analysis", patient_id, analysis_pos)])
+
+
+# Indici per-tenant aggiornati a ogni append in update_patient_analysis:
+# - session_id -> voci di analysis_history
+# - serie numeriche per paziente (trend)
+# - timeline dello storico ordinata per timestamp (paginazione admin), anche cross-tenant
+# - archivio colonnare su disco dei punteggi (statistiche admin)
+session_index = SessionIndex(storage)
+series_index = PatientSeriesIndex(storage)
+timeline_index = HistoryTimelineIndex(storage)
+score_store = ScoreStore(storage)
+analysis_indexes = [session_index, series_index, timeline_index, score_store]
+
+# Coda, attese e rifiuti del controllo di ammissione in /metrics
+register_collector(admission.collect)
+
+
+def session_entries(username: str, session_id: str, patient_id: Optional[str]) -> Tuple[List[tuple], Dict[str, dict]]:
+    """
+    Riferimenti (patient_id, posizione nello storico, voce) della sessione e
+    pazienti coinvolti, letti uno per uno dallo storage: il resto del tenant
+    non viene caricato.
+    """
+    for attempt in range(2):
+        refs = [ref for ref in session_index.refs(username, session_id) if patient_id is None or ref[2] == patient_id]
+        patients = {pid: storage.get_patient(username, pid) for pid in dict.fromkeys(ref[2] for ref in refs)}
+        group = []
+        for _, a_pos, pid in refs:
+            history = (patients[pid] or {}).get("analysis_history") or []
+            entry = history[a_pos] if a_pos < len(history) else None
+            if not isinstance(entry, dict) or (entry.get("result") or {}).get("session_id") != session_id:
+                break
+            group.append((pid, a_pos, entry))
+        else:
+            return group, patients
+        # Posizioni non più valide (dati modificati altrove): ricostruisce l'indice e riprova
+        session_index.invalidate(username)
+    raise HTTPException(status_code=409, detail="Sessione modificata durante il ricalcolo, riprovare.")
+
+
+def renormalize_session(username: str, session_id: str, patient_id: Optional[str],
+                        parametri: List[str]) -> dict:
+    """Corpo di /sessions/{session_id}/normalize_density (bloccante: va eseguito nel pool di I/O)."""
+    # Lettura, ricalcolo e salvataggio sotto il lock del tenant (nessun append perso)
+    with storage.tenant_lock(username):
+        if patient_id is not None and storage.get_patient(username, patient_id) is None:
+            raise HTTPException(status_code=404, detail="Paziente non trovato.")
+
+        # 1. seleziona tutte le analisi della sessione (dall'indice, solo i pazienti coinvolti)
+        group, _ = session_entries(username, session_id, patient_id)
+        if not group:
+            raise HTTPException(status_code=404, detail="Nessuna analisi con questo session_id.")
+
+        # 2. matrice dei valori grezzi (analisi x parametri) e minimi per colonna
+        raw = score_matrix((entry["result"] for _, _, entry in group), parametri, field="valore_raw")
+        if np.isnan(raw).all(axis=0).any():
+            raise HTTPException(status_code=400, detail="Valori grezzi mancanti per la sessione.")
+        normalized, min_raw = renormalize_min_shift(raw)
+
+        # 3. nuovi 'valore' per paziente e posizione nello storico
+        values: Dict[str, Dict[int, Dict[str, float]]] = {}
+        for row, (pid, a_pos, _) in enumerate(group):
+            values.setdefault(pid, {})[a_pos] = {name: float(normalized[row, col])
+                                                 for col, name in enumerate(parametri)
+                                                 if not np.isnan(raw[row, col])}
+
+        def patch(patient: dict) -> dict:
+            history = patient["analysis_history"]
+            for a_pos, params in values[patient["id"]].items():
+                for name, value in params.items():
+                    param = history[a_pos]["result"].get(name)
+                    if isinstance(param, dict):
+                        param["valore"] = value
+            return patient
+
+        # 4. salva solo i pazienti della sessione (i valori grezzi non cambiano:
+        #    sessioni, serie dei trend e archivio dei punteggi restano validi,
+        #    la timeline contiene i risultati e va ricostruita)
+        for pid in values:
+            storage.patch_patient(username, pid, patch)
+        session_index.mark_synced(username)
+        series_index.mark_synced(username)
+        score_store.mark_synced(username)
+        search_index.mark_synced(username)
+        timeline_index.invalidate(username)
+
+        # 5. registra le voci ricalcolate per la sincronizzazione della dashboard
+        change_log.record(username, [("analysis_update", pid, a_pos) for pid, a_pos, _ in group])
+
+    return {"message": "Sessione ricalcolata con successo",
+            "min_raw": {name: float(min_raw[col]) for col, name in enumerate(parametri)},
+            "analyses_updated": len(group)}
+
+
+def patient_trends(username: str, patient_id: str, body_zone: Optional[str], window: int, points: int) -> dict:
+    """Trend del paziente dalle serie in memoria (ricostruite dallo storage se cambiate)."""
+    tenant_series = series_index.get(username)
+    series = tenant_series.patients.get(patient_id)
+    if series is None:
+        if storage.get_patient(username, patient_id) is None:
+            raise HTTPException(status_code=404, detail="Paziente non trovato.")
+        return {"patient_id": patient_id, "analisi": 0, "parametri": {}, "per_zona": {}}
+    return {"patient_id": patient_id,
+            **compute_trends(series, tenant_series.population(exclude=patient_id), window, points, body_zone)}
+
+
+def export_scores_npz(*filters) -> bytes:
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **score_store.export(*filters))
+    return buffer.getvalue()
 
 
 # ------------------------------------------------------------------------------
 # ENDPOINT
+# Tutto il lavoro bloccante (storage, bcrypt, motori di analisi) gira nei
+# pool di io_executor: l'event loop resta libero per le altre richieste.
 # ------------------------------------------------------------------------------
+@app.get("/ready")
+def readiness(require_engine: bool = False):
+    """
+    Stato del servizio: "serving" appena l'app risponde, mentre
+    `analysis_engine` diventa "warm" quando i motori di analisi sono caricati.
+    Con require_engine=true risponde 503 finché i motori non sono pronti
+    (probe di readiness per chi deve inoltrare solo analisi).
+    """
+    states = [engine.status for engine in engines.engines.values()]
+    overall = next((s for s in ("error", "loading", "cold") if s in states), "warm")
+    body = {"status": "serving", "analysis_engine": overall, "engines": engines.state()}
+    return JSONResponse(body, status_code=503 if require_engine and overall != "warm" else 200)
+
+
 @app.post("/analyze_skin", response_model=AnalysisResult)
 async def analyze_skin(
         username: str,
         password: str,
-        request: AnalysisRequest
+        request: AnalysisRequest,
+        response: Response
 ):
     """
     Endpoint per analizzare lo stato della pelle in base a immagini Base64.
     Richiede credenziali e la request con patient_id e images in Base64.
+    Il motore che ha prodotto il risultato è nell'header X-Analysis-Engine.
     """
 
     print(request.images)
     # Verifica credenziali
-    if not verify_credentials(username, password):
+    if not await io_executor.run(verify_credentials, username, password):
         raise HTTPException(status_code=401, detail="Credenziali non valide")
 
     try:
-        # Esegui la funzione `main` con un massimo di 10 tentativi (come da codice originale)
-        result = execute_main_with_retries(request.images, request.body_zone, max_retries=10)
+        # Verifica che il paziente esista prima di avviare l'analisi
+        profile = await io_executor.run(get_patient_profile, username, request.patient_id)
+
+        # Esegui l'analisi (modello remoto con max 10 tentativi, oppure scoring locale)
+        # quando il controllo di ammissione assegna un posto al tenant
+        async with admission.slot(username):
+            result = await analysis_executor.run(execute_analysis, request, profile)
 
         result["body_zone"] = request.body_zone
+        if request.session_id:
+            result["session_id"] = request.session_id
+
+        # Normalizza 0-1 mantenendo il valore grezzo 0-100
+        result = normalize_result_values(result)
 
         # Aggiorna la storia delle analisi del paziente specificato
-        update_patient_analysis(username, request.patient_id, result)
+        await io_executor.run(update_patient_analysis, username, request.patient_id, result)
 
+        response.headers["X-Analysis-Engine"] = result["engine"]
         return {"result": result}
 
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        # Limite del tenant superato o servizio sovraccarico: il client riprova più tardi
+        raise HTTPException(status_code=429, detail=e.detail, headers={"Retry-After": e.retry_after_header})
     except FileNotFoundError as e:
         # Se l'utente non ha mai creato un file anagrafiche o manca qualche file
         raise HTTPException(status_code=500, detail=f"Errore file: {e}")
@@ -233,6 +457,71 @@ async def analyze_skin(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/analyze_skin/prefill", response_model=AnalysisResult)
+async def prefill_skin_analysis(
+        username: str,
+        password: str,
+        request: PrefillRequest
+):
+    """
+    Restituisce in pochi millisecondi una stima locale dei nove parametri,
+    utile per pre-compilare la dashboard mentre l'analisi completa è in corso.
+    Il risultato non viene salvato nello storico del paziente.
+    """
+    if not await io_executor.run(verify_credentials, username, password):
+        raise HTTPException(status_code=401, detail="Credenziali non valide")
+
+    try:
+        return {"result": await analysis_executor.run(score_images, request.images, request.body_zone)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Errore: {e}")
+
+
+@app.post("/sessions/{session_id}/normalize_density")
+async def normalize_session_density(
+        session_id: str,
+        username: str,
+        password: str,
+        patient_id: Optional[str] = None,
+        parametri: List[str] = Query(default=[DENSITY_PARAMETER]),
+):
+    """
+    Ricalcola il campo 'valore' dei parametri indicati (di default la
+    Densità pilifera) per tutte le analisi con lo stesso session_id
+    appartenenti a <username> (ed eventualmente a <patient_id>), in modo che
+    il valore minimo grezzo della sessione diventi 0 sulla scala 0-1.
+
+    Le analisi della sessione sono recuperate tramite l'indice delle sessioni
+    e la normalizzazione è calcolata con NumPy su tutti i parametri insieme.
+    """
+    if not await io_executor.run(verify_credentials, username, password):
+        raise HTTPException(status_code=401, detail="Credenziali non valide")
+
+    # Lettura, ricalcolo e salvataggio nel pool di I/O
+    return await io_executor.run(renormalize_session, username, session_id, patient_id, parametri)
+
+
+@app.get("/patients/{patient_id}/trends")
+async def get_patient_trends(
+        patient_id: str,
+        username: str,
+        password: str,
+        body_zone: Optional[str] = None,
+        window: int = Query(default=3, ge=1, le=50),
+        points: int = Query(default=30, ge=1, le=200),
+):
+    """
+    Trend e statistiche dei nove parametri per un paziente: media mobile,
+    delta dalla prima analisi, min/max, percentile rispetto al centro e
+    riepilogo per body_zone. Calcolati dalle serie numeriche in memoria,
+    senza restituire l'intero analysis_history.
+    """
+    if not await io_executor.run(verify_credentials, username, password):
+        raise HTTPException(status_code=401, detail="Credenziali non valide")
+
+    return {"data": await io_executor.run(patient_trends, username, patient_id, body_zone, window, points)}
+
+
 @app.get("/admin/users/{target_username}/analysis_history")
 async def get_user_analysis_history(
     target_username: str,
@@ -240,14 +529,16 @@ async def get_user_analysis_history(
     admin_password: str,
     page: int = Query(default=1, ge=1),
     page_size: int = Query(default=20, ge=1, le=200),
+    cursor: Optional[str] = None,
 ):
     """
     Permette all'admin di recuperare lo storico analisi di uno specifico utente con paginazione.
+    Oltre al numero di pagina è supportata la paginazione per cursore (`next_cursor`).
     """
-    verify_admin_credentials(admin_username, admin_password)
+    await io_executor.run(verify_admin_credentials, admin_username, admin_password)
 
-    history = build_user_analysis_history(target_username)
-    paginated = paginate_items(history, page, page_size)
+    timeline = await io_executor.run(timeline_index.get, target_username)
+    paginated = paginate_timeline(timeline, page, page_size, cursor)
 
     return {
         "data": {
@@ -257,6 +548,89 @@ async def get_user_analysis_history(
     }
 
 
+@app.get("/admin/analysis_history")
+async def get_all_analysis_history(
+    admin_username: str,
+    admin_password: str,
+    page: int = Query(default=1, ge=1),
+    page_size: int = Query(default=20, ge=1, le=200),
+    cursor: Optional[str] = None,
+):
+    """
+    Permette all'admin di scorrere lo storico analisi di tutti gli utenti,
+    ordinato per timestamp decrescente, con paginazione per pagina o cursore.
+    """
+    await io_executor.run(verify_admin_credentials, admin_username, admin_password)
+
+    timeline = await io_executor.run(timeline_index.get_global)
+    return {"data": paginate_timeline(timeline, page, page_size, cursor)}
+
+
+@app.get("/admin/analytics/scores")
+async def get_score_analytics(
+    admin_username: str,
+    admin_password: str,
+    group_by: List[str] = Query(default=[]),
+    parametri: List[str] = Query(default=SKIN_PARAMETERS),
+    stats: List[str] = Query(default=["count", "mean"]),
+    tenant: Optional[str] = None,
+    body_zone: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+):
+    """
+    Statistiche dei valori grezzi (0-100) su tutte le analisi di tutti i
+    centri, raggruppate per tenant, patient, body_zone, year, month e/o day.
+    `stats`: count, mean, std, min, max e percentili pNN (es. p50, p90).
+    Esempio: media Idratazione per centro e mese ->
+    ?group_by=tenant&group_by=month&parametri=Idratazione&stats=mean
+    """
+    await io_executor.run(verify_admin_credentials, admin_username, admin_password)
+
+    try:
+        data = await io_executor.run(score_store.query, parametri, group_by, stats, tenant, body_zone,
+                                     date_from, date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"data": data}
+
+
+@app.get("/admin/analytics/export")
+async def export_score_dataset(
+    admin_username: str,
+    admin_password: str,
+    tenant: Optional[str] = None,
+    body_zone: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+):
+    """
+    Esporta le colonne dei punteggi (stessi filtri delle statistiche) come
+    archivio NumPy .npz per il dataset di ricerca: codici di tenant, paziente
+    e zona, timestamp e matrice (n, 9) dei valori grezzi. I pazienti sono
+    identificati solo da un codice numerico.
+    """
+    await io_executor.run(verify_admin_credentials, admin_username, admin_password)
+
+    try:
+        content = await io_executor.run(export_scores_npz, tenant, body_zone, date_from, date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(content, media_type="application/octet-stream",
+                    headers={"Content-Disposition": 'attachment; filename="analysis_scores.npz"'})
+
+
+@app.get("/io_stats")
+async def get_io_stats(admin_username: str, admin_password: str):
+    """
+    Latenze dei pool (I/O e analisi) per operazione, ritardo dell'event loop
+    e controllo di ammissione delle analisi (coda, attese, rifiuti per tenant).
+    Solo admin: il dettaglio per tenant rivela chi sta usando il servizio.
+    """
+    await io_executor.run(verify_admin_credentials, admin_username, admin_password)
+    return {**io_stats(), "admission": admission.stats()}
+
+
 # ------------------------------------------------------------------------------
 # AVVIO SERVER
 # ------------------------------------------------------------------------------
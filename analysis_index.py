@@ -0,0 +1,502 @@
+"""
+Indici in memoria sullo storico analisi dei tenant (user_data/<username>).
+
+Ogni indice è costruito una sola volta per tenant a partire dalle
+anagrafiche e poi aggiornato in modo incrementale dagli append di
+`update_patient_analysis`. La versione dei dati del tenant fornita dallo
+storage (`Storage.tenant_version`) viene confrontata a ogni accesso: se i dati
+sono stati modificati altrove (es. patients_api) l'indice del tenant viene
+ricostruito.
+"""
+import base64
+import bisect
+import json
+import threading
+import warnings
+from datetime import datetime
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from agent.parameters import SKIN_PARAMETERS
+from storage import Storage
+
+
+class TenantIndex:
+    """
+    Base per gli indici per-tenant. Le sottoclassi implementano `_build`
+    (costruzione completa dalla lista pazienti) e i propri metodi di
+    aggiornamento incrementale.
+    """
+
+    def __init__(self, storage: Storage):
+        self._storage = storage
+        self._lock = threading.RLock()
+        self._signatures: Dict[str, Hashable] = {}
+        self._data: Dict[str, object] = {}
+
+    def _build(self, tenant: str, patients: List[dict]):
+        raise NotImplementedError
+
+    def _load(self, tenant: str) -> List[dict]:
+        """Pazienti da cui costruire l'indice (le sottoclassi possono saltare lo storico)."""
+        return self._storage.load_patients(tenant)
+
+    def _current(self, tenant: str, patients: Optional[List[dict]] = None):
+        """Restituisce i dati dell'indice per il tenant, ricostruendoli se i dati sono cambiati."""
+        signature = self._storage.tenant_version(tenant)
+        with self._lock:
+            if tenant in self._data and self._signatures.get(tenant) == signature:
+                return self._data[tenant]
+            if patients is None:
+                patients = self._load(tenant)
+            self._data[tenant] = self._build(tenant, patients)
+            self._signatures[tenant] = signature
+            return self._data[tenant]
+
+    def is_loaded(self, tenant: str) -> bool:
+        return tenant in self._data
+
+    def mark_synced(self, tenant: str):
+        """Da chiamare dopo un salvataggio già applicato all'indice in modo incrementale."""
+        with self._lock:
+            if tenant in self._data:
+                self._signatures[tenant] = self._storage.tenant_version(tenant)
+
+    def invalidate(self, tenant: Optional[str] = None):
+        with self._lock:
+            if tenant is None:
+                self._data.clear()
+                self._signatures.clear()
+            else:
+                self._data.pop(tenant, None)
+                self._signatures.pop(tenant, None)
+
+
+# ------------------------------------------------------------------------------
+# INDICE DELLE SESSIONI
+# ------------------------------------------------------------------------------
+SessionRef = Tuple[int, int, str]  # (posizione paziente, posizione analisi, patient_id)
+
+
+class SessionIndex(TenantIndex):
+    """
+    Indice session_id -> riferimenti alle voci di analysis_history.
+    I riferimenti sono posizioni nella lista pazienti e nello storico, quindi
+    una sessione si recupera in O(dimensione della sessione).
+    """
+
+    def _build(self, tenant: str, patients: List[dict]) -> Dict[str, List[SessionRef]]:
+        sessions: Dict[str, List[SessionRef]] = {}
+        for p_pos, patient in enumerate(patients):
+            for a_pos, entry in enumerate(patient.get("analysis_history") or []):
+                session_id = (entry.get("result") or {}).get("session_id")
+                if session_id:
+                    sessions.setdefault(session_id, []).append((p_pos, a_pos, patient.get("id")))
+        return sessions
+
+    def refs(self, tenant: str, session_id: str) -> List[SessionRef]:
+        """
+        Riferimenti (posizione paziente, posizione analisi, patient_id) della
+        sessione; i pazienti vengono letti solo se l'indice va ricostruito.
+        """
+        return list(self._current(tenant).get(session_id, []))
+
+    def entries(self, tenant: str, session_id: str, patients: List[dict]) -> List[Tuple[str, dict]]:
+        """
+        Coppie (patient_id, voce di analysis_history) della sessione, risolte
+        sulla lista `patients` appena caricata (le stesse istanze, modificabili in place).
+        """
+        refs = self._current(tenant, patients).get(session_id, [])
+        resolved = []
+        for p_pos, a_pos, patient_id in refs:
+            if p_pos >= len(patients) or patients[p_pos].get("id") != patient_id:
+                # Posizioni non più valide: ricostruisce una volta e riprova
+                self.invalidate(tenant)
+                return self.entries(tenant, session_id, patients)
+            resolved.append((patient_id, patients[p_pos]["analysis_history"][a_pos]))
+        return resolved
+
+    def on_append(self, tenant: str, patient_pos: int, patient: dict, analysis_pos: int, entry: dict):
+        session_id = (entry.get("result") or {}).get("session_id")
+        if not session_id:
+            return
+        with self._lock:
+            if tenant in self._data:
+                self._data[tenant].setdefault(session_id, []).append((patient_pos, analysis_pos, patient.get("id")))
+
+
+# ------------------------------------------------------------------------------
+# MATRICI DEI PUNTEGGI
+# ------------------------------------------------------------------------------
+def score_matrix(results: Iterable[dict], parameters: List[str] = SKIN_PARAMETERS,
+                 field: str = "valore_raw") -> np.ndarray:
+    """
+    Matrice (n_analisi, n_parametri) dei valori `field`; NaN dove mancanti.
+    """
+    rows = []
+    for result in results:
+        row = []
+        for name in parameters:
+            param = result.get(name)
+            value = param.get(field) if isinstance(param, dict) else None
+            row.append(float(value) if isinstance(value, (int, float)) else np.nan)
+        rows.append(row)
+    return np.array(rows, dtype=np.float64).reshape(len(rows), len(parameters))
+
+
+def renormalize_min_shift(raw: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Normalizzazione "min -> 0" su scala 0-1 per tutte le colonne insieme:
+    (raw - min) / (100 - min), con 0 se il minimo è già 100.
+    Restituisce (valori normalizzati arrotondati a 4 decimali, minimi per colonna).
+    """
+    with warnings.catch_warnings(), np.errstate(all="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)  # colonne interamente NaN
+        min_raw = np.nanmin(raw, axis=0)
+        span = 100.0 - min_raw
+        normalized = np.where(span > 0, (raw - min_raw) / np.where(span > 0, span, 1.0), 0.0)
+    return np.clip(np.round(normalized, 4), 0.0, 1.0), min_raw
+
+
+# ------------------------------------------------------------------------------
+# SERIE NUMERICHE PER PAZIENTE (TREND)
+# ------------------------------------------------------------------------------
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_timestamp(value: Optional[str]) -> float:
+    try:
+        return datetime.strptime(value, TIMESTAMP_FORMAT).timestamp()
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def raw_score_row(result: dict) -> np.ndarray:
+    """
+    Riga dei nove valori grezzi 0-100 di un risultato: `valore_raw` se
+    presente (analisi normalizzate), altrimenti `valore` (storico precedente).
+    """
+    row = np.full(len(SKIN_PARAMETERS), np.nan)
+    for col, name in enumerate(SKIN_PARAMETERS):
+        param = result.get(name)
+        if isinstance(param, dict):
+            value = param.get("valore_raw", param.get("valore"))
+            if isinstance(value, (int, float)):
+                row[col] = value
+    return row
+
+
+class PatientSeries:
+    """
+    Serie compatta delle analisi di un paziente: timestamp (epoch), zona e
+    matrice (n, 9) dei valori grezzi. Gli array crescono per raddoppio,
+    quindi l'append è O(1) ammortizzato.
+    """
+
+    def __init__(self, capacity: int = 8):
+        self.timestamps = np.full(capacity, np.nan)
+        self.values = np.full((capacity, len(SKIN_PARAMETERS)), np.nan)
+        self.zones: List[str] = []
+        self.size = 0
+
+    def append(self, timestamp: float, zone: str, row: np.ndarray):
+        if self.size == len(self.timestamps):
+            capacity = 2 * len(self.timestamps)
+            timestamps = np.full(capacity, np.nan)
+            values = np.full((capacity, len(SKIN_PARAMETERS)), np.nan)
+            timestamps[:self.size] = self.timestamps
+            values[:self.size] = self.values
+            self.timestamps, self.values = timestamps, values
+        self.timestamps[self.size] = timestamp
+        self.values[self.size] = row
+        self.zones.append(zone)
+        self.size += 1
+
+    @property
+    def latest(self) -> np.ndarray:
+        return self.values[self.size - 1]
+
+
+class TenantSeries:
+    """Serie di tutti i pazienti di un tenant e matrice di popolazione in cache."""
+
+    def __init__(self):
+        self.patients: Dict[str, PatientSeries] = {}
+        self._population: Optional[np.ndarray] = None
+        self._population_ids: List[str] = []
+
+    def append(self, patient_id: str, entry: dict):
+        result = entry.get("result") or {}
+        series = self.patients.setdefault(patient_id, PatientSeries())
+        series.append(parse_timestamp(entry.get("timestamp")),
+                      result.get("body_zone") or "Non specificata",
+                      raw_score_row(result))
+        self._population = None
+
+    def population(self, exclude: Optional[str] = None) -> np.ndarray:
+        """
+        Matrice (n_pazienti, 9) dell'ultima analisi di ciascun paziente del
+        centro, senza la riga del paziente `exclude`.
+        """
+        if self._population is None:
+            self._population_ids = [pid for pid, s in self.patients.items() if s.size]
+            rows = [self.patients[pid].latest for pid in self._population_ids]
+            self._population = np.array(rows).reshape(len(rows), len(SKIN_PARAMETERS))
+        if exclude in self._population_ids:
+            return np.delete(self._population, self._population_ids.index(exclude), axis=0)
+        return self._population
+
+
+class PatientSeriesIndex(TenantIndex):
+    """Indice per-tenant delle serie numeriche usate dall'endpoint dei trend."""
+
+    def _build(self, tenant: str, patients: List[dict]) -> TenantSeries:
+        tenant_series = TenantSeries()
+        for patient in patients:
+            history = sorted(patient.get("analysis_history") or [], key=lambda e: e.get("timestamp") or "")
+            for entry in history:
+                tenant_series.append(patient.get("id"), entry)
+        return tenant_series
+
+    def get(self, tenant: str) -> TenantSeries:
+        return self._current(tenant)
+
+    def on_append(self, tenant: str, patient_pos: int, patient: dict, analysis_pos: int, entry: dict):
+        with self._lock:
+            if tenant in self._data:
+                self._data[tenant].append(patient.get("id"), entry)
+
+
+def _moving_average(values: np.ndarray, window: int) -> np.ndarray:
+    """Media mobile per colonna che ignora i NaN (finestra troncata all'inizio)."""
+    filled = np.where(np.isnan(values), 0.0, values)
+    counts = (~np.isnan(values)).astype(np.float64)
+    csum = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(filled, axis=0)])
+    ccount = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(counts, axis=0)])
+    end = np.arange(1, values.shape[0] + 1)
+    start = np.maximum(end - window, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (csum[end] - csum[start]) / (ccount[end] - ccount[start])
+
+
+def _first_last(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    valid = ~np.isnan(values)
+    has_any = valid.any(axis=0)
+    first_idx = valid.argmax(axis=0)
+    last_idx = values.shape[0] - 1 - valid[::-1].argmax(axis=0)
+    cols = np.arange(values.shape[1])
+    first = np.where(has_any, values[first_idx, cols], np.nan)
+    last = np.where(has_any, values[last_idx, cols], np.nan)
+    return first, last
+
+
+def _round(values: np.ndarray, digits: int = 2) -> List[Optional[float]]:
+    return [None if np.isnan(v) else round(float(v), digits) for v in values]
+
+
+def _format_timestamp(value: float) -> Optional[str]:
+    return None if np.isnan(value) else datetime.fromtimestamp(value).strftime(TIMESTAMP_FORMAT)
+
+
+def compute_trends(series: PatientSeries, population: np.ndarray, window: int = 3,
+                   points: int = 30, body_zone: Optional[str] = None) -> dict:
+    """
+    Statistiche dei nove parametri per un paziente, calcolate in modo
+    vettoriale sulla sua serie: media mobile (ultimi `points` punti),
+    delta dal primo valore, min/max, percentile rispetto all'ultima analisi
+    degli altri pazienti del centro e riepilogo per body_zone.
+    """
+    timestamps = series.timestamps[:series.size]
+    values = series.values[:series.size]
+    zones = np.array(series.zones, dtype=object)
+    if body_zone is not None:
+        mask = zones == body_zone
+        timestamps, values, zones = timestamps[mask], values[mask], zones[mask]
+    if values.shape[0] == 0:
+        return {"analisi": 0, "parametri": {}, "per_zona": {}}
+
+    with warnings.catch_warnings(), np.errstate(all="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        first, last = _first_last(values)
+        minimum = np.nanmin(values, axis=0)
+        maximum = np.nanmax(values, axis=0)
+        moving = _moving_average(values, window)[-points:]
+        if population.shape[0]:
+            valid = ~np.isnan(population)
+            below = ((population < last) & valid).sum(axis=0)
+            equal = ((population == last) & valid).sum(axis=0)
+            percentile = 100.0 * (below + 0.5 * equal) / valid.sum(axis=0)
+            percentile[np.isnan(last)] = np.nan
+        else:
+            percentile = np.full(len(SKIN_PARAMETERS), np.nan)
+
+    ma_timestamps = [_format_timestamp(t) for t in timestamps[-points:]]
+    stats = {
+        "primo": _round(first),
+        "ultimo": _round(last),
+        "delta_dal_primo": _round(last - first),
+        "min": _round(minimum),
+        "max": _round(maximum),
+        "percentile_centro": _round(percentile, 1),
+    }
+    parametri = {}
+    for col, name in enumerate(SKIN_PARAMETERS):
+        parametri[name] = {key: column[col] for key, column in stats.items()}
+        parametri[name]["media_mobile"] = _round(moving[:, col])
+
+    per_zona = {}
+    for zone in dict.fromkeys(zones.tolist()):
+        zone_values = values[zones == zone]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            zone_first, zone_last = _first_last(zone_values)
+            zone_mean = np.nanmean(zone_values, axis=0)
+        per_zona[zone] = {
+            "analisi": int(zone_values.shape[0]),
+            "ultimo": dict(zip(SKIN_PARAMETERS, _round(zone_last))),
+            "media": dict(zip(SKIN_PARAMETERS, _round(zone_mean))),
+            "delta_dal_primo": dict(zip(SKIN_PARAMETERS, _round(zone_last - zone_first))),
+        }
+
+    known = timestamps[~np.isnan(timestamps)]
+    return {
+        "analisi": int(values.shape[0]),
+        "periodo": {"dal": _format_timestamp(known.min()) if known.size else None,
+                    "al": _format_timestamp(known.max()) if known.size else None},
+        "finestra_media_mobile": window,
+        "timestamps_media_mobile": ma_timestamps,
+        "parametri": parametri,
+        "per_zona": per_zona,
+    }
+
+
+# ------------------------------------------------------------------------------
+# TIMELINE DELLO STORICO (PAGINAZIONE ADMIN)
+# ------------------------------------------------------------------------------
+TimelineKey = Tuple[str, str, int]  # (timestamp, patient_id, posizione analisi)
+
+
+def history_item(patient: dict, tenant: str, entry: dict) -> dict:
+    """Voce dello storico analisi nella forma restituita agli endpoint admin."""
+    name = patient.get("nome")
+    surname = patient.get("cognome")
+    return {
+        "nome": name,
+        "cognome": surname,
+        "source_user": patient.get("source_user") or tenant,
+        "patient_label": f"{(name or '').strip()} {(surname or '').strip()}".strip(),
+        "patient_ref": patient.get("id"),
+        "timestamp": entry.get("timestamp"),
+        "result": entry.get("result", {}),
+    }
+
+
+def encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key), ensure_ascii=False).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode("ascii"))))
+    except (ValueError, TypeError):
+        raise ValueError("Cursore non valido.")
+
+
+class Timeline:
+    """
+    Lista ordinata per chiave crescente (timestamp come primo elemento) con le
+    voci già materializzate. Le pagine sono servite in ordine decrescente:
+    per cursore (keyset) o per numero di pagina, entrambe in O(page_size).
+    """
+
+    def __init__(self, pairs: Iterable[Tuple[tuple, dict]] = ()):
+        pairs = sorted(pairs, key=lambda kv: kv[0])
+        self.keys = [k for k, _ in pairs]
+        self.items = [v for _, v in pairs]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def insert(self, key: tuple, item: dict):
+        # Gli append arrivano quasi sempre in coda: bisect evita un sort completo
+        pos = bisect.bisect_right(self.keys, key)
+        self.keys.insert(pos, key)
+        self.items.insert(pos, item)
+
+    def _page(self, end: int, page_size: int) -> Tuple[List[dict], Optional[str]]:
+        end = max(end, 0)
+        start = max(end - page_size, 0)
+        next_cursor = encode_cursor(self.keys[start]) if start > 0 else None
+        return self.items[start:end][::-1], next_cursor
+
+    def page_after(self, cursor: Optional[tuple], page_size: int) -> Tuple[List[dict], Optional[str]]:
+        """Pagina delle voci precedenti (più vecchie) al cursore."""
+        if cursor is None:
+            return self._page(len(self.keys), page_size)
+        try:
+            end = bisect.bisect_left(self.keys, cursor)
+        except TypeError:
+            raise ValueError("Cursore non valido.")
+        return self._page(end, page_size)
+
+    def page_number(self, page: int, page_size: int) -> Tuple[List[dict], Optional[str]]:
+        return self._page(len(self.keys) - (page - 1) * page_size, page_size)
+
+
+class HistoryTimelineIndex(TenantIndex):
+    """
+    Indice per-tenant dello storico analisi ordinato per timestamp, più una
+    vista opzionale su tutti i tenant. Entrambi sono aggiornati negli append;
+    la vista globale viene riallineata (merge delle timeline dei tenant) solo
+    quando un tenant viene ricostruito o cambia l'elenco dei tenant.
+    """
+
+    def __init__(self, storage: Storage):
+        super().__init__(storage)
+        self._generations: Dict[str, int] = {}
+        self._global: Optional[Timeline] = None
+        self._global_generations: Dict[str, int] = {}
+
+    def _build(self, tenant: str, patients: List[dict]) -> Timeline:
+        pairs = []
+        for patient in patients:
+            for a_pos, entry in enumerate(patient.get("analysis_history") or []):
+                pairs.append(((entry.get("timestamp") or "", patient.get("id") or "", a_pos),
+                              history_item(patient, tenant, entry)))
+        return Timeline(pairs)
+
+    def _current(self, tenant: str, patients: Optional[List[dict]] = None) -> Timeline:
+        with self._lock:
+            previous = self._data.get(tenant)
+            timeline = super()._current(tenant, patients)
+            if timeline is not previous:
+                self._generations[tenant] = self._generations.get(tenant, 0) + 1
+            return timeline
+
+    def get(self, tenant: str) -> Timeline:
+        return self._current(tenant)
+
+    def get_global(self) -> Timeline:
+        tenants = self._storage.list_tenants()
+        with self._lock:
+            timelines = {tenant: self._current(tenant) for tenant in tenants}
+            generations = {tenant: self._generations[tenant] for tenant in tenants}
+            if self._global is None or generations != self._global_generations:
+                pairs = []
+                for tenant, timeline in timelines.items():
+                    pairs.extend(((k[0], tenant, k[1], k[2]), item) for k, item in zip(timeline.keys, timeline.items))
+                self._global = Timeline(pairs)
+                self._global_generations = generations
+            return self._global
+
+    def on_append(self, tenant: str, patient_pos: int, patient: dict, analysis_pos: int, entry: dict):
+        with self._lock:
+            timeline = self._data.get(tenant)
+            if timeline is None:
+                return
+            item = history_item(patient, tenant, entry)
+            key = (entry.get("timestamp") or "", patient.get("id") or "", analysis_pos)
+            timeline.insert(key, item)
+            if self._global is not None and tenant in self._global_generations:
+                self._global.insert((key[0], tenant, key[1], key[2]), item)
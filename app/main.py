@@ -1,11 +1,13 @@
+import asyncio
 import json
-import time
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List
 
+from metrics import instrument_app
+
 app = FastAPI()
 
 # CORS configuration (open for development purposes)
@@ -16,6 +18,8 @@ app.add_middleware(
     allow_methods=["*"],  # Allow all HTTP methods
     allow_headers=["*"],  # Allow all headers
 )
+# Request metrics and GET /metrics (disabled with METRICS_ENABLED=0)
+instrument_app(app, "app")
 
 class AnalysisRequest(BaseModel):
     analysis_type: str
@@ -94,7 +98,7 @@ async def analyze(request: AnalysisRequest):
     #    raise HTTPException(status_code=400, detail="Tipo di analisi non supportato.")
 
     #print(json.dumps(request.json(), indent=2))
-    time.sleep(5)
+    await asyncio.sleep(5)  # Simulated delay without blocking the event loop (shared in the gateway)
     # Simulated response
     #result = SIMULATED_RESULTS[request.analysis_type]
     return SIMULATED_RESULTS #AnalysisResponse(**result)
@@ -0,0 +1,215 @@
+"""
+Registro delle modifiche per tenant, per la sincronizzazione incrementale
+della dashboard.
+
+Ogni creazione / modifica / eliminazione di un'anagrafica (patients_api) e
+ogni analisi aggiunta o ricalcolata (agent_api) riceve un numero di sequenza
+monotono per tenant. Il client conserva l'ultimo numero visto e chiede solo
+le modifiche successive (`GET /changes?since=<seq>`): anagrafiche create o
+modificate (record completo), id eliminati e voci di analysis_history nuove.
+
+Il registro è un database SQLite in modalità WAL (CHANGE_LOG_PATH, default
+changes.db), condiviso dai processi del gateway: la sequenza resta unica anche
+con più worker. Le righe più vecchie di CHANGE_LOG_RETENTION per tenant
+vengono eliminate; un cursore più vecchio riceve `reset: true` e il client
+deve ricaricare la lista completa.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, Optional, Set, Tuple
+
+from io_executor import io_executor
+from storage import Storage
+
+CHANGE_LOG_PATH = os.getenv("CHANGE_LOG_PATH", "changes.db")
+CHANGE_LOG_RETENTION = int(os.getenv("CHANGE_LOG_RETENTION", "50000"))
+# Intervallo di controllo del registro durante l'attesa (modifiche fatte da altri processi)
+CHANGES_POLL_INTERVAL = float(os.getenv("CHANGES_POLL_INTERVAL", "0.5"))
+# Commento di keep-alive nello stream SSE quando non ci sono modifiche
+CHANGES_HEARTBEAT = float(os.getenv("CHANGES_HEARTBEAT", "15"))
+
+PATIENT_OPS = ("create", "update", "delete")
+ANALYSIS_OPS = ("analysis", "analysis_update")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    tenant TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    op TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    analysis_pos INTEGER,
+    ts TEXT NOT NULL,
+    PRIMARY KEY (tenant, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sequences (
+    tenant TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    pruned INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+Change = Tuple[str, str, Optional[int]]  # (op, patient_id, posizione in analysis_history)
+
+
+class ChangeLog:
+    """Sequenza e righe di modifica per tenant, con attesa di nuove modifiche."""
+
+    def __init__(self, path: str = CHANGE_LOG_PATH, retention: int = CHANGE_LOG_RETENTION):
+        self.path = path
+        self.retention = retention
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.RLock()
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self._waiters_lock = threading.Lock()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    # --------------------------------------------------------------------------
+    # Scrittura
+    # --------------------------------------------------------------------------
+    def record(self, tenant: str, changes: Iterable[Change]) -> int:
+        """
+        Registra le modifiche (da chiamare dopo il salvataggio, così un
+        cursore letto dal client corrisponde sempre a dati già scritti).
+        Ritorna l'ultimo numero di sequenza assegnato.
+        """
+        changes = list(changes)
+        if not changes:
+            return self.current_seq(tenant)
+        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO sequences (tenant, seq) VALUES (?, ?) "
+                         "ON CONFLICT(tenant) DO UPDATE SET seq = seq + excluded.seq", (tenant, len(changes)))
+            last, pruned = conn.execute("SELECT seq, pruned FROM sequences WHERE tenant = ?", (tenant,)).fetchone()
+            first = last - len(changes) + 1
+            conn.executemany(
+                "INSERT INTO changes (tenant, seq, op, patient_id, analysis_pos, ts) VALUES (?, ?, ?, ?, ?, ?)",
+                [(tenant, first + i, op, patient_id, pos, ts) for i, (op, patient_id, pos) in enumerate(changes)])
+            # Eliminazione delle righe oltre la soglia, a blocchi di un decimo della soglia
+            if last - pruned > self.retention + max(self.retention // 10, 1):
+                floor = last - self.retention
+                conn.execute("DELETE FROM changes WHERE tenant = ? AND seq <= ?", (tenant, floor))
+                conn.execute("UPDATE sequences SET pruned = ? WHERE tenant = ?", (floor, tenant))
+        self._notify()
+        return last
+
+    def _notify(self):
+        with self._waiters_lock:
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    # --------------------------------------------------------------------------
+    # Lettura
+    # --------------------------------------------------------------------------
+    def _state(self, tenant: str) -> Tuple[int, int]:
+        with self._lock:
+            row = self._conn.execute("SELECT seq, pruned FROM sequences WHERE tenant = ?", (tenant,)).fetchone()
+        return row if row else (0, 0)
+
+    def current_seq(self, tenant: str) -> int:
+        return self._state(tenant)[0]
+
+    def delta(self, storage: Storage, tenant: str, since: int, limit: int = 1000) -> dict:
+        """
+        Modifiche del tenant con sequenza > since (al massimo `limit` righe,
+        `more: true` se ce ne sono altre). Più modifiche dello stesso record
+        vengono compattate: conta solo lo stato attuale.
+        """
+        seq, pruned = self._state(tenant)
+        delta = {"since": since, "seq": seq, "reset": False, "more": False,
+                 "patients": [], "deleted": [], "analyses": []}
+        if since > seq or since < pruned:
+            # Cursore non più coperto dal registro (o di un registro precedente)
+            delta["reset"] = True
+            return delta
+        if since == seq:
+            return delta
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, op, patient_id, analysis_pos FROM changes WHERE tenant = ? AND seq > ? "
+                "ORDER BY seq LIMIT ?", (tenant, since, limit)).fetchall()
+        if not rows:
+            return delta
+        delta["seq"] = rows[-1][0]
+        delta["more"] = len(rows) == limit
+
+        patient_ops = {}
+        analyses = {}
+        for _, op, patient_id, pos in rows:
+            if op in PATIENT_OPS:
+                patient_ops[patient_id] = op
+            elif op in ANALYSIS_OPS and pos is not None:
+                analyses[(patient_id, pos)] = None
+        upserted = {patient_id for patient_id, op in patient_ops.items() if op != "delete"}
+        delta["deleted"] = [patient_id for patient_id, op in patient_ops.items() if op == "delete"]
+        # Le analisi dei pazienti inviati per intero o eliminati non servono
+        wanted = upserted | {patient_id for patient_id, _ in analyses if patient_id not in patient_ops}
+
+        if wanted:
+            found = {}
+            for patient in storage.iter_patients(tenant):
+                patient_id = patient.get("id")
+                if patient_id in wanted:
+                    found[patient_id] = patient
+            delta["patients"] = [found[patient_id] for patient_id in patient_ops if patient_id in upserted
+                                 and patient_id in found]
+            for patient_id, pos in analyses:
+                patient = found.get(patient_id)
+                if patient is None or patient_id in patient_ops:
+                    continue
+                history = patient.get("analysis_history") or []
+                if pos < len(history):
+                    delta["analyses"].append({"patient_id": patient_id, "index": pos, "entry": history[pos]})
+        return delta
+
+    async def wait(self, tenant: str, since: int, timeout: float) -> int:
+        """
+        Attende che la sequenza del tenant superi `since` (al massimo `timeout`
+        secondi) e la restituisce. Le modifiche dello stesso processo svegliano
+        subito l'attesa, quelle degli altri processi entro CHANGES_POLL_INTERVAL.
+        """
+        loop = asyncio.get_running_loop()
+        waiter = (loop, asyncio.Event())
+        deadline = loop.time() + timeout
+        with self._waiters_lock:
+            self._waiters.add(waiter)
+        try:
+            while True:
+                waiter[1].clear()
+                seq = await io_executor.run(self.current_seq, tenant, label="ChangeLog.current_seq")
+                remaining = deadline - loop.time()
+                if seq != since or remaining <= 0:
+                    return seq
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), min(CHANGES_POLL_INTERVAL, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._waiters_lock:
+                self._waiters.discard(waiter)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Registro condiviso dai servizi dello stesso processo (patients_api e agent_api, anche tramite il gateway)
+change_log = ChangeLog()
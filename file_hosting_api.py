@@ -1,8 +1,18 @@
-from fastapi import FastAPI, HTTPException
+import os
+import secrets
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 from pathlib import Path
 
+from metrics import gauges, instrument_app, register_collector
+from model_store import (LOD_LEVELS, HotModelCache, ModelCatalog, ModelEntry, RangeNotSatisfiable, etag_matches,
+                         negotiate_encoding, parse_range_header)
+from utils import verify_admin_credentials
+
 app = FastAPI(
     root_path="/api1"
 )
@@ -14,21 +24,234 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Content-Range", "Accept-Ranges", "Content-Length", "Content-Encoding"],
 )
+# Metriche delle richieste e GET /metrics (METRICS_ENABLED=0 per disattivarle)
+instrument_app(app, "files")
 
 # Percorso della cartella contenente i modelli 3D
 MODELS_FOLDER = Path("./models")
 
+# Catalogo con hash del contenuto (ETag) calcolati all'avvio
+catalog = ModelCatalog(MODELS_FOLDER)
+
+# URL versionati (?v=<hash>) possono essere tenuti in cache per sempre;
+# quelli senza versione vanno rivalidati con l'ETag (risposta 304).
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDATE = "public, no-cache"
+CHUNK_SIZE = 64 * 1024
+
+# Pre-compressione delle varianti all'avvio (in background: finché non sono
+# pronte i modelli vengono serviti non compressi)
+PRECOMPRESS_ON_STARTUP = os.getenv("MODELS_PRECOMPRESS", "1") == "1"
+
+# Cache in memoria (mmap) dei modelli richiesti più spesso: i file più grandi
+# di MODELS_CACHE_MAX_FILE_MB o non ancora "caldi" vengono serviti dal disco
+hot_cache = HotModelCache(
+    max_bytes=int(float(os.getenv("MODELS_CACHE_MB", "128")) * 1024 * 1024),
+    max_file_bytes=int(float(os.getenv("MODELS_CACHE_MAX_FILE_MB", "32")) * 1024 * 1024),
+    admit_after=int(os.getenv("MODELS_CACHE_ADMIT_AFTER", "2")),
+)
+VIEW_CHUNK_SIZE = 1024 * 1024
+
+# Occupazione e hit rate della cache in /metrics (model_cache_<campo>)
+register_collector(lambda: gauges("model_cache", hot_cache.stats()))
+
+
+@app.on_event("startup")
+def build_catalog():
+    catalog.refresh()
+    catalog.manifest()
+    if PRECOMPRESS_ON_STARTUP:
+        threading.Thread(target=catalog.precompress_all, name="models-precompress", daemon=True).start()
+
+
+def iter_file_range(path: Path, start: int, end: int) -> Iterator[bytes]:
+    """Legge il file a blocchi nell'intervallo [start, end] inclusivo."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def iter_view_range(view: memoryview, start: int, end: int) -> Iterator[memoryview]:
+    """Slice (senza copia) della memoryview nell'intervallo [start, end] inclusivo."""
+    for offset in range(start, end + 1, VIEW_CHUNK_SIZE):
+        yield view[offset:min(offset + VIEW_CHUNK_SIZE, end + 1)]
+
+
+def iter_body(path: Path, view: Optional[memoryview], start: int, end: int):
+    if view is not None:
+        return iter_view_range(view, start, end)
+    return iter_file_range(path, start, end)
+
+
+def iter_multipart(entry: ModelEntry, view: Optional[memoryview], ranges: List[Tuple[int, int]],
+                   boundary: str) -> Iterator[bytes]:
+    for start, end in ranges:
+        yield multipart_header(entry, start, end, boundary)
+        yield from iter_body(entry.path, view, start, end)
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode("ascii")
+
+
+def multipart_header(entry: ModelEntry, start: int, end: int, boundary: str) -> bytes:
+    return (
+        f"--{boundary}\r\n"
+        f"Content-Type: {entry.media_type}\r\n"
+        f"Content-Range: bytes {start}-{end}/{entry.size}\r\n\r\n"
+    ).encode("ascii")
+
+
+def model_response(request: Request, entry: ModelEntry, cache_control: str) -> Response:
+    """
+    Risposta per un modello con ETag forte, Cache-Control e supporto a
+    richieste condizionali (If-None-Match, If-Range) e Range singoli o multipli.
+    Senza Range, se il client accetta una codifica disponibile viene servita
+    la variante pre-compressa (nessuna compressione per richiesta).
+    I file caldi vengono serviti dalla cache in memoria, gli altri dal disco.
+    """
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding",
+    }
+
+    range_header = request.headers.get("range")
+    encoding = None
+    if range_header is None:
+        variants = catalog.variants(entry)
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"), variants)
+        if encoding:
+            headers["ETag"] = entry.encoded_etag(encoding)
+            headers["Content-Encoding"] = encoding
+
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    if encoding:
+        path, size = variants[encoding]
+        view = hot_cache.get(path, size, headers["ETag"].strip('"'))
+        if view is None:
+            return FileResponse(path, media_type=entry.media_type, headers=headers)
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iter_view_range(view, 0, size - 1), media_type=entry.media_type, headers=headers)
+
+    if_range = request.headers.get("if-range")
+    if range_header and if_range and if_range.strip() != entry.etag:
+        range_header = None  # Risorsa cambiata: si restituisce il file intero
+
+    try:
+        ranges = parse_range_header(range_header, entry.size)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{entry.size}"})
+
+    view = hot_cache.get(entry.path, entry.size, entry.sha256)
+    if ranges is None:
+        if view is None and "range" not in request.headers:
+            return FileResponse(entry.path, media_type=entry.media_type, headers=headers)
+        # File in cache, oppure Range ignorato (malformato o If-Range non
+        # corrispondente): file intero, senza lasciare a FileResponse una
+        # seconda interpretazione dell'header
+        headers["Content-Length"] = str(entry.size)
+        return StreamingResponse(iter_body(entry.path, view, 0, entry.size - 1),
+                                 media_type=entry.media_type, headers=headers)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end}/{entry.size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(iter_body(entry.path, view, start, end), status_code=206,
+                                 media_type=entry.media_type, headers=headers)
+
+    boundary = secrets.token_hex(16)
+    length = sum(len(multipart_header(entry, s, e, boundary)) + (e - s + 1) + 2 for s, e in ranges)
+    headers["Content-Length"] = str(length + len(f"--{boundary}--\r\n"))
+    return StreamingResponse(iter_multipart(entry, view, ranges, boundary), status_code=206,
+                             media_type=f"multipart/byteranges; boundary={boundary}", headers=headers)
+
+
 @app.get("/")
 def root():
     return {"message": "Backend per modelli 3D con FastAPI"}
 
-@app.get("/models/{model_name}")
-def get_model(model_name: str):
-    model_path = MODELS_FOLDER / model_name
-    if not model_path.exists():
+
+@app.get("/models")
+def list_models(request: Request):
+    """
+    Elenco dei modelli con dimensione, ETag e URL versionato (cache immutabile).
+    """
+    root_path = request.scope.get("root_path", "")
+    return {
+        "models": [
+            {
+                "name": entry.name,
+                "size": entry.size,
+                "etag": entry.etag,
+                "url": f"{root_path}/models/{entry.name}?v={entry.version}",
+                "lod_levels": sorted(LOD_LEVELS) if entry.name.lower().endswith(".glb") else [],
+            }
+            for entry in catalog.entries()
+        ]
+    }
+
+
+@app.get("/manifest")
+def get_manifest(request: Request):
+    """
+    Metadati di tutti i modelli (dimensione, hash, header GLB, mesh, materiali,
+    accessor, bounding box) in una sola piccola risposta, senza scaricare le mesh.
+    """
+    manifest = catalog.manifest()
+    headers = {"ETag": manifest["etag"], "Cache-Control": CACHE_REVALIDATE}
+    if etag_matches(request.headers.get("if-none-match"), manifest["etag"]):
+        return Response(status_code=304, headers=headers)
+    root_path = request.scope.get("root_path", "")
+    models = [{**model, "url": f"{root_path}/models/{model['name']}?v={model['version']}"}
+              for model in manifest["models"]]
+    return JSONResponse({"models": models}, headers=headers)
+
+
+@app.get("/cache_stats")
+def cache_stats(admin_username: str, admin_password: str):
+    """Occupazione e hit rate della cache in memoria dei modelli (solo admin: elenca i file in cache)."""
+    verify_admin_credentials(admin_username, admin_password)
+    return hot_cache.stats()
+
+
+@app.api_route("/models/{model_name}", methods=["GET", "HEAD"])
+def get_model(model_name: str, request: Request, v: Optional[str] = None, lod: Optional[int] = None):
+    """
+    Modello originale o, con `lod`, la variante GLB ottimizzata (buffer
+    deduplicati e quantizzati; da lod=1 anche geometria decimata, vedi LOD_LEVELS).
+    """
+    entry = catalog.get(model_name)
+    if entry is None:
         raise HTTPException(status_code=404, detail="Modello non trovato")
-    return FileResponse(model_path)
+
+    query = ""
+    if lod is not None:
+        if lod not in LOD_LEVELS:
+            raise HTTPException(status_code=400, detail=f"Livello LOD non valido (ammessi: {sorted(LOD_LEVELS)})")
+        entry = catalog.lod_entry(entry, lod)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Variante LOD non disponibile per questo modello")
+        query = f"lod={lod}&"
+
+    if v is None:
+        return model_response(request, entry, CACHE_REVALIDATE)
+    if entry.sha256.startswith(v) and len(v) >= 8:
+        return model_response(request, entry, CACHE_IMMUTABLE)
+
+    # Versione obsoleta: rimanda all'URL della versione corrente
+    root_path = request.scope.get("root_path", "")
+    return RedirectResponse(f"{root_path}/models/{model_name}?{query}v={entry.version}", status_code=307)
 
 # Avvia il server
 if __name__ == "__main__":
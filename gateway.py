@@ -0,0 +1,96 @@
+"""
+Gateway ASGI unico: monta i servizi sotto i rispettivi prefissi in un solo
+processo, con storage, cache delle credenziali e thread pool condivisi.
+
+    /api1 -> file_hosting_api     /api3 -> patients_api
+    /api2 -> agent_api            /api4 -> users_api
+    /app  -> app/main.py
+
+Avvio (più worker: ogni worker è un processo con il proprio gateway):
+    python gateway.py
+    uvicorn gateway:app --host 0.0.0.0 --port 8080 --workers 4
+
+GATEWAY_SERVICES sceglie i servizi da montare (default tutti), ad esempio
+"files,patients,users,app" per lasciare l'analisi (agent) in processi
+separati scalabili in modo indipendente; ogni servizio resta avviabile da
+solo come prima. Con più worker o processi che scrivono sugli stessi dati
+conviene STORAGE_BACKEND=wal o sqlite (lock fra processi).
+"""
+import importlib
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Tuple
+
+import anyio.to_thread
+from fastapi import FastAPI
+
+from metrics import instrument_app
+from storage import get_storage
+
+# nome -> (prefisso, modulo:attributo)
+SERVICES: Dict[str, Tuple[str, str]] = {
+    "files": ("/api1", "file_hosting_api:app"),
+    "agent": ("/api2", "agent_api:app"),
+    "patients": ("/api3", "patients_api:app"),
+    "users": ("/api4", "users_api:app"),
+    "app": ("/app", "app.main:app"),
+}
+
+GATEWAY_SERVICES = [name.strip() for name in os.getenv("GATEWAY_SERVICES", ",".join(SERVICES)).split(",")
+                    if name.strip()]
+# Thread pool condiviso (endpoint sincroni, file I/O): default di anyio 40
+GATEWAY_THREADS = int(os.getenv("GATEWAY_THREADS", "40"))
+GATEWAY_WORKERS = int(os.getenv("GATEWAY_WORKERS", "1"))
+
+
+def load_service(name: str) -> FastAPI:
+    try:
+        module_name, attribute = SERVICES[name][1].split(":")
+    except KeyError:
+        raise ValueError(f"Servizio sconosciuto: {name} (ammessi: {', '.join(SERVICES)})")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+# Tutti i moduli usano get_storage() e utils.credential_cache: importandoli
+# nello stesso processo condividono un'unica istanza di storage e di cache
+mounted: Dict[str, FastAPI] = {name: load_service(name) for name in GATEWAY_SERVICES}
+
+
+@asynccontextmanager
+async def lifespan(gateway: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = GATEWAY_THREADS
+    # Starlette non propaga gli eventi di avvio alle app montate: li esegue il gateway
+    for service in mounted.values():
+        await service.router.startup()
+    try:
+        yield
+    finally:
+        for service in mounted.values():
+            await service.router.shutdown()
+        get_storage().close()
+
+
+app = FastAPI(lifespan=lifespan)
+# /metrics del processo anche alla radice (le richieste sono misurate dai servizi montati)
+instrument_app(app, "gateway", http=False)
+
+
+@app.get("/")
+def root():
+    return {"services": {name: SERVICES[name][0] for name in mounted}}
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok", "pid": os.getpid(), "services": list(mounted)}
+
+
+for _name, _service in mounted.items():
+    app.mount(SERVICES[_name][0], _service)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("gateway:app", host="0.0.0.0", port=int(os.getenv("GATEWAY_PORT", "8080")),
+                workers=GATEWAY_WORKERS)
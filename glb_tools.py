@@ -0,0 +1,709 @@
+"""
+Strumenti per file GLB (glTF 2.0 binario) in puro Python + NumPy.
+
+- parsing del contenitore (header, chunk JSON, chunk BIN) e lettura degli accessor
+- deduplicazione di bufferView e accessor identici
+- quantizzazione di posizioni / normali / UV in interi normalizzati (KHR_mesh_quantization)
+- varianti LOD tramite decimazione per vertex clustering
+
+Uso da riga di comando:
+    python glb_tools.py models/skin.glb -o skin.lod1.glb --lod 0.5
+"""
+import copy
+import hashlib
+import json
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+GLB_MAGIC = b"glTF"
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+COMPONENT_DTYPES = {
+    5120: np.int8,
+    5121: np.uint8,
+    5122: np.int16,
+    5123: np.uint16,
+    5125: np.uint32,
+    5126: np.float32,
+}
+DTYPE_COMPONENTS = {np.dtype(v): k for k, v in COMPONENT_DTYPES.items()}
+TYPE_SIZES = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4, "MAT2": 4, "MAT3": 9, "MAT4": 16}
+SIZE_TYPES = {1: "SCALAR", 2: "VEC2", 3: "VEC3", 4: "VEC4"}
+
+TARGET_ARRAY_BUFFER = 34962
+TARGET_ELEMENT_ARRAY_BUFFER = 34963
+MODE_TRIANGLES = 4
+
+# Estensioni con geometria già compressa: in questi casi si applica solo la deduplicazione
+COMPRESSED_GEOMETRY_EXTENSIONS = {"KHR_draco_mesh_compression", "EXT_meshopt_compression", "KHR_mesh_quantization"}
+# Livelli per componente della normale nella chiave dei cluster LOD (5: -1, -0.5, 0, 0.5, 1,
+# circa 30 gradi): spigoli vivi e facce opposte non vengono fusi
+NORMAL_BINS = 5
+
+
+def _align(n: int, alignment: int = 4) -> int:
+    return (n + alignment - 1) // alignment * alignment
+
+
+# ------------------------------------------------------------------------------
+# CONTENITORE GLB
+# ------------------------------------------------------------------------------
+class GLB:
+    """Documento glTF (JSON) più il buffer binario del chunk BIN."""
+
+    def __init__(self, gltf: dict, binary: bytes = b""):
+        self.gltf = gltf
+        self.binary = binary
+
+    @classmethod
+    def parse(cls, data: bytes) -> "GLB":
+        if len(data) < 20:
+            raise ValueError("File GLB troppo corto.")
+        magic, version, length = struct.unpack_from("<4sII", data, 0)
+        if magic != GLB_MAGIC:
+            raise ValueError("Intestazione GLB non valida.")
+        if version != 2:
+            raise ValueError(f"Versione GLB non supportata: {version}")
+
+        gltf, binary = None, b""
+        offset = 12
+        while offset + 8 <= min(length, len(data)):
+            chunk_length, chunk_type = struct.unpack_from("<II", data, offset)
+            chunk = data[offset + 8:offset + 8 + chunk_length]
+            if chunk_type == CHUNK_JSON:
+                gltf = json.loads(chunk.decode("utf-8"))
+            elif chunk_type == CHUNK_BIN and not binary:
+                binary = bytes(chunk)
+            offset += 8 + chunk_length
+        if gltf is None:
+            raise ValueError("Chunk JSON mancante.")
+        for buffer in gltf.get("buffers", [])[:1]:
+            if "uri" in buffer:
+                raise ValueError("Sono supportati solo GLB con il buffer nel chunk BIN.")
+        return cls(gltf, binary)
+
+    @classmethod
+    def load(cls, path) -> "GLB":
+        return cls.parse(Path(path).read_bytes())
+
+    def to_bytes(self) -> bytes:
+        json_bytes = json.dumps(self.gltf, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        json_bytes += b" " * (_align(len(json_bytes)) - len(json_bytes))
+        chunks = struct.pack("<II", len(json_bytes), CHUNK_JSON) + json_bytes
+        if self.binary:
+            binary = self.binary + b"\0" * (_align(len(self.binary)) - len(self.binary))
+            chunks += struct.pack("<II", len(binary), CHUNK_BIN) + binary
+        return struct.pack("<4sII", GLB_MAGIC, 2, 12 + len(chunks)) + chunks
+
+    def save(self, path):
+        Path(path).write_bytes(self.to_bytes())
+
+    # --------------------------------------------------------------------------
+    # Lettura dati
+    # --------------------------------------------------------------------------
+    def buffer_view_bytes(self, index: int) -> bytes:
+        view = self.gltf["bufferViews"][index]
+        if view.get("buffer", 0) != 0:
+            raise ValueError("Sono supportati solo bufferView sul buffer 0.")
+        start = view.get("byteOffset", 0)
+        return self.binary[start:start + view["byteLength"]]
+
+    def _read_view(self, view_index: int, byte_offset: int, dtype: np.dtype, count: int, ncomp: int) -> np.ndarray:
+        view = self.gltf["bufferViews"][view_index]
+        base = view.get("byteOffset", 0) + byte_offset
+        element = dtype.itemsize * ncomp
+        stride = view.get("byteStride") or element
+        array = np.ndarray(shape=(count, ncomp), dtype=dtype, buffer=self.binary, offset=base,
+                           strides=(stride, dtype.itemsize))
+        return array.copy()
+
+    def read_accessor(self, index: int, dequantize: bool = False) -> np.ndarray:
+        """
+        Dati dell'accessor come array (count, componenti), con gli eventuali
+        valori sparse applicati. Con dequantize=True gli interi normalizzati
+        vengono riportati a float.
+        """
+        accessor = self.gltf["accessors"][index]
+        dtype = np.dtype(COMPONENT_DTYPES[accessor["componentType"]]).newbyteorder("<")
+        ncomp = TYPE_SIZES[accessor["type"]]
+        count = accessor["count"]
+
+        if "bufferView" in accessor:
+            data = self._read_view(accessor["bufferView"], accessor.get("byteOffset", 0), dtype, count, ncomp)
+        else:
+            data = np.zeros((count, ncomp), dtype=dtype)
+
+        sparse = accessor.get("sparse")
+        if sparse:
+            idx_info, val_info = sparse["indices"], sparse["values"]
+            idx_dtype = np.dtype(COMPONENT_DTYPES[idx_info["componentType"]]).newbyteorder("<")
+            positions = self._read_view(idx_info["bufferView"], idx_info.get("byteOffset", 0),
+                                        idx_dtype, sparse["count"], 1)[:, 0]
+            values = self._read_view(val_info["bufferView"], val_info.get("byteOffset", 0),
+                                     dtype, sparse["count"], ncomp)
+            data[positions] = values
+
+        if dequantize and accessor.get("normalized"):
+            return dequantize_normalized(data)
+        return data
+
+
+def dequantize_normalized(data: np.ndarray) -> np.ndarray:
+    info = np.iinfo(data.dtype)
+    scaled = data.astype(np.float32) / info.max
+    return np.maximum(scaled, -1.0) if info.min < 0 else scaled
+
+
+# ------------------------------------------------------------------------------
+# RIFERIMENTI AD ACCESSOR E BUFFERVIEW
+# ------------------------------------------------------------------------------
+def _accessor_refs(gltf: dict):
+    """
+    Itera (contenitore, chiave) di ogni riferimento ad accessor nel documento,
+    così i riferimenti possono essere letti e riscritti in place.
+    """
+    for mesh in gltf.get("meshes", []):
+        for primitive in mesh.get("primitives", []):
+            for name in primitive.get("attributes", {}):
+                yield primitive["attributes"], name
+            if "indices" in primitive:
+                yield primitive, "indices"
+            for target in primitive.get("targets", []):
+                for name in target:
+                    yield target, name
+    for animation in gltf.get("animations", []):
+        for sampler in animation.get("samplers", []):
+            yield sampler, "input"
+            yield sampler, "output"
+    for skin in gltf.get("skins", []):
+        if "inverseBindMatrices" in skin:
+            yield skin, "inverseBindMatrices"
+    for node in gltf.get("nodes", []):
+        instancing = node.get("extensions", {}).get("EXT_mesh_gpu_instancing")
+        if instancing:
+            for name in instancing.get("attributes", {}):
+                yield instancing["attributes"], name
+
+
+def _buffer_view_refs(gltf: dict):
+    for accessor in gltf.get("accessors", []):
+        if "bufferView" in accessor:
+            yield accessor, "bufferView"
+        sparse = accessor.get("sparse")
+        if sparse:
+            yield sparse["indices"], "bufferView"
+            yield sparse["values"], "bufferView"
+    for image in gltf.get("images", []):
+        if "bufferView" in image:
+            yield image, "bufferView"
+    for mesh in gltf.get("meshes", []):
+        for primitive in mesh.get("primitives", []):
+            draco = primitive.get("extensions", {}).get("KHR_draco_mesh_compression")
+            if draco and "bufferView" in draco:
+                yield draco, "bufferView"
+
+
+# ------------------------------------------------------------------------------
+# SCRITTURA CON DEDUPLICAZIONE
+# ------------------------------------------------------------------------------
+class _BinaryWriter:
+    """Costruisce il nuovo chunk BIN deduplicando i bufferView con byte identici."""
+
+    def __init__(self):
+        self.views: List[dict] = []
+        self.parts: List[bytes] = []
+        self.length = 0
+        self._seen: Dict[Tuple[str, Optional[int], Optional[int]], int] = {}
+
+    def add(self, data: bytes, byte_stride: Optional[int] = None, target: Optional[int] = None) -> int:
+        key = (hashlib.sha1(data).hexdigest(), byte_stride, target)
+        if key in self._seen:
+            return self._seen[key]
+        padding = _align(self.length) - self.length
+        if padding:
+            self.parts.append(b"\0" * padding)
+            self.length += padding
+        view = {"buffer": 0, "byteOffset": self.length, "byteLength": len(data)}
+        if byte_stride:
+            view["byteStride"] = byte_stride
+        if target:
+            view["target"] = target
+        self.parts.append(data)
+        self.length += len(data)
+        self.views.append(view)
+        self._seen[key] = len(self.views) - 1
+        return self._seen[key]
+
+    def binary(self) -> bytes:
+        return b"".join(self.parts)
+
+
+def _packed(array: np.ndarray, stride: Optional[int] = None) -> Tuple[bytes, Optional[int]]:
+    """
+    Serializza un array (count, ncomp) little-endian. Se l'elemento non è
+    multiplo di 4 byte (es. VEC3 int8/int16) viene aggiunto padding con
+    byteStride, come richiesto dalla specifica per gli attributi di vertice.
+    """
+    array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+    element = array.dtype.itemsize * array.shape[1]
+    if stride is None or stride == element:
+        return array.tobytes(), None
+    padded = np.zeros((array.shape[0], stride), dtype=np.uint8)
+    padded[:, :element] = array.view(np.uint8).reshape(array.shape[0], element)
+    return padded.tobytes(), stride
+
+
+def _new_accessor(writer: _BinaryWriter, array: np.ndarray, target: int, normalized: bool = False,
+                  bounds: bool = False) -> dict:
+    element = array.dtype.itemsize * array.shape[1]
+    stride = _align(element) if target == TARGET_ARRAY_BUFFER else None
+    data, byte_stride = _packed(array, stride)
+    accessor = {
+        "bufferView": writer.add(data, byte_stride, target),
+        "componentType": DTYPE_COMPONENTS[np.dtype(array.dtype).newbyteorder("=")],
+        "count": int(array.shape[0]),
+        "type": SIZE_TYPES[array.shape[1]],
+    }
+    if normalized:
+        accessor["normalized"] = True
+    if bounds:
+        cast = float if array.dtype.kind == "f" else int
+        accessor["min"] = [cast(v) for v in array.min(axis=0)]
+        accessor["max"] = [cast(v) for v in array.max(axis=0)]
+    return accessor
+
+
+# ------------------------------------------------------------------------------
+# GEOMETRIA: DECIMAZIONE E QUANTIZZAZIONE
+# ------------------------------------------------------------------------------
+def cluster_decimate(positions: np.ndarray, triangles: np.ndarray, ratio: float,
+                     uvs: Optional[np.ndarray] = None,
+                     normals: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decimazione per vertex clustering: i vertici vengono raggruppati in una
+    griglia regolare la cui risoluzione è scelta (ricerca binaria) per ottenere
+    circa `ratio` * vertici distinti; ogni cluster è rappresentato dal primo vertice.
+    La chiave del cluster include, oltre alla cella della posizione, la cella
+    delle UV (stessa risoluzione della griglia) e la normale quantizzata
+    (NORMAL_BINS livelli per componente): cuciture UV e spigoli vivi restano
+    separati, così la texture non si strappa nei LOD.
+    Restituisce (indici dei vertici rappresentanti, nuovi triangoli).
+    """
+    lo_bound = positions.min(axis=0)
+    extent = np.maximum(positions.max(axis=0) - lo_bound, 1e-12)
+    unit = (positions - lo_bound) / extent
+    normal_cells = None
+    if normals is not None:
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        normal_cells = np.rint(normals / np.where(lengths > 0, lengths, 1) * (NORMAL_BINS // 2)).astype(np.int64)
+
+    def clusters(resolution: int):
+        cells = np.minimum((unit * resolution).astype(np.int64), resolution - 1)
+        keys = cells[:, 0] + resolution * (cells[:, 1] + resolution * cells[:, 2])
+        if uvs is None and normal_cells is None:
+            return np.unique(keys, return_index=True, return_inverse=True)
+        columns = [keys[:, None]]
+        if uvs is not None:
+            columns.append(np.floor(uvs * resolution).astype(np.int64))
+        if normal_cells is not None:
+            columns.append(normal_cells)
+        return np.unique(np.hstack(columns), axis=0, return_index=True, return_inverse=True)
+
+    lo, hi = 1, 2048
+    best = clusters(hi)
+    # Il riferimento sono le posizioni distinte (mesh non indicizzate o con cuciture UV)
+    target = max(int(len(best[0]) * ratio), 4)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        candidate = clusters(mid)
+        if len(candidate[0]) <= target:
+            best, lo = candidate, mid
+        else:
+            hi = mid - 1
+    _, representatives, inverse = best
+    inverse = inverse.reshape(-1)
+
+    remapped = inverse[triangles]
+    keep = (remapped[:, 0] != remapped[:, 1]) & (remapped[:, 1] != remapped[:, 2]) & (remapped[:, 0] != remapped[:, 2])
+    remapped = remapped[keep]
+    # Triangoli duplicati (stessi vertici) mantenendo l'orientamento originale
+    _, unique_rows = np.unique(np.sort(remapped, axis=1), axis=0, return_index=True)
+    return representatives, remapped[np.sort(unique_rows)]
+
+
+def _quantize_unit(values: np.ndarray, dtype) -> np.ndarray:
+    info = np.iinfo(dtype)
+    return np.clip(np.rint(values * info.max), info.min if info.min < 0 else 0, info.max).astype(dtype)
+
+
+def _primitive_arrays(glb: GLB, primitive: dict) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    attributes = {name: glb.read_accessor(index, dequantize=True) for name, index in primitive["attributes"].items()}
+    count = next(iter(attributes.values())).shape[0]
+    if "indices" in primitive:
+        indices = glb.read_accessor(primitive["indices"])[:, 0].astype(np.int64)
+    else:
+        indices = np.arange(count, dtype=np.int64)
+    return attributes, indices.reshape(-1, 3)
+
+
+def optimize(glb: GLB, quantize: bool = True, lod_ratio: Optional[float] = None) -> GLB:
+    """
+    Restituisce un nuovo GLB ottimizzato:
+    - lod_ratio: frazione di vertici da mantenere (decimazione), None = nessuna
+    - quantize: posizioni int16 (con nodo figlio di de-quantizzazione), normali
+      int8 normalizzate, UV uint16 normalizzate (KHR_mesh_quantization)
+    In ogni caso bufferView e accessor identici vengono deduplicati e i dati
+    non più referenziati eliminati.
+    """
+    gltf = copy.deepcopy(glb.gltf)
+    writer = _BinaryWriter()
+    extensions = set(gltf.get("extensionsUsed", []))
+    process_geometry = (quantize or lod_ratio) and not (extensions & COMPRESSED_GEOMETRY_EXTENSIONS)
+
+    new_accessors: Dict[int, dict] = {}  # indice (>= len(originali)) -> accessor già scritto
+    next_index = len(gltf.get("accessors", []))
+    quantized_any = False
+    dequant_nodes: Dict[int, Tuple[List[float], float]] = {}
+
+    def register(accessor: dict) -> int:
+        nonlocal next_index
+        new_accessors[next_index] = accessor
+        next_index += 1
+        return next_index - 1
+
+    if process_geometry:
+        skinned_meshes = {n["mesh"] for n in gltf.get("nodes", []) if "mesh" in n and "skin" in n}
+        for mesh_index, mesh in enumerate(gltf.get("meshes", [])):
+            primitives = mesh.get("primitives", [])
+            eligible = all(p.get("mode", MODE_TRIANGLES) == MODE_TRIANGLES and not p.get("targets")
+                           and "POSITION" in p.get("attributes", {}) for p in primitives)
+            if not eligible or not primitives:
+                continue
+
+            arrays = [_primitive_arrays(glb, p) for p in primitives]
+            if lod_ratio:
+                decimated = []
+                for attributes, triangles in arrays:
+                    reps, triangles = cluster_decimate(attributes["POSITION"], triangles, lod_ratio,
+                                                       uvs=attributes.get("TEXCOORD_0"),
+                                                       normals=attributes.get("NORMAL"))
+                    decimated.append(({k: v[reps] for k, v in attributes.items()}, triangles))
+                arrays = decimated
+
+            quantize_positions = quantize and mesh_index not in skinned_meshes
+            if quantize_positions:
+                all_positions = np.vstack([a["POSITION"] for a, _ in arrays]).astype(np.float64)
+                center = (all_positions.min(axis=0) + all_positions.max(axis=0)) / 2
+                half = float(np.max(all_positions.max(axis=0) - center)) or 1.0
+                scale = half / 32767.0
+                dequant_nodes[mesh_index] = ([float(c) for c in center], scale)
+
+            for primitive, (attributes, triangles) in zip(primitives, arrays):
+                for name, values in attributes.items():
+                    if quantize_positions and name == "POSITION":
+                        q = np.rint((values - center) / scale).clip(-32767, 32767).astype(np.int16)
+                        accessor = _new_accessor(writer, q, TARGET_ARRAY_BUFFER, bounds=True)
+                    elif quantize and name == "NORMAL":
+                        lengths = np.linalg.norm(values, axis=1, keepdims=True)
+                        unit = values / np.where(lengths > 0, lengths, 1)
+                        accessor = _new_accessor(writer, _quantize_unit(unit, np.int8), TARGET_ARRAY_BUFFER,
+                                                 normalized=True)
+                    elif quantize and name == "TANGENT":
+                        accessor = _new_accessor(writer, _quantize_unit(values, np.int8), TARGET_ARRAY_BUFFER,
+                                                 normalized=True)
+                    elif quantize and name.startswith("TEXCOORD_") and values.min() >= 0 and values.max() <= 1:
+                        accessor = _new_accessor(writer, _quantize_unit(values, np.uint16), TARGET_ARRAY_BUFFER,
+                                                 normalized=True)
+                    else:
+                        original = gltf["accessors"][primitive["attributes"][name]]
+                        if original.get("normalized") or values.dtype.kind != "f":
+                            # Attributi interi (JOINTS, COLOR normalizzati...): tipo originale
+                            dtype = COMPONENT_DTYPES[original["componentType"]]
+                            if original.get("normalized"):
+                                values = _quantize_unit(values, dtype)
+                            accessor = _new_accessor(writer, values.astype(dtype), TARGET_ARRAY_BUFFER,
+                                                     normalized=bool(original.get("normalized")),
+                                                     bounds=name == "POSITION")
+                        else:
+                            accessor = _new_accessor(writer, values.astype(np.float32), TARGET_ARRAY_BUFFER,
+                                                     bounds=name == "POSITION")
+                    quantized_any = quantized_any or accessor["componentType"] != 5126 and name in (
+                        "POSITION", "NORMAL", "TANGENT") or name.startswith("TEXCOORD_") and accessor.get("normalized")
+                    primitive["attributes"][name] = register(accessor)
+
+                vertex_count = next(iter(attributes.values())).shape[0]
+                index_dtype = np.uint16 if vertex_count < 65535 else np.uint32
+                primitive["indices"] = register(_new_accessor(
+                    writer, triangles.reshape(-1, 1).astype(index_dtype), TARGET_ELEMENT_ARRAY_BUFFER))
+
+    _rebuild(glb, gltf, writer, new_accessors)
+
+    if dequant_nodes:
+        _insert_dequantization_nodes(gltf, dequant_nodes)
+    if quantized_any:
+        for key in ("extensionsUsed", "extensionsRequired"):
+            gltf[key] = sorted(set(gltf.get(key, [])) | {"KHR_mesh_quantization"})
+
+    gltf["buffers"] = [{"byteLength": writer.length}] if writer.length else []
+    if not gltf["buffers"]:
+        del gltf["buffers"]
+    return GLB(gltf, writer.binary())
+
+
+def _rebuild(glb: GLB, gltf: dict, writer: _BinaryWriter, new_accessors: Dict[int, dict]):
+    """
+    Riscrive accessor e bufferView ancora referenziati: copia i bufferView
+    originali nel nuovo BIN (deduplicati), unisce gli accessor identici e
+    rimappa tutti i riferimenti.
+    """
+    original_accessors = gltf.get("accessors", [])
+
+    # 1. bufferView originali ancora usati (da accessor originali referenziati, immagini, draco)
+    used_accessors = sorted({container[key] for container, key in _accessor_refs(gltf)})
+    view_map: Dict[int, int] = {}
+
+    def copy_view(old_index: int) -> int:
+        if old_index not in view_map:
+            old_view = glb.gltf["bufferViews"][old_index]
+            view_map[old_index] = writer.add(glb.buffer_view_bytes(old_index),
+                                             old_view.get("byteStride"), old_view.get("target"))
+        return view_map[old_index]
+
+    accessors_out: List[dict] = []
+    accessor_map: Dict[int, int] = {}
+    seen: Dict[str, int] = {}
+    for old_index in used_accessors:
+        if old_index in new_accessors:
+            accessor = new_accessors[old_index]
+        else:
+            accessor = copy.deepcopy(original_accessors[old_index])
+            if "bufferView" in accessor:
+                accessor["bufferView"] = copy_view(accessor["bufferView"])
+            sparse = accessor.get("sparse")
+            if sparse:
+                sparse["indices"]["bufferView"] = copy_view(sparse["indices"]["bufferView"])
+                sparse["values"]["bufferView"] = copy_view(sparse["values"]["bufferView"])
+        key = json.dumps(accessor, sort_keys=True)
+        if key not in seen:
+            seen[key] = len(accessors_out)
+            accessors_out.append(accessor)
+        accessor_map[old_index] = seen[key]
+
+    for container, key in list(_accessor_refs(gltf)):
+        container[key] = accessor_map[container[key]]
+    for image in gltf.get("images", []):
+        if "bufferView" in image:
+            image["bufferView"] = copy_view(image["bufferView"])
+    for mesh in gltf.get("meshes", []):
+        for primitive in mesh.get("primitives", []):
+            draco = primitive.get("extensions", {}).get("KHR_draco_mesh_compression")
+            if draco and "bufferView" in draco:
+                draco["bufferView"] = copy_view(draco["bufferView"])
+
+    if accessors_out:
+        gltf["accessors"] = accessors_out
+    else:
+        gltf.pop("accessors", None)
+    if writer.views:
+        gltf["bufferViews"] = writer.views
+    else:
+        gltf.pop("bufferViews", None)
+
+
+def _insert_dequantization_nodes(gltf: dict, dequant: Dict[int, Tuple[List[float], float]]):
+    """
+    Le posizioni quantizzate vanno riportate nello spazio originale: la mesh
+    viene spostata su un nodo figlio con traslazione = centro e scala uniforme,
+    così trasformazioni e animazioni del nodo padre restano invariate.
+    """
+    nodes = gltf.get("nodes", [])
+    for node in list(nodes):
+        mesh_index = node.get("mesh")
+        if mesh_index not in dequant:
+            continue
+        center, scale = dequant[mesh_index]
+        child = {"mesh": mesh_index, "translation": center, "scale": [scale, scale, scale]}
+        if "name" in node:
+            child["name"] = f"{node['name']}_mesh"
+        if "weights" in node:
+            child["weights"] = node.pop("weights")
+        del node["mesh"]
+        nodes.append(child)
+        node.setdefault("children", []).append(len(nodes) - 1)
+
+
+# ------------------------------------------------------------------------------
+# RIEPILOGO
+# ------------------------------------------------------------------------------
+def summarize(glb: GLB) -> dict:
+    """Statistiche sintetiche del documento (mesh, vertici, triangoli, byte)."""
+    gltf = glb.gltf
+    vertices = triangles = 0
+    for mesh in gltf.get("meshes", []):
+        for primitive in mesh.get("primitives", []):
+            position = primitive.get("attributes", {}).get("POSITION")
+            if position is not None:
+                vertices += gltf["accessors"][position]["count"]
+            if "indices" in primitive:
+                triangles += gltf["accessors"][primitive["indices"]]["count"] // 3
+            elif position is not None:
+                triangles += gltf["accessors"][position]["count"] // 3
+    return {
+        "meshes": len(gltf.get("meshes", [])),
+        "accessors": len(gltf.get("accessors", [])),
+        "bufferViews": len(gltf.get("bufferViews", [])),
+        "vertices": vertices,
+        "triangles": triangles,
+        "bytes": len(glb.to_bytes()),
+    }
+
+
+def read_header(path) -> Tuple[dict, dict]:
+    """
+    Legge solo l'header GLB e il chunk JSON (senza caricare il buffer binario).
+    Restituisce (info header, documento glTF).
+    """
+    with open(path, "rb") as f:
+        head = f.read(20)
+        if len(head) < 20:
+            raise ValueError("File GLB troppo corto.")
+        magic, version, length, json_length, chunk_type = struct.unpack("<4sIIII", head)
+        if magic != GLB_MAGIC or chunk_type != CHUNK_JSON:
+            raise ValueError("Intestazione GLB non valida.")
+        gltf = json.loads(f.read(json_length).decode("utf-8"))
+        bin_header = f.read(8)
+    bin_length = struct.unpack("<II", bin_header)[0] if len(bin_header) == 8 else 0
+    header = {"version": version, "length": length, "json_bytes": json_length, "bin_bytes": bin_length}
+    return header, gltf
+
+
+def _node_matrix(node: dict) -> np.ndarray:
+    if "matrix" in node:
+        return np.array(node["matrix"], dtype=np.float64).reshape(4, 4).T
+    x, y, z, w = node.get("rotation", [0, 0, 0, 1])
+    rotation = np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ])
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation * np.array(node.get("scale", [1, 1, 1]))
+    matrix[:3, 3] = node.get("translation", [0, 0, 0])
+    return matrix
+
+
+def _mesh_local_bounds(gltf: dict, mesh: dict) -> Optional[np.ndarray]:
+    """Bounding box (2, 3) della mesh dai min/max degli accessor POSITION."""
+    corners = []
+    for primitive in mesh.get("primitives", []):
+        accessor = gltf["accessors"][primitive["attributes"]["POSITION"]] if "POSITION" in primitive.get(
+            "attributes", {}) else None
+        if accessor and "min" in accessor and "max" in accessor:
+            low, high = np.array(accessor["min"], float), np.array(accessor["max"], float)
+            if accessor.get("normalized"):
+                low, high = dequantize_normalized(low.astype(COMPONENT_DTYPES[accessor["componentType"]])), \
+                    dequantize_normalized(high.astype(COMPONENT_DTYPES[accessor["componentType"]]))
+            corners.extend([low, high])
+    return np.array([np.min(corners, axis=0), np.max(corners, axis=0)]) if corners else None
+
+
+def scene_bounds(gltf: dict) -> Optional[Dict[str, List[float]]]:
+    """
+    Bounding box della scena di default in coordinate mondo: gli 8 vertici del
+    box di ogni mesh vengono trasformati con la matrice globale del nodo.
+    """
+    nodes, meshes = gltf.get("nodes", []), gltf.get("meshes", [])
+    scenes = gltf.get("scenes", [])
+    roots = scenes[gltf.get("scene", 0)]["nodes"] if scenes else range(len(nodes))
+    points = []
+    stack = [(index, np.eye(4)) for index in roots]
+    while stack:
+        index, parent = stack.pop()
+        node = nodes[index]
+        world = parent @ _node_matrix(node)
+        if "mesh" in node:
+            box = _mesh_local_bounds(gltf, meshes[node["mesh"]])
+            if box is not None:
+                corners = np.array([[x, y, z, 1.0] for x in box[:, 0] for y in box[:, 1] for z in box[:, 2]])
+                points.append((corners @ world.T)[:, :3])
+        stack.extend((child, world) for child in node.get("children", []))
+    if not points:
+        return None
+    points = np.vstack(points)
+    return {"min": [round(float(v), 6) for v in points.min(axis=0)],
+            "max": [round(float(v), 6) for v in points.max(axis=0)]}
+
+
+def describe(gltf: dict) -> dict:
+    """
+    Riepilogo del documento glTF per il manifest: mesh (primitive, vertici,
+    triangoli, attributi, materiali), materiali, conteggi e bounding box.
+    """
+    accessors = gltf.get("accessors", [])
+    meshes = []
+    for mesh in gltf.get("meshes", []):
+        vertices = triangles = 0
+        attributes, materials = set(), set()
+        for primitive in mesh.get("primitives", []):
+            position = primitive.get("attributes", {}).get("POSITION")
+            count = accessors[position]["count"] if position is not None else 0
+            vertices += count
+            if primitive.get("mode", MODE_TRIANGLES) == MODE_TRIANGLES:
+                triangles += (accessors[primitive["indices"]]["count"] if "indices" in primitive else count) // 3
+            attributes.update(primitive.get("attributes", {}))
+            if "material" in primitive:
+                materials.add(primitive["material"])
+        meshes.append({
+            "name": mesh.get("name"),
+            "primitives": len(mesh.get("primitives", [])),
+            "vertices": vertices,
+            "triangles": triangles,
+            "attributes": sorted(attributes),
+            "materials": sorted(materials),
+        })
+    materials = [
+        {
+            "name": material.get("name"),
+            "alphaMode": material.get("alphaMode", "OPAQUE"),
+            "doubleSided": material.get("doubleSided", False),
+            "baseColorFactor": material.get("pbrMetallicRoughness", {}).get("baseColorFactor"),
+            "textures": sorted(key for key, value in {**material, **material.get("pbrMetallicRoughness", {})}.items()
+                               if isinstance(value, dict) and "index" in value),
+        }
+        for material in gltf.get("materials", [])
+    ]
+    return {
+        "generator": gltf.get("asset", {}).get("generator"),
+        "meshes": meshes,
+        "materials": materials,
+        "counts": {key: len(gltf.get(key, [])) for key in
+                   ("nodes", "meshes", "materials", "accessors", "bufferViews", "textures", "images",
+                    "animations", "skins")},
+        "vertices": sum(mesh["vertices"] for mesh in meshes),
+        "triangles": sum(mesh["triangles"] for mesh in meshes),
+        "bounds": scene_bounds(gltf),
+        "extensionsUsed": gltf.get("extensionsUsed", []),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ottimizzazione GLB: deduplicazione, quantizzazione, LOD")
+    parser.add_argument("input")
+    parser.add_argument("-o", "--output")
+    parser.add_argument("--lod", type=float, default=None, help="frazione di vertici da mantenere (es. 0.5)")
+    parser.add_argument("--no-quantize", action="store_true")
+    args = parser.parse_args()
+
+    source = GLB.load(args.input)
+    result = optimize(source, quantize=not args.no_quantize, lod_ratio=args.lod)
+    before, after = summarize(source), summarize(result)
+    for key in before:
+        print(f"{key:12} {before[key]:>10} -> {after[key]:>10}")
+    if args.output:
+        result.save(args.output)
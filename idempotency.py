@@ -0,0 +1,265 @@
+"""
+Header Idempotency-Key per le richieste che modificano dati (POST, PUT,
+PATCH, DELETE) di agent_api e patients_api.
+
+Il client genera una chiave per ogni operazione e la rimanda identica nei
+tentativi successivi. La prima richiesta viene eseguita e la sua risposta
+(2xx) salvata; una ripetizione con la stessa chiave restituisce subito la
+risposta salvata (header `Idempotent-Replayed: true`) senza rieseguire
+l'analisi o ricreare il paziente. Se la prima richiesta è ancora in corso la
+ripetizione ne attende l'esito (fino a IDEMPOTENCY_WAIT secondi, poi 409).
+La stessa chiave con una richiesta diversa (corpo o parametri) dà 422.
+
+Il corpo non viene mai trattenuto in memoria: la prima esecuzione lo passa
+all'app così come arriva (l'import NDJSON resta in streaming) calcolandone
+l'impronta, che si salva insieme alla risposta; una ripetizione legge e
+scarta il proprio corpo calcolando l'impronta da confrontare.
+
+Le chiavi sono separate per utente (username e password della richiesta
+entrano nello spazio dei nomi, così una risposta salvata non è leggibile
+senza le stesse credenziali) e per metodo e percorso. Le risposte sono in un
+database SQLite (IDEMPOTENCY_PATH, default idempotency.db) condiviso dai
+processi del gateway e scadono dopo IDEMPOTENCY_TTL secondi.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from starlette.responses import JSONResponse
+
+from io_executor import io_executor
+
+IDEMPOTENCY_PATH = os.getenv("IDEMPOTENCY_PATH", "idempotency.db")
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+# Attesa massima di una ripetizione mentre la prima richiesta è in corso
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", "60"))
+# Una richiesta "in corso" più vecchia di così (processo terminato) non blocca più la chiave
+IDEMPOTENCY_PENDING_TIMEOUT = float(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT", "600"))
+# Risposte più grandi non vengono salvate (la chiave viene liberata)
+IDEMPOTENCY_MAX_BODY = int(os.getenv("IDEMPOTENCY_MAX_BODY", str(1024 * 1024)))
+
+MUTATING_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+MAX_KEY_LENGTH = 255
+_POLL_INTERVAL = 0.25
+_PURGE_INTERVAL = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    created REAL NOT NULL,
+    status INTEGER,
+    headers TEXT,
+    body BLOB
+);
+"""
+
+StoredResponse = Tuple[int, List[List[str]], bytes]
+
+
+class IdempotencyStore:
+    """
+    Risposte salvate per chiave; status NULL = richiesta ancora in corso
+    (l'impronta della richiesta è nota, e salvata, solo a risposta completata).
+    """
+
+    def __init__(self, path: str = IDEMPOTENCY_PATH, ttl: float = IDEMPOTENCY_TTL,
+                 pending_timeout: float = IDEMPOTENCY_PENDING_TIMEOUT):
+        self.path = path
+        self.ttl = ttl
+        self.pending_timeout = pending_timeout
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.RLock()
+        self._last_purge = 0.0
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def claim(self, key: str) -> Tuple[str, Optional[str], Optional[StoredResponse]]:
+        """
+        Esito per la chiave: ("new", None, None) se la richiesta va eseguita
+        (la chiave resta riservata fino a complete / release), ("pending",
+        None, None) oppure ("done", impronta, risposta) da confrontare con
+        l'impronta della ripetizione.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            if now - self._last_purge > _PURGE_INTERVAL:
+                conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                self._last_purge = now
+            row = conn.execute("SELECT fingerprint, created, status, headers, body FROM responses WHERE key = ?",
+                               (key,)).fetchone()
+            if (row is None or now - row[1] > self.ttl
+                    or (row[2] is None and now - row[1] > self.pending_timeout)):
+                conn.execute("INSERT OR REPLACE INTO responses (key, fingerprint, created) VALUES (?, '', ?)",
+                             (key, now))
+                return "new", None, None
+        if row[2] is None:
+            return "pending", None, None
+        return "done", row[0], (row[2], json.loads(row[3]), bytes(row[4]))
+
+    def complete(self, key: str, fingerprint: str, status: int, headers: List[List[str]], body: bytes):
+        with self._lock:
+            self._conn.execute("UPDATE responses SET fingerprint = ?, status = ?, headers = ?, body = ? WHERE key = ?",
+                               (fingerprint, status, json.dumps(headers), body, key))
+
+    def release(self, key: str):
+        """Libera la chiave: la prossima richiesta con la stessa chiave viene eseguita."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ? AND status IS NULL", (key,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _sha256(*parts: bytes):
+    """Digest delle parti (con la lunghezza di ciascuna); il corpo si aggiunge poi a pezzi."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest
+
+
+class IdempotencyMiddleware:
+    """
+    Middleware ASGI: va aggiunto prima di CORSMiddleware (più interno), così
+    le risposte ripetute ricevono comunque gli header CORS della richiesta.
+    """
+
+    def __init__(self, app, store: Optional[IdempotencyStore] = None, methods=MUTATING_METHODS):
+        self.app = app
+        self.store = store
+        self.methods = methods
+
+    def _store(self) -> IdempotencyStore:
+        # Creato al primo uso: importare i servizi non apre il database
+        if self.store is None:
+            self.store = idempotency_store()
+        return self.store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in self.methods:
+            return await self.app(scope, receive, send)
+        header = next((value for name, value in scope["headers"] if name == b"idempotency-key"), None)
+        if header is None:
+            return await self.app(scope, receive, send)
+        if not header or len(header) > MAX_KEY_LENGTH:
+            return await JSONResponse({"detail": f"Idempotency-Key deve avere da 1 a {MAX_KEY_LENGTH} caratteri."},
+                                      status_code=400)(scope, receive, send)
+
+        query = sorted(parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True))
+        params = dict(query)
+        user = params.get("username") or params.get("admin_username") or ""
+        password = params.get("password") or params.get("admin_password") or ""
+        method_path = f"{scope['method']} {scope.get('root_path', '')}{scope['path']}".encode("utf-8")
+        key = _sha256(user.encode("utf-8"), password.encode("utf-8"), method_path, header).hexdigest()
+        # Impronta: metodo, percorso, parametri e corpo, aggiornata mentre il corpo arriva
+        fingerprint = _sha256(method_path, json.dumps(query).encode("utf-8"))
+
+        store = self._store()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + IDEMPOTENCY_WAIT
+        while True:
+            state, stored_fingerprint, stored = await io_executor.run(store.claim, key,
+                                                                      label="IdempotencyStore.claim")
+            if state != "pending" or loop.time() >= deadline:
+                break
+            await asyncio.sleep(_POLL_INTERVAL)
+
+        if state == "pending":
+            return await JSONResponse({"detail": "Richiesta con la stessa Idempotency-Key ancora in corso."},
+                                      status_code=409, headers={"Retry-After": "1"})(scope, receive, send)
+        if state == "done":
+            # Corpo della ripetizione letto a pezzi solo per l'impronta
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                fingerprint.update(message.get("body", b""))
+                if not message.get("more_body", False):
+                    break
+            if fingerprint.hexdigest() != stored_fingerprint:
+                return await JSONResponse({"detail": "Idempotency-Key già usata per una richiesta diversa."},
+                                          status_code=422)(scope, receive, send)
+            status, headers, content = stored
+            raw_headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+            await send({"type": "http.response.start", "status": status,
+                        "headers": raw_headers + [(b"idempotent-replayed", b"true")]})
+            await send({"type": "http.response.body", "body": content})
+            return
+
+        # Prima esecuzione: corpo passato all'app così come arriva, risposta inoltrata e registrata
+        body_complete = False
+
+        async def hashing_receive():
+            nonlocal body_complete
+            message = await receive()
+            if message["type"] == "http.request" and not body_complete:
+                fingerprint.update(message.get("body", b""))
+                body_complete = not message.get("more_body", False)
+            return message
+
+        response = {"status": 500, "headers": [], "body": [], "size": 0}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [[name.decode("latin-1"), value.decode("latin-1")]
+                                       for name, value in message.get("headers", [])]
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                response["size"] += len(chunk)
+                if response["size"] <= IDEMPOTENCY_MAX_BODY:
+                    response["body"].append(chunk)
+            await send(message)
+
+        try:
+            await self.app(scope, hashing_receive, capture_send)
+            storable = 200 <= response["status"] < 300 and response["size"] <= IDEMPOTENCY_MAX_BODY
+            # Corpo non letto per intero dall'app: il resto serve comunque all'impronta
+            while storable and not body_complete:
+                if (await hashing_receive())["type"] == "http.disconnect":
+                    storable = False
+        except BaseException:
+            await io_executor.run(store.release, key)
+            raise
+        if storable:
+            await io_executor.run(store.complete, key, fingerprint.hexdigest(), response["status"],
+                                  response["headers"], b"".join(response["body"]))
+        else:
+            # Errori (anche 4xx), risposte troppo grandi o corpo incompleto: un nuovo tentativo viene rieseguito
+            await io_executor.run(store.release, key)
+
+
+_store: Optional[IdempotencyStore] = None
+_store_lock = threading.Lock()
+
+
+def idempotency_store() -> IdempotencyStore:
+    """Store condiviso dai servizi dello stesso processo (creato al primo uso)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = IdempotencyStore()
+    return _store
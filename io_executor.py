@@ -0,0 +1,241 @@
+"""
+Esecuzione delle operazioni bloccanti (file I/O dello storage, bcrypt,
+chiamate ai motori di analisi) fuori dall'event loop, su thread pool
+dedicati e limitati, con istogrammi di latenza per operazione.
+
+- `io_executor`: letture e scritture dei tenant e verifica credenziali
+  (IO_THREADS, default 16)
+- `analysis_executor`: analisi LLM / scoring locale, lente e poco numerose
+  (ANALYSIS_THREADS, default 8), così non occupano i thread dell'I/O
+
+`LoopLagMonitor` misura il ritardo dell'event loop (quanto un `sleep`
+programmato arriva in ritardo). Il pool toglie dal loop le attese di disco,
+fsync e bcrypt (che rilasciano il GIL), non il lavoro CPU in Python: la
+codifica e decodifica JSON nei thread tiene il GIL e rallenta comunque il
+loop. Con il benchmark di default (payload 128 KB, 50 richieste concorrenti)
+il ritardo passa da oltre un secondo con I/O inline a p50 ~25 ms e p99
+~200-300 ms con il pool; con payload da 16 KB p50 ~5 ms, p99 ~40 ms.
+
+Benchmark (ritardo dell'event loop con I/O inline e con il pool):
+    python io_executor.py
+"""
+import asyncio
+import bisect
+import functools
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Limiti superiori dei bucket in secondi (stessi valori di default di Prometheus)
+LATENCY_BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                                      1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+class LatencyHistogram:
+    """Istogramma cumulabile a bucket fissi (conteggio, somma, massimo)."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Stima dal limite superiore del bucket che contiene il quantile."""
+        if self.count == 0:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return self.max if bound == float("inf") else min(bound, self.max)
+        return self.max
+
+    def cumulative(self) -> Tuple[List[Tuple[float, int]], int, float]:
+        """Conteggi cumulativi per limite superiore, conteggio e somma (formato Prometheus)."""
+        with self._lock:
+            return list(zip(self.buckets, itertools.accumulate(self.counts))), self.count, self.total
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "count": self.count,
+                "mean_ms": round(1000 * self.total / self.count, 3) if self.count else None,
+                "p50_ms": _ms(self.quantile(0.5)),
+                "p95_ms": _ms(self.quantile(0.95)),
+                "p99_ms": _ms(self.quantile(0.99)),
+                "max_ms": round(1000 * self.max, 3),
+                "buckets": {("+Inf" if b == float("inf") else str(b)): c for b, c in zip(self.buckets, self.counts)},
+            }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(1000 * seconds, 3)
+
+
+class IoExecutor:
+    """
+    Thread pool limitato per le chiamate bloccanti. Per ogni etichetta
+    registra due istogrammi: attesa in coda (pool saturo) ed esecuzione.
+    """
+
+    def __init__(self, max_workers: int, name: str = "io"):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-pool")
+        self._histograms: Dict[str, Dict[str, LatencyHistogram]] = {}
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def _histogram(self, label: str, kind: str) -> LatencyHistogram:
+        with self._lock:
+            histograms = self._histograms.setdefault(label, {"queue": LatencyHistogram(), "run": LatencyHistogram()})
+        return histograms[kind]
+
+    def _call(self, label: str, submitted: float, fn: Callable, args, kwargs):
+        started = time.perf_counter()
+        self._histogram(label, "queue").observe(started - submitted)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._histogram(label, "run").observe(time.perf_counter() - started)
+            with self._lock:
+                self._pending -= 1
+
+    async def run(self, fn: Callable, *args, label: Optional[str] = None, **kwargs):
+        """Esegue `fn(*args, **kwargs)` nel pool e ne attende il risultato (le eccezioni si propagano)."""
+        label = label or getattr(fn, "__qualname__", None) or repr(fn)
+        with self._lock:
+            self._pending += 1
+        call = functools.partial(self._call, label, time.perf_counter(), fn, args, kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    def histograms(self) -> Dict[str, Dict[str, LatencyHistogram]]:
+        """Istogrammi per etichetta ("queue" / "run") e richieste in attesa o in esecuzione."""
+        with self._lock:
+            return dict(self._histograms)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def stats(self) -> dict:
+        with self._lock:
+            labels = dict(self._histograms)
+            pending = self._pending
+        return {
+            "threads": self.max_workers,
+            "pending": pending,
+            "operations": {label: {kind: h.snapshot() for kind, h in histograms.items()}
+                           for label, histograms in sorted(labels.items())},
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+class LoopLagMonitor:
+    """Misura periodicamente il ritardo dell'event loop in cui viene avviato."""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.histogram = LatencyHistogram()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.histogram.observe(max(time.perf_counter() - start - self.interval, 0.0))
+
+    def start(self):
+        """Da chiamare dall'event loop (evento di startup); una sola volta per loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def snapshot(self) -> dict:
+        return self.histogram.snapshot()
+
+
+# Pool condivisi dai servizi dello stesso processo (anche tramite il gateway)
+io_executor = IoExecutor(int(os.getenv("IO_THREADS", "16")), name="io")
+analysis_executor = IoExecutor(int(os.getenv("ANALYSIS_THREADS", "8")), name="analysis")
+loop_lag = LoopLagMonitor(float(os.getenv("LOOP_LAG_INTERVAL", "0.1")))
+
+
+def io_stats() -> dict:
+    """Statistiche dei pool e del ritardo dell'event loop (endpoint /io_stats)."""
+    return {
+        "event_loop_lag": loop_lag.snapshot(),
+        "executors": {executor.name: executor.stats() for executor in (io_executor, analysis_executor)},
+    }
+
+
+# ------------------------------------------------------------------------------
+# BENCHMARK
+# ------------------------------------------------------------------------------
+if __name__ == "__main__":
+    import argparse
+    import json
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Ritardo dell'event loop con I/O inline o nel pool")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--payload-kb", type=int, default=128)
+    args = parser.parse_args()
+
+    payload = [{"id": str(i), "analysis_history": [{"result": {"x": "y" * 100}}] * 5}
+               for i in range(args.payload_kb * 1024 // 600)]
+
+    def write_and_read(path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(path, "r", encoding="utf-8") as f:
+            return len(json.load(f))
+
+    async def scenario(offload: bool, folder: str) -> dict:
+        monitor = LoopLagMonitor(interval=0.005)
+        monitor.start()
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def request(i: int):
+            async with semaphore:
+                path = os.path.join(folder, f"{i % args.concurrency}.json")
+                if offload:
+                    await io_executor.run(write_and_read, path, label="write_and_read")
+                else:
+                    write_and_read(path)
+                await asyncio.sleep(0)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(request(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - start
+        monitor.stop()
+        return {"seconds": elapsed, **monitor.snapshot()}
+
+    with tempfile.TemporaryDirectory() as folder:
+        for offload in (False, True):
+            result = asyncio.run(scenario(offload, folder))
+            print(f"{'pool' if offload else 'inline':6}  {args.requests} richieste in {result['seconds']:.2f} s  "
+                  f"ritardo event loop p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, "
+                  f"max {result['max_ms']} ms ({result['count']} campioni)")
@@ -0,0 +1,309 @@
+"""
+Metriche di processo in formato testo Prometheus (`GET /metrics` su ogni
+servizio e sul gateway).
+
+- `span(stage)`: tempo di una fase (decodifica Base64, ricodifica immagini,
+  scrittura in saved_images, chiamata LLM, parsing, bcrypt, chiamate allo
+  storage, ...) nell'istogramma `stage_duration_seconds{stage=...}`; le
+  eccezioni contano in `stage_errors_total`
+- `inc(name, **labels)`: contatori (es. tentativi LLM per esito)
+- `instrument_app(app, service)`: durata e numero delle richieste HTTP per
+  handler e stato, più la route /metrics
+- collector registrati con `register_collector`: i pool di io_executor, il
+  ritardo dell'event loop e le statistiche dei singoli servizi (controllo di
+  ammissione, cache dei modelli) vengono letti solo al momento dello scrape
+
+Con METRICS_ENABLED=0 gli span sono un context manager vuoto condiviso, lo
+storage non viene avvolto, nessun middleware viene aggiunto e /metrics non
+esiste. Attive, costano circa due microsecondi per span (due letture
+dell'orologio e un istogramma aggiornato sotto lock): si misura con
+    python metrics.py
+"""
+import functools
+import os
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from io_executor import LatencyHistogram, analysis_executor, io_executor, loop_lag
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no", "off")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+# (nome, tipo, descrizione, campioni (suffisso, etichette, valore))
+MetricFamily = Tuple[str, str, str, List[Tuple[str, Labels, float]]]
+
+# Metodi dello storage misurati da instrument_storage (stage "storage.<metodo>")
+STORAGE_METHODS = ("get_user", "save_user", "create_user", "delete_user", "list_user_records",
+                   "append_login_event", "list_tenants", "load_patients", "save_patients", "get_patient",
+                   "create_patient", "create_patients", "update_patient", "patch_patient", "delete_patient",
+                   "append_analysis")
+
+_NOOP = nullcontext()
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def histogram_samples(histogram: LatencyHistogram, labels: Labels) -> List[Tuple[str, Labels, float]]:
+    """Campioni _bucket / _sum / _count di un LatencyHistogram."""
+    buckets, count, total = histogram.cumulative()
+    samples = [("_bucket", labels + (("le", "+Inf" if bound == float("inf") else repr(bound)),), cumulative)
+               for bound, cumulative in buckets]
+    samples.append(("_sum", labels, total))
+    samples.append(("_count", labels, count))
+    return samples
+
+
+def gauges(prefix: str, stats: dict, labels: Optional[dict] = None) -> List[MetricFamily]:
+    """Gauge `<prefix>_<chiave>` per i valori numerici di un dizionario di statistiche."""
+    labels = _labels(labels or {})
+    return [(f"{prefix}_{key}", "gauge", f"{prefix} {key}", [("", labels, float(value))])
+            for key, value in stats.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)]
+
+
+class _Span:
+    __slots__ = ("registry", "stage", "histogram", "started")
+
+    def __init__(self, registry: "MetricsRegistry", stage: str, histogram: LatencyHistogram):
+        self.registry = registry
+        self.stage = stage
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started)
+        if exc_type is not None:
+            self.registry.inc("stage_errors_total", stage=self.stage)
+        return False
+
+
+class MetricsRegistry:
+    """Istogrammi, contatori e collector di un processo."""
+
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self._histograms: Dict[Tuple[str, Labels], LatencyHistogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+        self._stages: Dict[str, LatencyHistogram] = {}  # stage -> istogramma (evita di ricostruire le etichette)
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def histogram(self, name: str, **labels) -> LatencyHistogram:
+        key = (name, _labels(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def observe(self, name: str, seconds: float, **labels):
+        if self.enabled:
+            self.histogram(name, **labels).observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def span(self, stage: str):
+        if not self.enabled:
+            return _NOOP
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            histogram = self._stages[stage] = self.histogram("stage_duration_seconds", stage=stage)
+        return _Span(self, stage, histogram)
+
+    def timed(self, stage: str) -> Callable:
+        """Decoratore: ogni chiamata della funzione è uno span."""
+        def decorator(fn: Callable) -> Callable:
+            if not self.enabled:
+                return fn
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def register_collector(self, collector: Callable[[], Iterable[MetricFamily]]):
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    # --------------------------------------------------------------------------
+    # Esposizione
+    # --------------------------------------------------------------------------
+    def collect(self) -> List[MetricFamily]:
+        families: Dict[str, MetricFamily] = {}
+
+        def family(name: str, kind: str) -> MetricFamily:
+            if name not in families:
+                families[name] = (name, kind, self._help.get(name, name), [])
+            return families[name]
+
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = list(self._counters.items())
+        for (name, labels), histogram in histograms:
+            family(name, "histogram")[3].extend(histogram_samples(histogram, labels))
+        for (name, labels), value in counters:
+            family(name, "counter")[3].append(("", labels, value))
+        for collector in self._collectors:
+            for name, kind, text, samples in collector():
+                family(name, kind)[3].extend(samples)
+                self._help.setdefault(name, text)
+        return list(families.values())
+
+    def render(self) -> str:
+        lines = []
+        for name, kind, text, samples in self.collect():
+            lines.append(f"# HELP {name} {_escape(self._help.get(name, text), help_text=True)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                rendered = ",".join(f'{key}="{_escape(val)}"' for key, val in labels)
+                lines.append(f"{name}{suffix}{{{rendered}}} {_number(value)}" if rendered
+                             else f"{name}{suffix} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str, help_text: bool = False) -> str:
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+    return value if help_text else value.replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# Registro condiviso dai servizi dello stesso processo (anche tramite il gateway)
+registry = MetricsRegistry()
+span = registry.span
+inc = registry.inc
+timed = registry.timed
+register_collector = registry.register_collector
+
+registry.describe("stage_duration_seconds", "Durata delle fasi instrumentate (secondi)")
+registry.describe("stage_errors_total", "Fasi terminate con un'eccezione")
+registry.describe("http_request_duration_seconds", "Durata delle richieste HTTP (secondi, fino all'ultimo byte)")
+registry.describe("http_requests_total", "Richieste HTTP per handler e stato")
+
+
+def _executor_metrics() -> List[MetricFamily]:
+    queue, run, pending = [], [], []
+    for executor in (io_executor, analysis_executor):
+        for label, histograms in sorted(executor.histograms().items()):
+            labels = (("executor", executor.name), ("operation", label))
+            queue.extend(histogram_samples(histograms["queue"], labels))
+            run.extend(histogram_samples(histograms["run"], labels))
+        pending.append(("", (("executor", executor.name),), executor.pending))
+    return [
+        ("executor_queue_seconds", "histogram", "Attesa nel pool prima dell'esecuzione (secondi)", queue),
+        ("executor_run_seconds", "histogram", "Esecuzione nel pool (secondi)", run),
+        ("executor_pending", "gauge", "Chiamate in coda o in esecuzione nel pool", pending),
+        ("event_loop_lag_seconds", "histogram", "Ritardo dell'event loop (secondi)",
+         histogram_samples(loop_lag.histogram, ())),
+    ]
+
+
+registry.register_collector(_executor_metrics)
+
+
+# ------------------------------------------------------------------------------
+# STORAGE E APP
+# ------------------------------------------------------------------------------
+def instrument_storage(storage, methods: Iterable[str] = STORAGE_METHODS):
+    """
+    Misura i metodi dello storage condiviso (stage "storage.<metodo>"),
+    avvolgendoli sull'istanza; chiamarla più volte non ha effetto.
+    """
+    if not registry.enabled or getattr(storage, "_metrics_instrumented", False):
+        return storage
+    for name in methods:
+        method = getattr(storage, name, None)
+        if method is not None:
+            setattr(storage, name, timed(f"storage.{name}")(method))
+    storage._metrics_instrumented = True
+    return storage
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: durata e conteggio delle richieste per handler, metodo e stato."""
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Nome della funzione dell'endpoint (non il percorso: gli id farebbero esplodere le serie)
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", None) or "unmatched"
+            labels = {"service": self.service, "method": scope["method"], "handler": handler}
+            registry.observe("http_request_duration_seconds", time.perf_counter() - started, **labels)
+            registry.inc("http_requests_total", status=status[0], **labels)
+
+
+def metrics_response():
+    from starlette.responses import Response
+
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
+def instrument_app(app, service: str, http: bool = True):
+    """Aggiunge /metrics e (con http=True) le metriche delle richieste di `app`."""
+    if not registry.enabled:
+        return
+    if http:
+        app.add_middleware(MetricsMiddleware, service=service)
+    app.add_api_route("/metrics", metrics_response, methods=["GET"], include_in_schema=False)
+
+
+# ------------------------------------------------------------------------------
+# BENCHMARK
+# ------------------------------------------------------------------------------
+if __name__ == "__main__":
+    iterations = 200_000
+    for enabled in (False, True):
+        bench = MetricsRegistry(enabled=enabled)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            with bench.span("bench"):
+                pass
+        elapsed = time.perf_counter() - start
+        print(f"metriche {'attive   ' if enabled else 'disattive'}  {1e9 * elapsed / iterations:7.0f} ns per span")
+    bench = MetricsRegistry(enabled=True)
+    for i in range(1000):
+        with bench.span(f"stage_{i % 20}"):
+            pass
+    start = time.perf_counter()
+    text = bench.render()
+    print(f"render di {text.count(chr(10))} righe in {1000 * (time.perf_counter() - start):.2f} ms")
@@ -0,0 +1,561 @@
+"""
+Catalogo dei modelli 3D serviti da file_hosting_api.
+
+Per ogni file in MODELS_FOLDER calcola una sola volta (all'avvio o quando il
+file cambia) l'hash SHA-256 del contenuto, usato come ETag forte e come
+versione negli URL immutabili. Contiene anche il parsing degli header
+HTTP Range / If-None-Match / Accept-Encoding e lo stadio di pre-compressione
+(varianti gzip/brotli/zstd salvate in MODELS_FOLDER/.precompressed).
+Per i GLB gestisce inoltre le varianti ottimizzate per livello di dettaglio
+(glb_tools), generate alla prima richiesta e salvate in MODELS_FOLDER/.variants,
+e il manifest con i metadati GLB letti dal solo chunk JSON.
+"""
+import gzip
+import hashlib
+import mimetypes
+import mmap
+import os
+import stat
+import struct
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Prefisso dell'hash usato come versione negli URL (?v=...)
+VERSION_LENGTH = 16
+# Oltre questo numero di intervalli una richiesta Range viene servita per intero
+MAX_RANGES = 16
+
+# Codifiche supportate in ordine di preferenza; brotli e zstd sono opzionali
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    zstandard = None
+
+PRECOMPRESSED_FOLDER = ".precompressed"
+LOD_FOLDER = ".variants"
+# Livelli di dettaglio: frazione di posizioni mantenute (0 = sola deduplicazione
+# e quantizzazione, geometria completa)
+LOD_LEVELS = {0: None, 1: 0.5, 2: 0.25, 3: 0.1}
+# Una variante viene servita solo se risparmia almeno il 5% dei byte
+MIN_COMPRESSION_GAIN = 0.95
+
+
+def _compress_gzip(data: bytes) -> bytes:
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _compress_brotli(data: bytes) -> bytes:
+    return brotli.compress(data, quality=11)
+
+
+def _compress_zstd(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=19).compress(data)
+
+
+COMPRESSORS = {"br": _compress_brotli, "zstd": _compress_zstd, "gzip": _compress_gzip}
+if brotli is None:
+    del COMPRESSORS["br"]
+if zstandard is None:
+    del COMPRESSORS["zstd"]
+
+mimetypes.add_type("model/gltf-binary", ".glb")
+mimetypes.add_type("model/gltf+json", ".gltf")
+
+
+@dataclass
+class ModelEntry:
+    name: str
+    path: Path
+    size: int
+    mtime_ns: int
+    sha256: str
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.sha256}"'
+
+    @property
+    def version(self) -> str:
+        return self.sha256[:VERSION_LENGTH]
+
+    @property
+    def media_type(self) -> str:
+        return mimetypes.guess_type(self.name)[0] or "application/octet-stream"
+
+    def encoded_etag(self, encoding: str) -> str:
+        return f'"{self.sha256}-{encoding}"'
+
+
+def hash_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelCatalog:
+    """
+    Elenco dei file di una cartella con hash del contenuto. Gli hash vengono
+    ricalcolati solo per i file la cui coppia (mtime, dimensione) è cambiata.
+    """
+
+    def __init__(self, folder: Path):
+        self.folder = Path(folder)
+        self._entries: Dict[str, ModelEntry] = {}
+        self.compressed_folder = self.folder / PRECOMPRESSED_FOLDER
+        self.lod_folder = self.folder / LOD_FOLDER
+        self._lod_entries: Dict[Tuple[str, int], ModelEntry] = {}
+        self._summaries: Dict[str, Optional[dict]] = {}
+        self._manifest: Optional[dict] = None
+        self._manifest_key: Optional[tuple] = None
+        self._lock = threading.Lock()
+        self._lod_lock = threading.Lock()
+        self._loaded = False
+
+    def _scan_file(self, path: Path) -> Optional[ModelEntry]:
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        current = self._entries.get(path.name)
+        if current and current.size == st.st_size and current.mtime_ns == st.st_mtime_ns:
+            return current
+        return ModelEntry(path.name, path, st.st_size, st.st_mtime_ns, hash_file(path))
+
+    def refresh(self):
+        """Riallinea il catalogo al contenuto della cartella."""
+        with self._lock:
+            entries = {}
+            if self.folder.is_dir():
+                for path in sorted(self.folder.iterdir()):
+                    if path.is_file() and not path.name.startswith("."):
+                        entry = self._scan_file(path)
+                        if entry:
+                            entries[entry.name] = entry
+            self._entries = entries
+            self._loaded = True
+
+    def entries(self) -> List[ModelEntry]:
+        if not self._loaded:
+            self.refresh()
+        return list(self._entries.values())
+
+    def get(self, name: str) -> Optional[ModelEntry]:
+        """
+        Restituisce il modello `name` (solo nomi presenti nella cartella: niente
+        path traversal), aggiornandone l'hash se il file è cambiato su disco.
+        """
+        if not self._loaded:
+            self.refresh()
+        if not name or name.startswith(".") or "/" in name or "\\" in name:
+            return None
+        with self._lock:
+            entry = self._scan_file(self.folder / name)
+            if entry is None:
+                self._entries.pop(name, None)
+            else:
+                self._entries[name] = entry
+            return entry
+
+    # --------------------------------------------------------------------------
+    # Manifest
+    # --------------------------------------------------------------------------
+    def summary(self, entry: ModelEntry) -> Optional[dict]:
+        """
+        Header GLB e riepilogo del chunk JSON (vedi glb_tools.describe), letti
+        senza caricare il buffer binario; memorizzati per hash del contenuto.
+        """
+        if entry.sha256 in self._summaries:
+            return self._summaries[entry.sha256]
+        summary = None
+        if entry.name.lower().endswith(".glb"):
+            import glb_tools
+
+            try:
+                header, gltf = glb_tools.read_header(entry.path)
+                summary = {"header": header, **glb_tools.describe(gltf)}
+            except (ValueError, KeyError, IndexError, struct.error):
+                summary = None
+        self._summaries[entry.sha256] = summary
+        return summary
+
+    def manifest(self) -> dict:
+        """
+        Manifest di tutti i file (nome, dimensione, hash, riepilogo GLB). Viene
+        ricostruito solo quando cambia l'insieme (nome, hash) dei file; il campo
+        `etag` permette al client di rivalidarlo con una richiesta condizionale.
+        """
+        self.refresh()
+        entries = self.entries()
+        key = tuple((entry.name, entry.sha256) for entry in entries)
+        if self._manifest is not None and key == self._manifest_key:
+            return self._manifest
+        models = [
+            {
+                "name": entry.name,
+                "size": entry.size,
+                "sha256": entry.sha256,
+                "version": entry.version,
+                "media_type": entry.media_type,
+                "lod_levels": sorted(LOD_LEVELS) if entry.name.lower().endswith(".glb") else [],
+                "glb": self.summary(entry),
+            }
+            for entry in entries
+        ]
+        digest = hashlib.sha256("\n".join(f"{name}:{sha}" for name, sha in key).encode("utf-8")).hexdigest()
+        live = {entry.sha256 for entry in entries}
+        self._summaries = {sha: value for sha, value in self._summaries.items() if sha in live}
+        self._manifest, self._manifest_key = {"etag": f'"{digest}"', "models": models}, key
+        return self._manifest
+
+    # --------------------------------------------------------------------------
+    # Varianti LOD (solo GLB)
+    # --------------------------------------------------------------------------
+    def lod_path(self, entry: ModelEntry, level: int) -> Path:
+        return self.lod_folder / f"{entry.sha256}.lod{level}.glb"
+
+    def lod_entry(self, entry: ModelEntry, level: int) -> Optional[ModelEntry]:
+        """
+        Variante ottimizzata del modello al livello `level` (vedi LOD_LEVELS),
+        generata alla prima richiesta. Il nome del file contiene l'hash del
+        sorgente, quindi una variante non va mai invalidata: cambia il sorgente,
+        cambia il file. Ritorna None se il livello o il formato non sono supportati.
+        """
+        if level not in LOD_LEVELS or not entry.name.lower().endswith(".glb"):
+            return None
+        key = (entry.sha256, level)
+        cached = self._lod_entries.get(key)
+        if cached is not None:
+            return cached
+
+        with self._lod_lock:
+            cached = self._lod_entries.get(key)
+            if cached is not None:
+                return cached
+            path = self.lod_path(entry, level)
+            if not path.exists():
+                import glb_tools
+
+                try:
+                    optimized = glb_tools.optimize(glb_tools.GLB.load(entry.path), lod_ratio=LOD_LEVELS[level])
+                except (ValueError, KeyError, struct.error):
+                    return None
+                self.lod_folder.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_suffix(".glb.tmp")
+                tmp_path.write_bytes(optimized.to_bytes())
+                os.replace(tmp_path, path)
+            st = path.stat()
+            name = f"{Path(entry.name).stem}.lod{level}.glb"
+            lod = ModelEntry(name, path, st.st_size, st.st_mtime_ns, hash_file(path))
+            self._lod_entries[key] = lod
+        # Le varianti compresse della LOD vengono create in background
+        threading.Thread(target=self.precompress, args=(lod,), name="lod-precompress", daemon=True).start()
+        return lod
+
+    # --------------------------------------------------------------------------
+    # Varianti pre-compresse
+    # --------------------------------------------------------------------------
+    def variant_path(self, entry: ModelEntry, encoding: str) -> Path:
+        return self.compressed_folder / f"{entry.sha256}.{encoding}"
+
+    def variants(self, entry: ModelEntry) -> Dict[str, Tuple[Path, int]]:
+        """
+        Varianti già pronte per il modello: encoding -> (path, dimensione).
+        Le varianti che non riducono abbastanza la dimensione sono escluse.
+        """
+        available = {}
+        for encoding in COMPRESSORS:
+            path = self.variant_path(entry, encoding)
+            try:
+                size = path.stat().st_size
+            except OSError:
+                continue
+            if size < entry.size * MIN_COMPRESSION_GAIN:
+                available[encoding] = (path, size)
+        return available
+
+    def precompress(self, entry: ModelEntry) -> Dict[str, int]:
+        """Crea (se mancano) le varianti compresse di un modello; ritorna le dimensioni."""
+        self.compressed_folder.mkdir(parents=True, exist_ok=True)
+        data = None
+        sizes = {}
+        for encoding, compress in COMPRESSORS.items():
+            path = self.variant_path(entry, encoding)
+            if not path.exists():
+                if data is None:
+                    data = entry.path.read_bytes()
+                tmp_path = path.with_suffix(f".{encoding}.tmp")
+                tmp_path.write_bytes(compress(data))
+                os.replace(tmp_path, path)
+            sizes[encoding] = path.stat().st_size
+        return sizes
+
+    def precompress_all(self):
+        """
+        Stadio di pre-compressione (all'avvio o offline): crea le varianti per
+        ogni modello e rimuove quelle di contenuti non più presenti.
+        """
+        entries = self.entries()
+        for entry in entries:
+            self.precompress(entry)
+        sources = {entry.sha256 for entry in entries}
+        current = set(sources)
+        if self.lod_folder.is_dir():
+            for path in self.lod_folder.iterdir():
+                if path.name.split(".", 1)[0] not in sources:
+                    path.unlink(missing_ok=True)
+                elif path.suffix == ".glb":
+                    current.add(hash_file(path))
+        if self.compressed_folder.is_dir():
+            for path in self.compressed_folder.iterdir():
+                if path.name.split(".", 1)[0] not in current:
+                    path.unlink(missing_ok=True)
+
+
+# ------------------------------------------------------------------------------
+# CACHE IN MEMORIA DEI MODELLI "CALDI"
+# ------------------------------------------------------------------------------
+class HotModelCache:
+    """
+    Cache LRU limitata in byte di file mappati in memoria (mmap). Restituisce
+    memoryview da cui servire slice senza copie per richiesta.
+
+    Un file entra in cache solo dalla `admit_after`-esima richiesta (i file
+    freddi restano su FileResponse/sendfile) e solo se non supera `max_file_bytes`.
+    Alla rimozione la mappa non viene chiusa esplicitamente: le risposte ancora
+    in corso mantengono valide le loro slice e la memoria viene liberata quando
+    l'ultima viene rilasciata.
+    """
+
+    def __init__(self, max_bytes: int, max_file_bytes: int, admit_after: int = 2):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = min(max_file_bytes, max_bytes)
+        self.admit_after = admit_after
+        self._items: "OrderedDict[Tuple[str, str], memoryview]" = OrderedDict()
+        self._seen: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = self.misses = self.evictions = self.bypassed = 0
+
+    def get(self, path: Path, size: int, version: str) -> Optional[memoryview]:
+        """
+        memoryview del file se in cache (o appena ammesso); None se il file va
+        servito dal disco. `version` (hash) distingue contenuti diversi dello
+        stesso path.
+        """
+        if self.max_bytes <= 0 or size == 0 or size > self.max_file_bytes:
+            with self._lock:
+                self.bypassed += 1
+            return None
+        key = (str(path), version)
+        with self._lock:
+            view = self._items.get(key)
+            if view is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return view
+            self.misses += 1
+            seen = self._seen.pop(key, 0) + 1
+            if seen < self.admit_after:
+                self._seen[key] = seen
+                while len(self._seen) > 1024:
+                    self._seen.popitem(last=False)
+                return None
+
+        try:
+            with open(path, "rb") as f:
+                view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError):
+            return None
+        if len(view) != size:
+            return None  # File cambiato fra stat e apertura
+
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = view
+                self.size += size
+                while self.size > self.max_bytes and self._items:
+                    _, evicted = self._items.popitem(last=False)
+                    self.size -= len(evicted)
+                    self.evictions += 1
+            return self._items.get(key, view)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "max_file_bytes": self.max_file_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "files": [{"path": path, "version": version[:VERSION_LENGTH], "bytes": len(view)}
+                          for (path, version), view in reversed(self._items.items())],
+            }
+
+
+# ------------------------------------------------------------------------------
+# HEADER HTTP
+# ------------------------------------------------------------------------------
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Interpreta un header `Range: bytes=...` e restituisce gli intervalli
+    [start, end] inclusivi. Ritorna None se l'header è assente, malformato o
+    con troppi intervalli (la risposta sarà il file intero, come da RFC 9110);
+    solleva RangeNotSatisfiable se nessun intervallo cade nel file.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        if not sep:
+            return None
+        try:
+            if first == "":
+                # Suffisso: ultimi N byte
+                length = int(last)
+                if length <= 0:
+                    continue
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+            start = int(first)
+            end = int(last) if last else None
+        except ValueError:
+            return None
+        if end is not None and start > end:
+            return None
+        if start >= size:
+            continue
+        if end is None:
+            end = size - 1
+        ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable()
+    return ranges
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Confronto debole per If-None-Match (supporta liste e `*`)."""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in header.split(","))
+
+
+def negotiate_encoding(header: Optional[str], available) -> Optional[str]:
+    """
+    Sceglie la codifica da usare secondo Accept-Encoding (con q-values) fra
+    quelle disponibili, privilegiando l'ordine di COMPRESSORS a parità di q.
+    Ritorna None per la rappresentazione non compressa.
+    """
+    if not header or not available:
+        return None
+    weights = {}
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[token] = q
+
+    best, best_q = None, 0.0
+    for encoding in COMPRESSORS:
+        if encoding not in available:
+            continue
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+# ------------------------------------------------------------------------------
+# PRE-COMPRESSIONE OFFLINE E BENCHMARK
+# ------------------------------------------------------------------------------
+def _benchmark(catalog: ModelCatalog, mbps: float, rtt_ms: float):
+    """
+    Byte trasferiti e time-to-last-byte per modello e codifica: misurato
+    in-process (TestClient, nessuna rete) e stimato su un collegamento a
+    `mbps` Mbit/s con `rtt_ms` di latenza.
+    """
+    import time
+    from fastapi.testclient import TestClient
+
+    import file_hosting_api
+
+    # Il servizio legge il catalogo del modulo a ogni richiesta: lo sostituisce
+    # con quello di --folder, così le richieste servono gli stessi file elencati
+    served_catalog = file_hosting_api.catalog
+    file_hosting_api.catalog = catalog
+    try:
+        client = TestClient(file_hosting_api.app)
+        print(f"{'modello':32} {'codifica':9} {'byte':>10} {'ratio':>6} {'TTLB locale':>12} {'TTLB stimato':>13}")
+        for entry in catalog.entries():
+            for encoding in ["identity", *catalog.variants(entry)]:
+                start = time.perf_counter()
+                response = client.get(f"/models/{entry.name}", headers={"Accept-Encoding": encoding})
+                response.raise_for_status()
+                body = response.read() if hasattr(response, "read") else response.content
+                local_ms = (time.perf_counter() - start) * 1000
+                size = int(response.headers.get("content-length", len(body)))
+                estimated_ms = rtt_ms + size * 8 / (mbps * 1e6) * 1000
+                print(f"{entry.name:32} {encoding:9} {size:>10} {size / entry.size:>6.2f} "
+                      f"{local_ms:>10.1f}ms {estimated_ms:>11.0f}ms")
+    finally:
+        file_hosting_api.catalog = served_catalog
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pre-compressione e benchmark dei modelli 3D")
+    parser.add_argument("--folder", default="./models")
+    parser.add_argument("--precompress", action="store_true", help="crea le varianti compresse")
+    parser.add_argument("--benchmark", action="store_true", help="byte e time-to-last-byte per modello")
+    parser.add_argument("--mbps", type=float, default=20.0)
+    parser.add_argument("--rtt-ms", type=float, default=40.0)
+    args = parser.parse_args()
+
+    models = ModelCatalog(Path(args.folder))
+    if args.precompress:
+        models.precompress_all()
+        print(f"Varianti create in {models.compressed_folder} ({', '.join(COMPRESSORS)})")
+    if args.benchmark:
+        _benchmark(models, args.mbps, args.rtt_ms)
@@ -0,0 +1,389 @@
+"""
+Ricerca full-text e a faccette sulle anagrafiche di ogni tenant.
+
+L'indice è invertito e in memoria, costruito una volta per tenant (senza
+leggere analysis_history) e poi aggiornato in modo incrementale da
+patients_api a ogni creazione, modifica ed eliminazione. Come gli indici di
+analysis_index, se la versione dei dati del tenant cambia altrove l'indice
+viene ricostruito al primo accesso.
+
+- testo: nome, cognome, address, skin_types e issues; ogni parola della
+  query deve essere il prefisso di una parola del paziente, senza distinzione
+  di maiuscole e accenti ("nicolo" trova "Nicolò")
+- filtri e faccette: gender, skin_types, issues (conteggi sul risultato)
+- ordinamento: cognome, nome
+
+Benchmark (100k pazienti sintetici):
+    python patient_search.py --patients 100000
+"""
+import bisect
+import functools
+import itertools
+import re
+import unicodedata
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from analysis_index import TenantIndex
+from storage import get_storage
+
+SEARCH_FIELDS = ("nome", "cognome", "address", "skin_types", "issues")
+FACET_FIELDS = ("gender", "skin_types", "issues")
+SUMMARY_FIELDS = ("id", "nome", "cognome", "birth_date", "address", "gender", "skin_types", "issues",
+                  "created_at", "source_user")
+
+_WORD = re.compile(r"\w+")
+_PREFIX_END = "\U0010ffff"
+# Fino a questo numero di risultati si ordinano direttamente, oltre si scorre l'ordinamento globale
+SORT_THRESHOLD = 4096
+
+
+def normalize_text(text: str) -> str:
+    """Minuscolo e senza accenti (decomposizione NFKD, segni diacritici rimossi)."""
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+@functools.lru_cache(maxsize=65536)
+def tokenize(text: str) -> Tuple[str, ...]:
+    # Nomi, città e valori delle faccette si ripetono molto: la cache evita di rinormalizzarli
+    return tuple(_WORD.findall(normalize_text(text)))
+
+
+def _values(record: dict, field: str) -> List[str]:
+    value = record.get(field)
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value if v is not None]
+    return [str(value)]
+
+
+def _sort_key(summary: dict) -> tuple:
+    return (normalize_text(str(summary.get("cognome") or "")), normalize_text(str(summary.get("nome") or "")),
+            str(summary.get("id") or ""))
+
+
+class _Facet:
+    """Matrice booleana valore x documento di un campo (anche multi-valore)."""
+
+    def __init__(self, capacity: int):
+        self.values: List[str] = []
+        self.codes: Dict[str, int] = {}
+        self.matrix = np.zeros((0, capacity), dtype=bool)
+
+    def grow(self, capacity: int):
+        grown = np.zeros((self.matrix.shape[0], capacity), dtype=bool)
+        grown[:, :self.matrix.shape[1]] = self.matrix
+        self.matrix = grown
+
+    def set(self, doc: int, values: List[str]):
+        self.matrix[:, doc] = False
+        for value in values:
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.values)
+                self.values.append(value)
+                self.matrix = np.vstack([self.matrix, np.zeros((1, self.matrix.shape[1]), dtype=bool)])
+            self.matrix[code, doc] = True
+
+    def row(self, value: str) -> Optional[np.ndarray]:
+        code = self.codes.get(value)
+        return None if code is None else self.matrix[code]
+
+    def counts(self, mask: np.ndarray) -> Dict[str, int]:
+        n = len(mask)
+        counts = np.count_nonzero(self.matrix[:, :n] & mask, axis=1)
+        return {value: int(count) for value, count in zip(self.values, counts) if count}
+
+
+class TenantSearch:
+    """
+    Indice di un tenant. I documenti sono numerati (i numeri dei pazienti
+    eliminati vengono riusati); per ogni parola normalizzata c'è l'insieme dei
+    documenti che la contengono e le parole sono tenute ordinate, così la
+    ricerca per prefisso è un intervallo trovato con bisect.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self.docs: List[Optional[dict]] = []
+        self.doc_terms: List[Set[str]] = []
+        self.positions: Dict[str, int] = {}
+        self.free: List[int] = []
+        self.postings: Dict[str, Set[int]] = {}
+        self.terms: List[str] = []
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.facets = {field: _Facet(capacity) for field in FACET_FIELDS}
+        self.keys: List[Optional[tuple]] = []
+        self.order: List[tuple] = []  # chiavi (cognome, nome, id, doc) ordinate
+        # Maschere dei prefissi di un carattere (migliaia di parole ciascuno), aggiornate a ogni modifica
+        self.prefix_masks: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    # -- aggiornamento ---------------------------------------------------------
+    def _grow(self, needed: int):
+        if needed <= self.capacity:
+            return
+        capacity = max(needed, 2 * self.capacity)
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self.capacity] = self.alive
+        self.alive = alive
+        for facet in self.facets.values():
+            facet.grow(capacity)
+        for prefix, mask in self.prefix_masks.items():
+            self.prefix_masks[prefix] = np.concatenate([mask, np.zeros(capacity - self.capacity, dtype=bool)])
+        self.capacity = capacity
+
+    def add(self, record: dict, keep_sorted: bool = True):
+        """
+        Indicizza il paziente (sostituisce quello con lo stesso id, se presente).
+        Con keep_sorted=False (costruzione in blocco) parole e ordinamento vanno
+        sistemati alla fine con `finish_bulk`.
+        """
+        patient_id = str(record.get("id"))
+        if patient_id in self.positions:
+            self.remove(patient_id)
+        if self.free:
+            doc = self.free.pop()
+        else:
+            doc = len(self.docs)
+            self._grow(doc + 1)
+            self.docs.append(None)
+            self.keys.append(None)
+            self.doc_terms.append(set())
+
+        terms = {token for field in SEARCH_FIELDS for value in _values(record, field) for token in tokenize(value)}
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = set()
+                if keep_sorted:
+                    bisect.insort(self.terms, term)
+            posting.add(doc)
+        for field, facet in self.facets.items():
+            facet.set(doc, _values(record, field))
+
+        for prefix, mask in self.prefix_masks.items():
+            mask[doc] = any(term.startswith(prefix) for term in terms)
+
+        summary = self.docs[doc] = {field: record.get(field) for field in SUMMARY_FIELDS}
+        key = self.keys[doc] = _sort_key(summary) + (doc,)
+        if keep_sorted:
+            bisect.insort(self.order, key)
+        else:
+            self.order.append(key)
+        self.doc_terms[doc] = terms
+        self.positions[patient_id] = doc
+        self.alive[doc] = True
+
+    def finish_bulk(self):
+        self.terms = sorted(self.postings)
+        self.order.sort()
+
+    def remove(self, patient_id: str) -> bool:
+        doc = self.positions.pop(str(patient_id), None)
+        if doc is None:
+            return False
+        for term in self.doc_terms[doc]:
+            posting = self.postings[term]
+            posting.discard(doc)
+            if not posting:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+        for facet in self.facets.values():
+            facet.set(doc, [])
+        for mask in self.prefix_masks.values():
+            mask[doc] = False
+        del self.order[bisect.bisect_left(self.order, self.keys[doc])]
+        self.docs[doc] = None
+        self.keys[doc] = None
+        self.doc_terms[doc] = set()
+        self.alive[doc] = False
+        self.free.append(doc)
+        return True
+
+    # -- ricerca ---------------------------------------------------------------
+    def _prefix_mask(self, prefix: str) -> np.ndarray:
+        cached = self.prefix_masks.get(prefix)
+        if cached is not None:
+            return cached[:len(self.docs)]
+        mask = np.zeros(self.capacity if len(prefix) == 1 else len(self.docs), dtype=bool)
+        lo = bisect.bisect_left(self.terms, prefix)
+        hi = bisect.bisect_left(self.terms, prefix + _PREFIX_END, lo)
+        if hi > lo:
+            docs = np.fromiter(itertools.chain.from_iterable(self.postings[t] for t in self.terms[lo:hi]),
+                               dtype=np.int64)
+            mask[docs] = True
+        if len(prefix) == 1:
+            self.prefix_masks[prefix] = mask
+        return mask[:len(self.docs)]
+
+    def _page(self, mask: np.ndarray, matches: np.ndarray, start: int, stop: int) -> List[int]:
+        """Documenti fra le posizioni [start, stop) dei risultati ordinati per cognome, nome."""
+        if len(matches) <= SORT_THRESHOLD:
+            keys = sorted(self.keys[doc] for doc in matches.tolist())
+            return [key[-1] for key in keys[start:stop]]
+        # Molti risultati: si scorre l'ordinamento globale finché la pagina è completa
+        page: List[int] = []
+        for pos, doc in enumerate(key[-1] for key in self.order if mask[key[-1]]):
+            if pos >= stop:
+                break
+            if pos >= start:
+                page.append(doc)
+        return page
+
+    def search(self, query: str = "", filters: Optional[Dict[str, List[str]]] = None,
+               limit: int = 20, offset: int = 0) -> dict:
+        n = len(self.docs)
+        mask = self.alive[:n].copy()
+        for token in dict.fromkeys(tokenize(query or "")):
+            mask &= self._prefix_mask(token)
+            if not mask.any():
+                break
+        for field, values in (filters or {}).items():
+            for value in values:
+                row = self.facets[field].row(value)
+                if row is None:
+                    mask[:] = False
+                else:
+                    mask &= row[:n]
+
+        matches = np.flatnonzero(mask)
+        total = len(matches)
+        wanted = min(offset + limit, total)
+        items: List[dict] = []
+        if wanted > offset:
+            items = [self.docs[doc] for doc in self._page(mask, matches, offset, wanted)]
+        return {
+            "total": total,
+            "items": items,
+            "facets": {field: facet.counts(mask) for field, facet in self.facets.items()},
+        }
+
+
+class PatientSearchIndex(TenantIndex):
+    """Indice di ricerca per tenant con aggiornamenti incrementali da patients_api."""
+
+    def _load(self, tenant: str) -> List[dict]:
+        return self._storage.stamp(tenant, list(self._storage.iter_patients(tenant, skip_history=True)))
+
+    def _build(self, tenant: str, patients: List[dict]) -> TenantSearch:
+        index = TenantSearch(capacity=max(1024, len(patients)))
+        for patient in patients:
+            index.add(patient, keep_sorted=False)
+        index.finish_bulk()
+        return index
+
+    def search(self, tenant: str, query: str = "", filters: Optional[Dict[str, List[str]]] = None,
+               limit: int = 20, offset: int = 0) -> dict:
+        with self._lock:
+            return self._current(tenant).search(query, filters, limit, offset)
+
+    def on_upsert(self, tenant: str, record: dict):
+        """Paziente creato o modificato (da chiamare dopo il salvataggio, poi mark_synced)."""
+        with self._lock:
+            if tenant in self._data:
+                self._data[tenant].add({**record, "source_user": record.get("source_user") or tenant})
+
+    def on_delete(self, tenant: str, patient_id: str):
+        with self._lock:
+            if tenant in self._data:
+                self._data[tenant].remove(patient_id)
+
+
+def merge_results(results: List[dict], limit: int, offset: int) -> dict:
+    """Unisce le ricerche di più tenant (admin): totali e faccette sommati, pagina riordinata."""
+    items = sorted((item for result in results for item in result["items"]), key=_sort_key)
+    facets: Dict[str, Dict[str, int]] = {field: {} for field in FACET_FIELDS}
+    for result in results:
+        for field, counts in result["facets"].items():
+            for value, count in counts.items():
+                facets[field][value] = facets[field].get(value, 0) + count
+    return {
+        "total": sum(result["total"] for result in results),
+        "items": items[offset:offset + limit],
+        "facets": facets,
+    }
+
+
+# Indice condiviso dai servizi dello stesso processo (patients_api e agent_api, anche tramite il gateway)
+search_index = PatientSearchIndex(get_storage())
+
+
+# ------------------------------------------------------------------------------
+# BENCHMARK
+# ------------------------------------------------------------------------------
+if __name__ == "__main__":
+    import argparse
+    import random
+    import time
+    import uuid
+
+    parser = argparse.ArgumentParser(description="Latenza della ricerca pazienti su un tenant sintetico")
+    parser.add_argument("--patients", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    first = ["Maria", "Giulia", "Nicolò", "Luca", "Francesca", "Andrea", "Chiara", "Matteo", "Sofia", "Niccolò",
+             "Elena", "Marco", "Alessandro", "Giorgia", "Federico", "Martina", "Lorenzo", "Anna", "Davide", "Sara"]
+    last = ["Rossi", "Bianchi", "Esposito", "Romano", "Colombo", "Ricci", "Marino", "Greco", "Bruno", "Gallo",
+            "Conti", "De Luca", "Mancini", "Costa", "Giordano", "Rizzo", "Lombardi", "Moretti", "Barbieri", "Fontana"]
+    streets = ["Via Roma", "Corso Italia", "Via Garibaldi", "Piazza Duomo", "Via Mazzini", "Viale Europa"]
+    cities = ["Milano", "Torino", "Napoli", "Firenze", "Bologna", "Forlì", "Cantù", "Palermo"]
+    skin_types = ["Pelle secca", "Pelle grassa", "Pelle mista", "Pelle mista grassa", "Pelle sensibile",
+                  "Pelle normale"]
+    issues = ["Acne", "Rughe", "Macchie", "Rossori", "Ruvida", "Pori dilatati", "Disidratazione", "Couperose"]
+    patients = [{
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "nome": rng.choice(first),
+        "cognome": f"{rng.choice(last)}{rng.randrange(2000)}" if rng.random() < 0.5 else rng.choice(last),
+        "birth_date": f"{rng.randrange(1940, 2010)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+        "address": f"{rng.choice(streets)} {rng.randrange(1, 200)}, {rng.choice(cities)}",
+        "gender": rng.choice(["Uomo", "Donna"]),
+        "skin_types": rng.sample(skin_types, rng.randrange(1, 3)),
+        "issues": rng.sample(issues, rng.randrange(0, 4)),
+    } for _ in range(args.patients)]
+
+    start = time.perf_counter()
+    index = TenantSearch(capacity=len(patients))
+    for patient in patients:
+        index.add(patient, keep_sorted=False)
+    index.finish_bulk()
+    print(f"costruzione: {len(index)} pazienti, {len(index.terms)} parole in {time.perf_counter() - start:.2f} s")
+
+    queries = [
+        ("tutti + faccette", "", None),
+        ("tutti, pagina 50", "", None),
+        ("prefisso 1 lettera", "m", None),
+        ("nome", "nicolo", None),
+        ("nome e cognome", "maria ross", None),
+        ("cognome esatto", "rossi1234", None),
+        ("città + faccetta", "forli", {"gender": ["Donna"]}),
+        ("filtri", "", {"skin_types": ["Pelle sensibile"], "issues": ["Acne", "Rughe"]}),
+    ]
+    for label, query, filters in queries:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = index.search(query, filters, limit=20, offset=980 if "pagina" in label else 0)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print(f"{label:20} q={query!r:14} {result['total']:7} risultati  "
+              f"p50 {1000 * timings[len(timings) // 2]:.2f} ms  max {1000 * timings[-1]:.2f} ms")
+
+    start = time.perf_counter()
+    for patient in patients[:1000]:
+        index.add({**patient, "nome": "Modificato"})
+        index.remove(patient["id"])
+        index.add(patient)
+    print(f"1000 x (modifica, eliminazione, creazione): {1000 * (time.perf_counter() - start):.1f} ms")
+    start = time.perf_counter()
+    result = index.search("m", limit=20)
+    print(f"prima ricerca dopo le modifiche: {1000 * (time.perf_counter() - start):.2f} ms")
@@ -1,18 +1,30 @@
-import os
+import hashlib
 import json
-import bcrypt
+import os
+import tempfile
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, Form, Query
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import List, Dict, Any
-from uuid import uuid4
 
-from utils import verify_credentials  # la tua funzione di verifica password
+import jsonpatch
+import jsonpointer
+from fastapi import FastAPI, HTTPException, Form, Header, Query, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Dict, Any, AsyncIterator, Iterable, Iterator, Optional, Tuple
+
+from change_log import CHANGES_HEARTBEAT, change_log
+from idempotency import IdempotencyMiddleware
+from io_executor import io_executor, io_stats, loop_lag
+from metrics import inc, instrument_app, instrument_storage
+from patient_search import merge_results, search_index
+from storage import get_storage
+from utils import verify_credentials, verify_admin_credentials, paginate_items
 
 app = FastAPI(root_path="/api3")
 
+# Idempotency-Key sulle richieste di modifica (interno a CORS: le ripetizioni ricevono gli header CORS)
+app.add_middleware(IdempotencyMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -20,6 +32,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Metriche delle richieste e GET /metrics (METRICS_ENABLED=0 per disattivarle)
+instrument_app(app, "patients")
+
+# Persistenza condivisa con gli altri servizi (backend scelto con STORAGE_BACKEND).
+# Gli endpoint sono async: ogni accesso allo storage e ogni verifica bcrypt
+# passa dal pool io_executor per non bloccare l'event loop. I tempi delle
+# chiamate allo storage finiscono nelle metriche (stage "storage.<metodo>").
+storage = instrument_storage(get_storage())
 
 # Modello per una singola anagrafica
 class Anagrafica(BaseModel):
@@ -35,101 +55,394 @@ class Anagrafica(BaseModel):
     issues: List[str]
     analysis_history: List[Dict[str, Any]] = []
 
+
+# Campi modificabili con PATCH: id e storico analisi (solo append da agent_api) restano fuori
+PATCHABLE_FIELDS = frozenset(Anagrafica.__fields__) - {"id", "analysis_history"}
+# L'ETag copre i dati anagrafici: una nuova analisi non invalida le modifiche in corso
+ETAG_EXCLUDED_FIELDS = ("analysis_history", "source_user")
+
+# Import NDJSON: righe validate a blocchi nel pool di I/O e parcheggiate in un file
+# temporaneo (su disco oltre IMPORT_SPOOL_BYTES), poi scritte a blocchi di IMPORT_WRITE_CHUNK
+IMPORT_CHUNK_LINES = int(os.getenv("IMPORT_CHUNK_LINES", "1000"))
+IMPORT_WRITE_CHUNK = int(os.getenv("IMPORT_WRITE_CHUNK", "5000"))
+IMPORT_MAX_RECORDS = int(os.getenv("IMPORT_MAX_RECORDS", "200000"))
+IMPORT_MAX_LINE_BYTES = int(os.getenv("IMPORT_MAX_LINE_BYTES", str(1024 * 1024)))
+IMPORT_SPOOL_BYTES = int(os.getenv("IMPORT_SPOOL_BYTES", str(8 * 1024 * 1024)))
+IMPORT_MAX_ERRORS = 100
+
 # ------------------------------------------------------------------------
 #  FUNZIONI DI SUPPORTO
 # ------------------------------------------------------------------------
 
 
-def get_user_anagrafiche_file(username: str) -> str:
+def load_user_anagrafiche(username: str) -> List[dict]:
     """
-    Ritorna il path del file anagrafiche per lo user specificato:
-    user_data/<username>/anagrafiche.json
-
-    Se la cartella user_data/<username> non esiste, la crea.
+    Carica la lista di anagrafiche dell'utente (lista vuota se non ne ha).
     """
-    user_folder = os.path.join("user_data", username)
-    if not os.path.exists(user_folder):
-        os.makedirs(user_folder)
-    return os.path.join(user_folder, "anagrafiche.json")
+    return storage.load_patients(username)
 
 
-def load_user_anagrafiche(username: str) -> List[dict]:
+def iter_visible_anagrafiche(username: str, skip_history: bool = False) -> Iterator[dict]:
     """
-    Carica la lista di anagrafiche dal file dell'utente.
-    Se il file non esiste o è vuoto, ritorna lista vuota.
+    Anagrafiche visibili all'utente, lette una alla volta:
+    quelle di tutti gli utenti per l'admin, altrimenti solo le proprie.
     """
-    user_anagrafiche_path = get_user_anagrafiche_file(username)
-    if not os.path.isfile(user_anagrafiche_path):
-        return []
-    try:
-        with open(user_anagrafiche_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
-
+    tenants = storage.list_tenants() if username == "admin" else [username]
+    for tenant in tenants:
+        yield from storage.iter_patients(tenant, skip_history=skip_history)
 
-def load_all_anagrafiche(username: str):
-    if username != "admin":
-        return []
 
-    users = []
-    for user_file in os.listdir("users"):
-        users.append(user_file.replace(".json", ""))
+def stream_ndjson(records: Iterable[dict]) -> Iterator[bytes]:
+    """Un record JSON per riga, così come è salvato (created_at e storico compresi)."""
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
 
-    anagrafiche = []
-    for user_name in users:
-        anagrafiche.extend(load_user_anagrafiche(user_name))
 
-    return anagrafiche
+def validate_import_lines(lines: List[Optional[bytes]], first_line: int,
+                          created_at: str) -> Tuple[List[tuple], List[dict]]:
+    """
+    Valida un blocco di righe NDJSON come Anagrafica (None = riga oltre
+    IMPORT_MAX_LINE_BYTES, già scartata). Ritorna le coppie (numero di riga,
+    record) valide e gli errori per riga; created_at dell'export originale
+    viene conservato.
+    """
+    records, errors = [], []
+    for line_number, line in enumerate(lines, first_line):
+        if line is None:
+            errors.append({"line": line_number, "error": f"Riga oltre {IMPORT_MAX_LINE_BYTES} byte."})
+            continue
+        if not line.strip():
+            continue
+        try:
+            raw = json.loads(line)
+            record = Anagrafica(**raw).dict()
+        except ValidationError as e:
+            errors.append({"line": line_number, "error": [err["msg"] + " (" + ".".join(map(str, err["loc"])) + ")"
+                                                          for err in e.errors()]})
+            continue
+        except (ValueError, TypeError) as e:
+            errors.append({"line": line_number, "error": f"JSON non valido: {e}"})
+            continue
+        record["created_at"] = raw["created_at"] if isinstance(raw.get("created_at"), str) else created_at
+        records.append((line_number, record))
+    return records, errors
+
+
+def spool_import_lines(spool, lines: List[Optional[bytes]], first_line: int,
+                       created_at: str) -> Tuple[List[tuple], List[dict]]:
+    """
+    Valida un blocco e accoda i record validi al file temporaneo dell'import
+    (una riga JSON [numero di riga, record] ciascuno). Ritorna le coppie
+    (numero di riga, id) e gli errori per riga.
+    """
+    records, errors = validate_import_lines(lines, first_line, created_at)
+    spool.writelines(json.dumps([line_number, record], ensure_ascii=False).encode("utf-8") + b"\n"
+                     for line_number, record in records)
+    return [(line_number, record["id"]) for line_number, record in records], errors
 
 
-def save_user_anagrafiche(username: str, anagrafiche_list: List[dict]):
+def import_anagrafiche(username: str, spool, ids: List[tuple], errors: List[dict], error_count: int,
+                       skip_invalid: bool) -> dict:
+    """
+    Scrive le anagrafiche parcheggiate in `spool` a blocchi di
+    IMPORT_WRITE_CHUNK, sotto il lock del tenant. Gli id già presenti (o
+    ripetuti nel file) sono errori, controllati prima di scrivere: senza
+    skip_invalid basta un errore per non importare nulla.
+    """
+    with storage.tenant_lock(username):
+        seen = {patient.get("id") for patient in storage.iter_patients(username, skip_history=True)}
+        duplicates = set()
+        for line_number, patient_id in ids:
+            if patient_id in seen:
+                duplicates.add(line_number)
+                if len(duplicates) <= IMPORT_MAX_ERRORS:
+                    errors.append({"line": line_number, "error": f"id già presente: {patient_id}"})
+                continue
+            seen.add(patient_id)
+        error_count += len(duplicates)
+        errors.sort(key=lambda error: error["line"])
+        if error_count and not skip_invalid:
+            raise HTTPException(status_code=422, detail={
+                "message": "Import annullato: nessuna anagrafica salvata.",
+                "error_count": error_count, "errors": errors[:IMPORT_MAX_ERRORS]})
+
+        # Molti record: l'indice di ricerca si ricostruisce alla prossima ricerca
+        reindex = len(ids) - len(duplicates) > IMPORT_CHUNK_LINES
+        imported = 0
+
+        def write(batch: List[dict]):
+            storage.create_patients(username, batch)
+            if not reindex:
+                for record in batch:
+                    search_index.on_upsert(username, record)
+                search_index.mark_synced(username)
+            change_log.record(username, [("create", record["id"], None) for record in batch])
+
+        spool.seek(0)
+        batch = []
+        for row in spool:
+            line_number, record = json.loads(row)
+            if line_number in duplicates:
+                continue
+            batch.append(record)
+            if len(batch) >= IMPORT_WRITE_CHUNK:
+                write(batch)
+                imported += len(batch)
+                batch = []
+        if batch:
+            write(batch)
+            imported += len(batch)
+        if reindex:
+            search_index.invalidate(username)
+    return {"message": "Import completato", "imported": imported, "skipped": error_count,
+            "errors": errors[:IMPORT_MAX_ERRORS]}
+
+
+def stream_json_array(records: Iterable[dict]) -> Iterator[bytes]:
+    """
+    Serializza le anagrafiche come array JSON un record alla volta (stessa
+    forma di response_model=List[Anagrafica]), senza costruire la lista intera.
+    Lo status 200 è già partito: un record non valido (dati storici) viene
+    escluso e registrato, così l'array si chiude sempre.
     """
-    Salva la lista di anagrafiche nel file dell'utente, in user_data/<username>/anagrafiche.json
+    yield b"["
+    first = True
+    for record in records:
+        try:
+            item = json.dumps(Anagrafica(**record).dict(), ensure_ascii=False).encode("utf-8")
+        except (ValidationError, TypeError) as e:
+            source = record if isinstance(record, dict) else {}
+            fields = sorted({".".join(map(str, err["loc"])) for err in e.errors()}) if isinstance(e, ValidationError) else [str(e)]
+            print(f"Anagrafica non valida esclusa dall'elenco "
+                  f"(id={source.get('id')}, utente={source.get('source_user')}): {', '.join(fields)}")
+            inc("anagrafiche_invalid_records_total")
+            continue
+        yield item if first else b"," + item
+        first = False
+    yield b"]"
+
+
+def sorted_page(username: str, page: int, page_size: int) -> dict:
     """
-    user_anagrafiche_path = get_user_anagrafiche_file(username)
-    for anagrafica in anagrafiche_list:
-        anagrafica["source_user"] = username
-    with open(user_anagrafiche_path, "w", encoding="utf-8") as f:
-        json.dump(anagrafiche_list, f, indent=4, ensure_ascii=False)
+    Pagina delle anagrafiche di `username` ordinate per created_at decrescente.
+    Un primo passaggio legge solo le date (senza analysis_history), il secondo
+    carica per intero solo i record della pagina.
+    """
+    version = storage.tenant_version(username)
+    keys = [record.get("created_at") or "" for record in storage.iter_patients(username, skip_history=True)]
+    order = sorted(range(len(keys)), key=lambda pos: keys[pos], reverse=True)
+    paginated = paginate_items(order, page, page_size)
+
+    wanted = {pos: rank for rank, pos in enumerate(paginated["items"])}
+    items: List[Optional[dict]] = [None] * len(wanted)
+    if wanted:
+        for pos, record in enumerate(storage.iter_patients(username)):
+            if pos in wanted:
+                items[wanted[pos]] = record
+    if storage.tenant_version(username) != version or any(item is None for item in items):
+        # Dati modificati fra i due passaggi: ordinamento sulla lista completa
+        records = load_user_anagrafiche(username)
+        records.sort(key=lambda x: x.get("created_at") or "", reverse=True)
+        return paginate_items(records, page, page_size)
+    paginated["items"] = items
+    return paginated
+
+
+def record_etag(record: dict) -> str:
+    """ETag (forte) dei dati anagrafici del record."""
+    data = {key: value for key, value in record.items() if key not in ETAG_EXCLUDED_FIELDS}
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return '"' + hashlib.sha1(payload.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def check_if_match(record: dict, if_match: Optional[str]):
+    """412 se l'header If-Match (lista di ETag o `*`) non contiene l'ETag attuale del record."""
+    if if_match is None:
+        return
+    tags = [tag.strip().removeprefix("W/") for tag in if_match.split(",")]
+    if "*" not in tags and record_etag(record) not in tags:
+        raise HTTPException(status_code=412, detail="L'anagrafica è stata modificata nel frattempo (ETag diverso).")
+
+
+def merge_patch(target, patch):
+    """JSON Merge Patch (RFC 7396): i valori null rimuovono il campo."""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def patch_roots(operations: list) -> set:
+    """Campi di primo livello toccati dalle operazioni di un JSON Patch (RFC 6902)."""
+    roots = set()
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise HTTPException(status_code=422, detail="JSON Patch non valido: ogni operazione deve essere un oggetto.")
+        for key in ("path", "from"):
+            if key in operation:
+                try:
+                    parts = jsonpointer.JsonPointer(str(operation[key])).parts
+                except jsonpointer.JsonPointerException as e:
+                    raise HTTPException(status_code=422, detail=f"JSON Patch non valido: {e}")
+                roots.add(parts[0] if parts else "")
+    return roots
+
+
+def patched_anagrafica(current: dict, body, json_patch: bool, if_match: Optional[str]) -> dict:
+    """
+    Nuovo record dopo il patch (eseguito nella sezione critica dello storage):
+    controllo dell'ETag, patch sui soli campi modificabili, validazione del
+    risultato come Anagrafica. Storico analisi e metadati restano invariati.
+    """
+    check_if_match(current, if_match)
+    touched = patch_roots(body) if json_patch else set(body)
+    if touched - PATCHABLE_FIELDS:
+        raise HTTPException(status_code=422,
+                            detail=f"Campi non modificabili: {', '.join(sorted(touched - PATCHABLE_FIELDS)) or '/'}")
+
+    editable = {key: value for key, value in current.items() if key in PATCHABLE_FIELDS}
+    if json_patch:
+        try:
+            editable = jsonpatch.apply_patch(editable, body)
+        except jsonpatch.JsonPatchTestFailed as e:
+            raise HTTPException(status_code=409, detail=f"Test del JSON Patch non superato: {e}")
+        except (jsonpatch.JsonPatchConflict, jsonpointer.JsonPointerException) as e:
+            raise HTTPException(status_code=409, detail=f"JSON Patch non applicabile: {e}")
+        except jsonpatch.InvalidJsonPatch as e:
+            raise HTTPException(status_code=422, detail=f"JSON Patch non valido: {e}")
+    else:
+        editable = merge_patch(editable, body)
+
+    try:
+        validated = Anagrafica(id=current.get("id"), **editable).dict(include=PATCHABLE_FIELDS)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    result = {key: value for key, value in current.items() if key not in PATCHABLE_FIELDS}
+    result.update(validated)
+    return result
+
 
+def insert_anagrafica(username: str, record: dict) -> dict:
+    """
+    Salva la nuova anagrafica e la aggiunge all'indice di ricerca
+    (sotto il lock del tenant, così l'indice resta allineato al file).
+    """
+    with storage.tenant_lock(username):
+        created = storage.create_patient(username, record)
+        search_index.on_upsert(username, created)
+        search_index.mark_synced(username)
+        change_log.record(username, [("create", created["id"], None)])
+        return created
 
-def verify_admin_credentials(admin_username: str, admin_password: str):
-    if admin_username.upper() != "ADMIN":
-        raise HTTPException(status_code=403, detail="Accesso non autorizzato")
 
-    admin_file = os.path.join("users", "admin.json")
-    if not os.path.isfile(admin_file):
-        raise HTTPException(status_code=401, detail="Credenziali admin non valide")
+def replaced_anagrafica(current: dict, updated_dict: dict, if_match: Optional[str]) -> dict:
+    """
+    Nuovo record per la PUT (eseguito nella sezione critica dello storage):
+    controllo dell'ETag e sostituzione dei dati anagrafici. ID, data di
+    creazione, storico analisi e source_user restano quelli salvati: l'ETag
+    non copre lo storico, e la copia del client cancellerebbe le analisi
+    aggiunte dopo la sua lettura.
+    """
+    check_if_match(current, if_match)
+    result = {key: value for key, value in updated_dict.items() if key not in ETAG_EXCLUDED_FIELDS}
+    result["id"] = current.get("id")
+    for key in ("created_at", *ETAG_EXCLUDED_FIELDS):
+        if key in current:
+            result[key] = current[key]
+    return result
 
-    try:
-        with open(admin_file, "r", encoding="utf-8") as f:
-            admin_data = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        raise HTTPException(status_code=401, detail="Credenziali admin non valide")
 
-    hashed_pw = admin_data.get("hashed_password", "").encode("utf-8")
-    if not bcrypt.checkpw(admin_password.encode("utf-8"), hashed_pw):
-        raise HTTPException(status_code=401, detail="Credenziali admin non valide")
+def replace_anagrafica(username: str, anagrafica_id: str, updated_dict: dict,
+                       if_match: Optional[str] = None) -> dict:
+    """
+    Sostituisce i campi dell'anagrafica conservando ID, data di creazione e
+    storico analisi (lettura e scrittura nella sezione critica dello storage).
+    """
+    with storage.tenant_lock(username):
+        updated = storage.patch_patient(
+            username, anagrafica_id, lambda current: replaced_anagrafica(current, updated_dict, if_match))
+        if updated is None:
+            raise HTTPException(status_code=404, detail="Anagrafica non trovata.")
+        search_index.on_upsert(username, updated)
+        search_index.mark_synced(username)
+        change_log.record(username, [("update", anagrafica_id, None)])
+        return updated
+
+
+def modify_anagrafica(username: str, anagrafica_id: str, body, json_patch: bool,
+                      if_match: Optional[str]) -> dict:
+    """Applica un JSON Patch / Merge Patch all'anagrafica; lo storage salva solo i campi cambiati."""
+    with storage.tenant_lock(username):
+        updated = storage.patch_patient(
+            username, anagrafica_id, lambda current: patched_anagrafica(current, body, json_patch, if_match))
+        if updated is None:
+            raise HTTPException(status_code=404, detail="Anagrafica non trovata.")
+        search_index.on_upsert(username, updated)
+        search_index.mark_synced(username)
+        change_log.record(username, [("update", anagrafica_id, None)])
+        return updated
+
+
+def remove_anagrafica(username: str, anagrafica_id: str) -> Optional[dict]:
+    """Elimina l'anagrafica e la toglie dall'indice di ricerca; None se non esiste."""
+    with storage.tenant_lock(username):
+        deleted = storage.delete_patient(username, anagrafica_id)
+        if deleted is not None:
+            search_index.on_delete(username, anagrafica_id)
+            search_index.mark_synced(username)
+            change_log.record(username, [("delete", anagrafica_id, None)])
+        return deleted
+
+
+def search_visible_anagrafiche(username: str, q: str, filters: Dict[str, List[str]],
+                               limit: int, offset: int) -> dict:
+    """
+    Ricerca sulle anagrafiche visibili all'utente; per l'admin unisce i
+    risultati di tutti i tenant (ogni tenant restituisce le prime offset+limit).
+    """
+    if username != "admin":
+        return search_index.search(username, q, filters, limit, offset)
+    results = [search_index.search(tenant, q, filters, offset + limit, 0) for tenant in storage.list_tenants()]
+    return merge_results(results, limit, offset)
 
 
-def paginate_items(items: List[Any], page: int, page_size: int) -> dict:
-    total_items = len(items)
-    total_pages = (total_items + page_size - 1) // page_size if total_items > 0 else 0
+def changes_tenant(username: str, tenant: Optional[str]) -> str:
+    """Tenant di cui leggere le modifiche: il proprio, oppure uno qualsiasi per l'admin."""
+    if tenant is None or tenant == username:
+        return username
+    if username != "admin":
+        raise HTTPException(status_code=403, detail="Solo l'admin può leggere le modifiche di altri utenti")
+    return tenant
 
-    start = (page - 1) * page_size
-    end = start + page_size
 
-    return {
-        "page": page,
-        "page_size": page_size,
-        "total_items": total_items,
-        "total_pages": total_pages,
-        "items": items[start:end],
-    }
+async def change_events(request: Request, tenant: str, since: int, limit: int) -> AsyncIterator[str]:
+    """
+    Stream SSE delle modifiche: un evento `changes` (id = sequenza raggiunta)
+    per ogni gruppo di modifiche, un commento di keep-alive durante le attese.
+    """
+    cursor = since
+    while not await request.is_disconnected():
+        delta = await io_executor.run(change_log.delta, storage, tenant, cursor, limit)
+        if delta["seq"] != cursor or delta["reset"]:
+            cursor = delta["seq"]
+            yield f"id: {cursor}\nevent: changes\ndata: {json.dumps(delta, ensure_ascii=False)}\n\n"
+            if delta["more"]:
+                continue
+        if await change_log.wait(tenant, cursor, CHANGES_HEARTBEAT) == cursor:
+            yield ": keep-alive\n\n"
 # ------------------------------------------------------------------------
 
 
+@app.on_event("startup")
+def start_loop_lag_monitor():
+    loop_lag.start()
+
+
 @app.options("/{path_name:path}")
 async def options_handler():
     return JSONResponse(status_code=200, content="OK")
@@ -149,20 +462,16 @@ async def create_anagrafica(
     Crea una nuova anagrafica per l'utente 'username' (se i credentials sono validi).
     """
     # 1. Verifica credenziali
-    if not verify_credentials(username, password):
+    if not await io_executor.run(verify_credentials, username, password):
         raise HTTPException(status_code=401, detail="Credenziali non valide")
 
-    # 2. Carica anagrafiche esistenti dell'utente
-    anagrafiche = load_user_anagrafiche(username)
-
-    # 3. Aggiungi la nuova anagrafica
+    # 2. Prepara la nuova anagrafica
     new_record = new_anagrafica.dict()
     if "created_at" not in new_record:
         new_record["created_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    anagrafiche.append(new_record)
 
-    # 4. Salva
-    save_user_anagrafiche(username, anagrafiche)
+    # 3. Aggiungila a quelle dell'utente e salva
+    await io_executor.run(insert_anagrafica, username, new_record)
 
     return {"message": "Anagrafica creata con successo"}
 
@@ -173,34 +482,63 @@ async def update_anagrafica(
         updated_data: Anagrafica,
         username: str,
         password: str,
+        response: Response,
+        if_match: Optional[str] = Header(default=None),
 ):
     """
     Aggiorna un'anagrafica esistente per l'utente specificato, tramite ID.
+    Con If-Match la sostituzione avviene solo se l'ETag è ancora quello atteso (412 altrimenti).
     """
     # 1. Verifica credenziali
-    if not verify_credentials(username, password):
+    if not await io_executor.run(verify_credentials, username, password):
         raise HTTPException(status_code=401, detail="Credenziali non valide")
 
-    # 2. Carica l'elenco anagrafiche di quell'utente
-    anagrafiche = load_user_anagrafiche(username)
+    # 2. Cerca l'anagrafica da aggiornare, sostituisci i campi, salva e ritorna
+    updated = await io_executor.run(replace_anagrafica, username, anagrafica_id, updated_data.dict(), if_match)
+    response.headers["ETag"] = record_etag(updated)
+    return updated
 
-    # 3. Cerca l'anagrafica da aggiornare
-    for idx, an_item in enumerate(anagrafiche):
-        if an_item["id"] == anagrafica_id:
-            # Sostituisci i campi con quelli nuovi, ma conserva l'ID
-            updated_dict = updated_data.dict()
-            updated_dict["id"] = anagrafica_id
-            if "created_at" in an_item:
-                updated_dict["created_at"] = an_item["created_at"]
-            if "source_user" in an_item:
-                updated_dict["source_user"] = an_item["source_user"]
-            anagrafiche[idx] = updated_dict
 
-            # Salva e ritorna
-            save_user_anagrafiche(username, anagrafiche)
-            return anagrafiche[idx]
+@app.patch("/anagrafiche/{anagrafica_id}", response_model=Anagrafica)
+async def patch_anagrafica(
+        anagrafica_id: str,
+        request: Request,
+        response: Response,
+        username: str,
+        password: str,
+        if_match: Optional[str] = Header(default=None),
+):
+    """
+    Modifica parziale di un'anagrafica, senza reinviare il record completo:
+    - application/merge-patch+json: oggetto con i soli campi da cambiare (null rimuove)
+    - application/json-patch+json: lista di operazioni JSON Patch (add, remove, replace, test, ...)
+    - application/json: merge patch se il corpo è un oggetto, JSON Patch se è una lista
+    id e analysis_history non sono modificabili. Con If-Match (ETag ottenuto da
+    GET / PUT / PATCH) la modifica si applica solo se nessun altro ha cambiato
+    l'anagrafica nel frattempo, altrimenti 412.
+    """
+    # 1. Verifica credenziali
+    if not await io_executor.run(verify_credentials, username, password):
+        raise HTTPException(status_code=401, detail="Credenziali non valide")
+
+    # 2. Formato del patch dal Content-Type
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in ("application/json", "application/merge-patch+json", "application/json-patch+json"):
+        raise HTTPException(status_code=415, detail="Usare application/merge-patch+json o application/json-patch+json")
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Corpo della richiesta non è JSON valido.")
+    json_patch = content_type == "application/json-patch+json" or (content_type == "application/json"
+                                                                   and isinstance(body, list))
+    if not isinstance(body, list if json_patch else dict):
+        raise HTTPException(status_code=422, detail="JSON Patch: attesa una lista di operazioni; "
+                                                    "Merge Patch: atteso un oggetto.")
 
-    raise HTTPException(status_code=404, detail="Anagrafica non trovata.")
+    # 3. Patch sotto il lock del tenant, con controllo dell'ETag atomico rispetto alla scrittura
+    updated = await io_executor.run(modify_anagrafica, username, anagrafica_id, body, json_patch, if_match)
+    response.headers["ETag"] = record_etag(updated)
+    return updated
 
 
 @app.delete("/anagrafiche/{anagrafica_id}", response_model=dict)
@@ -213,19 +551,14 @@ async def delete_anagrafica(
     Elimina un'anagrafica tramite ID, dal file dell'utente.
     """
     # 1. Verifica credenziali
-    if not verify_credentials(username, password):
+    if not await io_executor.run(verify_credentials, username, password):
         raise HTTPException(status_code=401, detail="Credenziali non valide")
 
-    # 2. Carica l'elenco anagrafiche di quell'utente
-    anagrafiche = load_user_anagrafiche(username)
-
-    # 3. Trova e rimuovi l'anagrafica
-    for idx, an_item in enumerate(anagrafiche):
-        if an_item["id"] == anagrafica_id:
-            deleted = anagrafiche.pop(idx)
-            save_user_anagrafiche(username, anagrafiche)
-            return {"message": "Anagrafica eliminata con successo.", "data": deleted}
-    raise HTTPException(status_code=404, detail="Anagrafica non trovata.")
+    # 2. Trova e rimuovi l'anagrafica
+    deleted = await io_executor.run(remove_anagrafica, username, anagrafica_id)
+    if deleted is None:
+        raise HTTPException(status_code=404, detail="Anagrafica non trovata.")
+    return {"message": "Anagrafica eliminata con successo.", "data": deleted}
 
 
 @app.get("/anagrafiche", response_model=List[Anagrafica])
@@ -237,16 +570,195 @@ async def get_anagrafiche(
     Recupera tutte le anagrafiche dell'utente specificato.
     """
     # 1. Verifica credenziali
-    if not verify_credentials(username, password):
+    if not await io_executor.run(verify_credentials, username, password):
         raise HTTPException(status_code=401, detail="Credenziali non valide")
 
-    if username == "admin":
-        anagrafiche = load_all_anagrafiche(username)
+    # 2. Cursore del registro delle modifiche letto prima dei dati: il client
+    #    può proseguire con GET /changes?since=<X-Change-Seq> senza perdere modifiche
+    headers = {}
+    if username != "admin":
+        headers["X-Change-Seq"] = str(await io_executor.run(change_log.current_seq, username))
+
+    # 3. Risposta in streaming: un record alla volta (memoria limitata anche per tenant grandi);
+    #    Starlette legge i generatori sincroni nel suo thread pool, fuori dall'event loop
+    return StreamingResponse(stream_json_array(iter_visible_anagrafiche(username)),
+                             media_type="application/json", headers=headers)
 
-        return anagrafiche
-    else:
-        anagrafiche = load_user_anagrafiche(username)
-        return anagrafiche
+
+@app.get("/anagrafiche/search")
+async def search_anagrafiche(
+    username: str,
+    password: str,
+    q: str = "",
+    gender: Optional[str] = None,
+    skin_type: List[str] = Query(default=[]),
+    issue: List[str] = Query(default=[]),
+    limit: int = Query(default=20, ge=1, le=200),
+    offset: int = Query(default=0, ge=0),
+):
+    """
+    Cerca le anagrafiche per nome, cognome, indirizzo, tipi di pelle e
+    problematiche (prefissi delle parole, senza distinzione di maiuscole e
+    accenti), con filtri e conteggi per gender, skin_type e issue.
+    Restituisce solo i dati anagrafici, senza analysis_history.
+    """
+    # 1. Verifica credenziali
+    if not await io_executor.run(verify_credentials, username, password):
+        raise HTTPException(status_code=401, detail="Credenziali non valide")
+
+    # 2. Ricerca sull'indice (costruito al primo accesso al tenant, poi incrementale)
+    filters = {"gender": [gender] if gender else [], "skin_types": skin_type, "issues": issue}
+    return await io_executor.run(search_visible_anagrafiche, username, q, filters, limit, offset)
+
+
+@app.post("/anagrafiche/import")
+async def import_anagrafiche_ndjson(
+    request: Request,
+    username: str,
+    password: str,
+    skip_invalid: bool = False,
+):
+    """
+    Import massivo da NDJSON (application/x-ndjson): un'anagrafica per riga,
+    stesso formato di /create_anagrafiche (created_at facoltativo). Il corpo è
+    letto in streaming e validato a blocchi; i record validi attendono in un
+    file temporaneo (memoria limitata anche per file grandi) e vengono scritti
+    a blocchi, sotto il lock del tenant. Con errori (righe non valide o oltre
+    IMPORT_MAX_LINE_BYTES, id duplicati) non viene importato nulla (422), a
+    meno di skip_invalid=true.
+    """
+    # 1. Verifica credenziali
+    if not await io_executor.run(verify_credentials, username, password):
+        raise HTTPException(status_code=401, detail="Credenziali non valide")
+
+    # 2. Lettura in streaming e validazione a blocchi di righe
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # Solo id, numeri di riga e i primi errori restano in memoria; le righe
+    # troppo lunghe vengono scartate mentre arrivano (None nel blocco)
+    ids, errors, block, pending, overflow, next_line, error_count = [], [], [], b"", False, 1, 0
+
+    async def validate_block():
+        nonlocal next_line, error_count
+        valid, invalid = await io_executor.run(spool_import_lines, spool, block, next_line, created_at)
+        ids.extend(valid)
+        error_count += len(invalid)
+        errors.extend(invalid[:max(IMPORT_MAX_ERRORS - len(errors), 0)])
+        next_line += len(block)
+        block.clear()
+        if len(ids) > IMPORT_MAX_RECORDS:
+            raise HTTPException(status_code=413, detail=f"Massimo {IMPORT_MAX_RECORDS} anagrafiche per import.")
+
+    def add_lines(data: bytes):
+        nonlocal pending, overflow
+        lines = (pending + data).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            block.append(None if overflow or len(line) > IMPORT_MAX_LINE_BYTES else line)
+            overflow = False
+        if len(pending) > IMPORT_MAX_LINE_BYTES:
+            pending, overflow = b"", True
+
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES) as spool:
+        async for chunk in request.stream():
+            add_lines(chunk)
+            if len(block) >= IMPORT_CHUNK_LINES:
+                await validate_block()
+        if pending or overflow:
+            block.append(None if overflow else pending)
+        await validate_block()
+
+        # 3. Scrittura a blocchi
+        return await io_executor.run(import_anagrafiche, username, spool, ids, errors, error_count, skip_invalid)
+
+
+@app.get("/anagrafiche/export")
+async def export_anagrafiche_ndjson(
+    username: str,
+    password: str,
+    include_history: bool = True,
+):
+    """
+    Export NDJSON delle anagrafiche visibili all'utente, un record per riga,
+    generato in streaming senza costruire la lista; il risultato si può
+    reimportare con /anagrafiche/import.
+    """
+    # 1. Verifica credenziali
+    if not await io_executor.run(verify_credentials, username, password):
+        raise HTTPException(status_code=401, detail="Credenziali non valide")
+
+    # 2. Stream dei record (cursore delle modifiche letto prima dei dati, come GET /anagrafiche)
+    headers = {"Content-Disposition": 'attachment; filename="anagrafiche.ndjson"'}
+    if username != "admin":
+        headers["X-Change-Seq"] = str(await io_executor.run(change_log.current_seq, username))
+    return StreamingResponse(stream_ndjson(iter_visible_anagrafiche(username, skip_history=not include_history)),
+                             media_type="application/x-ndjson", headers=headers)
+
+
+@app.get("/anagrafiche/{anagrafica_id}", response_model=Anagrafica)
+async def get_anagrafica(
+    anagrafica_id: str,
+    username: str,
+    password: str,
+    response: Response,
+):
+    """
+    Recupera una singola anagrafica; l'header ETag va rimandato in If-Match
+    con PUT / PATCH per non sovrascrivere modifiche altrui.
+    """
+    # 1. Verifica credenziali
+    if not await io_executor.run(verify_credentials, username, password):
+        raise HTTPException(status_code=401, detail="Credenziali non valide")
+
+    # 2. Lettura del record
+    record = await io_executor.run(storage.get_patient, username, anagrafica_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Anagrafica non trovata.")
+    response.headers["ETag"] = record_etag(record)
+    return record
+
+
+@app.get("/changes")
+async def get_changes(
+    request: Request,
+    username: str,
+    password: str,
+    since: int = Query(default=0, ge=0),
+    wait: float = Query(default=0, ge=0, le=60),
+    stream: bool = False,
+    tenant: Optional[str] = None,
+    limit: int = Query(default=1000, ge=1, le=5000),
+    last_event_id: Optional[str] = Header(default=None),
+):
+    """
+    Modifiche alle anagrafiche e allo storico analisi successive al cursore
+    `since` (numero di sequenza del tenant):
+    - `patients`: anagrafiche create o modificate (record completo)
+    - `deleted`: id delle anagrafiche eliminate
+    - `analyses`: voci di analysis_history aggiunte o ricalcolate
+    - `seq`: cursore da usare nella richiesta successiva (`more: true` se ci
+      sono altre modifiche), `reset: true` se il cursore non è più valido e
+      la lista va ricaricata per intero
+
+    Con `wait` > 0 la richiesta resta aperta fino alla prima modifica (long
+    polling); con `stream=true` risponde con uno stream SSE (text/event-stream)
+    che riprende da Last-Event-ID dopo una riconnessione.
+    """
+    # 1. Verifica credenziali
+    if not await io_executor.run(verify_credentials, username, password):
+        raise HTTPException(status_code=401, detail="Credenziali non valide")
+    tenant = changes_tenant(username, tenant)
+
+    # 2. Stream SSE
+    if stream:
+        if last_event_id and last_event_id.isdigit():
+            since = int(last_event_id)
+        return StreamingResponse(change_events(request, tenant, since, limit), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    # 3. Long polling: attende solo se non c'è già qualcosa da restituire
+    if wait > 0:
+        await change_log.wait(tenant, since, wait)
+    return await io_executor.run(change_log.delta, storage, tenant, since, limit)
 
 
 @app.get("/admin/users/{target_username}/anagrafiche_history")
@@ -260,11 +772,9 @@ async def get_user_anagrafiche_history(
     """
     Permette all'admin di recuperare con paginazione le anagrafiche create da uno specifico utente.
     """
-    verify_admin_credentials(admin_username, admin_password)
+    await io_executor.run(verify_admin_credentials, admin_username, admin_password)
 
-    user_records = load_user_anagrafiche(target_username)
-    user_records.sort(key=lambda x: x.get("created_at") or "", reverse=True)
-    paginated = paginate_items(user_records, page, page_size)
+    paginated = await io_executor.run(sorted_page, target_username, page, page_size)
 
     return {
         "data": {
@@ -274,6 +784,13 @@ async def get_user_anagrafiche_history(
     }
 
 
+@app.get("/io_stats")
+async def get_io_stats(admin_username: str, admin_password: str):
+    """Latenze dei pool di I/O e ritardo dell'event loop (solo admin)."""
+    await io_executor.run(verify_admin_credentials, admin_username, admin_password)
+    return io_stats()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8002)
@@ -0,0 +1,558 @@
+"""
+Archivio colonnare dei punteggi per le statistiche admin cross-tenant.
+
+Una riga per analisi, in file .npy mappati in memoria (SCORE_STORE_FOLDER):
+- tenant.npy, patient.npy, zone.npy: codici int32 nei dizionari *.txt
+  (una stringa JSON per riga, solo in append)
+- timestamp.npy: datetime64[s] (NaT se il timestamp manca o non è valido)
+- values.npy: matrice (n, 9) float32 dei valori grezzi 0-100 (NaN se assenti)
+- day.npy, month.npy: giorni / mesi dal 1970 (int32) per i group-by temporali
+- meta.json: righe valide, capacità, lunghezza dei dizionari e versione dei
+  dati di ogni tenant (Storage.tenant_version) già riportata nell'archivio
+
+Gli append di `update_patient_analysis` aggiungono una riga (stessa
+interfaccia on_append / mark_synced degli indici di analysis_index); un
+tenant modificato altrove viene riletto al primo accesso. Group-by e
+percentili sono calcolati con NumPy su tutte le righe, senza leggere le
+anagrafiche.
+
+Benchmark su dati sintetici:
+    python score_store.py --rows 2000000
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: solo lock fra thread
+    fcntl = None
+
+from agent.parameters import SKIN_PARAMETERS
+from analysis_index import raw_score_row
+from storage import Storage
+from storage.json_backend import write_json_atomic
+
+SCORE_STORE_FOLDER = os.getenv("SCORE_STORE_FOLDER", "score_store")
+
+COLUMNS = {
+    "tenant": ("<i4", ()),
+    "patient": ("<i4", ()),
+    "zone": ("<i4", ()),
+    "timestamp": ("<M8[s]", ()),
+    "values": ("<f4", (len(SKIN_PARAMETERS),)),
+    # Periodi precalcolati per i group-by (la conversione di calendario di
+    # datetime64 su milioni di righe costa più dell'aggregazione)
+    "day": ("<i4", ()),
+    "month": ("<i4", ()),
+}
+ROW_FIELDS = ("tenant", "patient", "zone", "timestamp", "values")
+NO_PERIOD = -1  # timestamp mancante (le analisi sono tutte successive al 1970)
+MAX_SCORE = 100
+DICTIONARIES = ("tenant", "patient", "zone")
+INITIAL_CAPACITY = 1024
+
+GROUP_KEYS = ("tenant", "patient", "body_zone", "year", "month", "day")
+BASE_STATS = ("count", "mean", "std", "min", "max")
+DEFAULT_ZONE = "Non specificata"
+
+
+def parse_datetime(value: Optional[str]) -> np.datetime64:
+    """Timestamp "YYYY-MM-DD HH:MM:SS" (o solo data) come datetime64[s], NaT se non valido."""
+    try:
+        return np.datetime64(value.strip().replace(" ", "T"), "s")
+    except (AttributeError, ValueError):
+        return np.datetime64("NaT", "s")
+
+
+def parse_stat(stat: str) -> Optional[float]:
+    """Quantile (0-1) per le statistiche pNN, None per quelle di base."""
+    if stat in BASE_STATS:
+        return None
+    if stat.startswith("p"):
+        try:
+            q = float(stat[1:])
+        except ValueError:
+            q = -1
+        if 0 <= q <= 100:
+            return q / 100
+    raise ValueError(f"Statistica non supportata: {stat} (ammesse: {', '.join(BASE_STATS)}, p0-p100)")
+
+
+class ScoreStore:
+    def __init__(self, storage: Storage, folder: str = SCORE_STORE_FOLDER):
+        self._storage = storage
+        self.folder = folder
+        self._lock = threading.RLock()
+        self._meta: Optional[dict] = None
+        self._columns: Dict[str, np.memmap] = {}
+        self._strings: Dict[str, List[str]] = {name: [] for name in DICTIONARIES}
+        self._codes: Dict[str, Dict[str, int]] = {name: {} for name in DICTIONARIES}
+
+    # --------------------------------------------------------------------------
+    # File e lock
+    # --------------------------------------------------------------------------
+    def _path(self, name: str) -> str:
+        return os.path.join(self.folder, name)
+
+    @contextmanager
+    def _locked(self):
+        """Lock fra thread e, dove supportato, fra processi; ricarica lo stato scritto da altri."""
+        with self._lock:
+            os.makedirs(self.folder, exist_ok=True)
+            if fcntl is None:
+                self._reload()
+                yield
+                return
+            with open(self._path("store.lock"), "a") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    self._reload()
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _reload(self):
+        try:
+            with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            meta = None
+        # Archivio di un altro backend, oppure backend in memoria (i dati non
+        # sopravvivono al processo): si riparte da zero
+        if meta is None or meta.get("backend") != self._storage.name or \
+                (self._storage.name == "memory" and self._meta is None):
+            self._reset()
+            return
+        if self._meta is not None and meta["generation"] == self._meta["generation"]:
+            return
+        self._meta = meta
+        self._open_columns()
+        for name in DICTIONARIES:
+            strings = self._strings[name]
+            if len(strings) > meta["dictionaries"][name]:
+                strings.clear()
+                self._codes[name].clear()
+            if len(strings) < meta["dictionaries"][name]:
+                with open(self._path(f"{name}.txt"), "r", encoding="utf-8") as f:
+                    lines = f.read().splitlines()[len(strings):meta["dictionaries"][name]]
+                for line in lines:
+                    self._codes[name][line] = len(strings)
+                    strings.append(line)
+
+    def _reset(self):
+        self._meta = {"backend": self._storage.name, "generation": 0, "count": 0, "capacity": 0,
+                      "dictionaries": {name: 0 for name in DICTIONARIES}, "tenant_versions": {},
+                      "integral": True}
+        for name in DICTIONARIES:
+            open(self._path(f"{name}.txt"), "w").close()
+            self._strings[name].clear()
+            self._codes[name].clear()
+        self._grow(INITIAL_CAPACITY)
+        self._commit()
+
+    def _open_columns(self):
+        self._columns = {name: np.load(self._path(f"{name}.npy"), mmap_mode="r+") for name in COLUMNS}
+
+    def _grow(self, capacity: int):
+        """Nuovi file con capacità maggiore (copia delle righe valide, poi os.replace)."""
+        count = self._meta["count"]
+        for name, (dtype, shape) in COLUMNS.items():
+            tmp_path = self._path(f"{name}.npy.tmp")
+            column = open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(capacity,) + shape)
+            if name in self._columns:
+                column[:count] = self._columns[name][:count]
+            column.flush()
+            del column
+            os.replace(tmp_path, self._path(f"{name}.npy"))
+        self._meta["capacity"] = capacity
+        self._open_columns()
+
+    def _commit(self):
+        """Rende visibili le righe scritte: flush delle colonne e poi meta.json."""
+        for column in self._columns.values():
+            column.flush()
+        self._meta["generation"] += 1
+        write_json_atomic(self._path("meta.json"), self._meta)
+
+    def _code(self, dictionary: str, value: str) -> int:
+        key = json.dumps(value, ensure_ascii=False)
+        code = self._codes[dictionary].get(key)
+        if code is None:
+            strings = self._strings[dictionary]
+            code = self._codes[dictionary][key] = len(strings)
+            strings.append(key)
+            with open(self._path(f"{dictionary}.txt"), "a", encoding="utf-8") as f:
+                f.write(key + "\n")
+            self._meta["dictionaries"][dictionary] = len(strings)
+        return code
+
+    def _label(self, dictionary: str, code: int):
+        return json.loads(self._strings[dictionary][code])
+
+    # --------------------------------------------------------------------------
+    # Scrittura
+    # --------------------------------------------------------------------------
+    def _row(self, tenant: str, patient: dict, entry: dict) -> tuple:
+        result = entry.get("result") or {}
+        return (self._code("tenant", tenant),
+                self._code("patient", [tenant, patient.get("id")]),
+                self._code("zone", result.get("body_zone") or DEFAULT_ZONE),
+                parse_datetime(entry.get("timestamp")),
+                raw_score_row(result))
+
+    def _append_rows(self, rows: Sequence[tuple]):
+        count = self._meta["count"]
+        needed = count + len(rows)
+        if needed > self._meta["capacity"]:
+            capacity = self._meta["capacity"] or INITIAL_CAPACITY
+            while capacity < needed:
+                capacity *= 2
+            self._grow(capacity)
+        if not rows:
+            return
+        columns = {name: np.array([row[pos] for row in rows], dtype=COLUMNS[name][0])
+                   for pos, name in enumerate(ROW_FIELDS)}
+        columns.update(_periods(columns["timestamp"]))
+        if self._meta.get("integral") and not _integral(columns["values"]):
+            self._meta["integral"] = False
+        for name, column in columns.items():
+            self._columns[name][count:needed] = column
+        self._meta["count"] = needed
+
+    def _remove_tenant(self, tenant: str):
+        code = self._codes["tenant"].get(json.dumps(tenant, ensure_ascii=False))
+        if code is None:
+            return
+        count = self._meta["count"]
+        keep = self._columns["tenant"][:count] != code
+        kept = int(keep.sum())
+        for column in self._columns.values():
+            column[:kept] = column[:count][keep]
+        self._meta["count"] = kept
+
+    def _rebuild_tenant(self, tenant: str, version: Optional[str]):
+        self._remove_tenant(tenant)
+        if version is None:
+            self._meta["tenant_versions"].pop(tenant, None)
+            return
+        rows = [self._row(tenant, patient, entry)
+                for patient in self._storage.iter_patients(tenant)
+                for entry in patient.get("analysis_history") or []]
+        self._append_rows(rows)
+        self._meta["tenant_versions"][tenant] = version
+
+    def _sync(self):
+        """Rilegge i tenant modificati fuori da on_append (o non ancora caricati)."""
+        tenants = set(self._storage.list_tenants())
+        versions = self._meta["tenant_versions"]
+        changed = False
+        for tenant in sorted(tenants | set(versions)):
+            version = repr(self._storage.tenant_version(tenant)) if tenant in tenants else None
+            if versions.get(tenant) != version:
+                self._rebuild_tenant(tenant, version)
+                changed = True
+        if changed:
+            self._commit()
+
+    def on_append(self, tenant: str, patient_pos: int, patient: dict, analysis_pos: int, entry: dict):
+        with self._locked():
+            if self._meta["tenant_versions"].get(tenant) is not None:
+                self._append_rows([self._row(tenant, patient, entry)])
+                self._commit()
+
+    def mark_synced(self, tenant: str):
+        """Da chiamare dopo un salvataggio già riportato nell'archivio."""
+        with self._locked():
+            if self._meta["tenant_versions"].get(tenant) is not None:
+                self._meta["tenant_versions"][tenant] = repr(self._storage.tenant_version(tenant))
+                self._commit()
+
+    def invalidate(self, tenant: Optional[str] = None):
+        with self._locked():
+            versions = self._meta["tenant_versions"]
+            for name in ([tenant] if tenant is not None else list(versions)):
+                versions[name] = None
+            self._commit()
+
+    # --------------------------------------------------------------------------
+    # Lettura
+    # --------------------------------------------------------------------------
+    def _selection(self, tenant: Optional[str], body_zone: Optional[str],
+                   date_from: Optional[str], date_to: Optional[str]):
+        """Righe che soddisfano i filtri: slice (nessuna copia) se sono tutte, altrimenti indici."""
+        count = self._meta["count"]
+        mask = None
+        for dictionary, value in (("tenant", tenant), ("zone", body_zone)):
+            if value is not None:
+                code = self._codes[dictionary].get(json.dumps(value, ensure_ascii=False), -1)
+                mask = _and(mask, self._columns[dictionary][:count] == code)
+        for value, compare in ((date_from, np.greater_equal), (date_to, np.less_equal)):
+            if value is not None:
+                bound = parse_datetime(value)
+                if np.isnat(bound):
+                    raise ValueError(f"Data non valida: {value}")
+                if len(value.strip()) <= 10 and compare is np.less_equal:
+                    bound = bound + np.timedelta64(1, "D") - np.timedelta64(1, "s")  # giorno incluso
+                mask = _and(mask, compare(self._columns["timestamp"][:count], bound))
+        return slice(0, count) if mask is None else np.flatnonzero(mask)
+
+    def _group_codes(self, key: str, rows):
+        """Codici interi e funzione che li traduce in etichette, per una chiave di raggruppamento."""
+        if key in ("tenant", "patient"):
+            return self._columns[key][rows], lambda c: self._label(key, c)
+        if key == "body_zone":
+            return self._columns["zone"][rows], lambda c: self._label("zone", c)
+        periods = self._columns["day" if key == "day" else "month"][rows]
+        if key == "year":
+            periods = periods // 12  # NO_PERIOD (-1) resta -1
+        unit = {"year": "Y", "month": "M", "day": "D"}[key]
+        return periods, lambda c: None if c == NO_PERIOD else str(np.datetime64(c, unit))
+
+    def query(self, parameters: Optional[List[str]] = None, group_by: Iterable[str] = (),
+              stats: Iterable[str] = ("count", "mean"), tenant: Optional[str] = None,
+              body_zone: Optional[str] = None, date_from: Optional[str] = None,
+              date_to: Optional[str] = None) -> dict:
+        """
+        Statistiche dei valori grezzi per gruppo. `group_by` fra GROUP_KEYS,
+        `stats` fra count, mean, std, min, max e percentili pNN (es. p50, p90).
+        I valori mancanti (NaN) sono esclusi parametro per parametro.
+        """
+        parameters = list(parameters or SKIN_PARAMETERS)
+        group_by, stats = list(group_by), list(stats)
+        for name in parameters:
+            if name not in SKIN_PARAMETERS:
+                raise ValueError(f"Parametro non valido: {name}")
+        for key in group_by:
+            if key not in GROUP_KEYS:
+                raise ValueError(f"Raggruppamento non valido: {key} (ammessi: {', '.join(GROUP_KEYS)})")
+        quantiles = {stat: parse_stat(stat) for stat in stats}
+
+        with self._locked():
+            self._sync()
+            rows = self._selection(tenant, body_zone, date_from, date_to)
+
+            # Identificativo di gruppo denso: codici di ogni chiave compattati
+            # (bincount) e combinati in base mista
+            n_rows = self._columns["tenant"][rows].shape[0]
+            group_ids = np.zeros(n_rows, dtype=np.int64)
+            keys = []
+            for key in group_by:
+                codes, labeler = self._group_codes(key, rows)
+                present, dense = _dense(codes)
+                group_ids = group_ids * len(present) + dense
+                keys.append((key, present, labeler))
+            if len(keys) > 1:
+                present, group_ids = _dense(group_ids)
+            elif keys:
+                present = np.arange(len(keys[0][1]))
+            else:
+                present = np.zeros(1 if n_rows else 0, dtype=np.int64)
+            integral = self._meta.get("integral", False)
+            columns = [SKIN_PARAMETERS.index(name) for name in parameters]
+            # Solo le colonne dei parametri richiesti (slice: vista senza copia delle righe)
+            values = self._columns["values"]
+            values = values[rows][:, columns] if isinstance(rows, slice) else values[np.ix_(rows, columns)]
+
+            labels = []
+            for group in present.tolist():
+                label = {}
+                for key, key_present, labeler in reversed(keys):
+                    group, pos = divmod(group, len(key_present))
+                    label[key] = labeler(int(key_present[pos]))
+                labels.append({key: label[key] for key in group_by})
+
+        results = [{"group": label, "analisi": count, "parametri": {}}
+                   for label, count in zip(labels, np.bincount(group_ids, minlength=len(labels)).tolist())]
+        for col, name in enumerate(parameters):
+            computed = _group_stats(values[:, col], group_ids, len(labels), quantiles, integral)
+            for pos, result in enumerate(results):
+                result["parametri"][name] = {stat: int(computed[stat][pos]) if stat == "count"
+                                             else _value(computed[stat][pos]) for stat in stats}
+        return {"righe": int(n_rows), "gruppi": results}
+
+    def export(self, tenant: Optional[str] = None, body_zone: Optional[str] = None,
+               date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, np.ndarray]:
+        """
+        Colonne per il dataset di ricerca (np.savez). I pazienti sono esportati
+        solo come codice numerico, senza identificativi.
+        """
+        with self._locked():
+            self._sync()
+            rows = self._selection(tenant, body_zone, date_from, date_to)
+            tenant_codes, tenants = np.unique(self._columns["tenant"][rows], return_inverse=True)
+            zone_codes, zones = np.unique(self._columns["zone"][rows], return_inverse=True)
+            _, patients = np.unique(self._columns["patient"][rows], return_inverse=True)
+            return {
+                "tenant": tenants.reshape(-1).astype(np.int32),
+                "tenant_names": np.array([self._label("tenant", c) for c in tenant_codes.tolist()], dtype=str),
+                "patient": patients.reshape(-1).astype(np.int32),
+                "body_zone": zones.reshape(-1).astype(np.int32),
+                "body_zone_names": np.array([self._label("zone", c) for c in zone_codes.tolist()], dtype=str),
+                "timestamp": np.array(self._columns["timestamp"][rows]),
+                "values": np.array(self._columns["values"][rows]),
+                "parameters": np.array(SKIN_PARAMETERS, dtype=str),
+            }
+
+
+def _periods(timestamps: np.ndarray) -> Dict[str, np.ndarray]:
+    """Giorni e mesi dal 1970 (NO_PERIOD se il timestamp manca)."""
+    missing = np.isnat(timestamps)
+    return {unit_name: np.where(missing, NO_PERIOD, timestamps.astype(f"datetime64[{unit}]").view(np.int64))
+            .astype(np.int32) for unit_name, unit in (("day", "D"), ("month", "M"))}
+
+
+def _and(mask: Optional[np.ndarray], condition: np.ndarray) -> np.ndarray:
+    return condition if mask is None else mask & condition
+
+
+def _dense(codes: np.ndarray):
+    """Valori distinti (ordinati) e codici compatti 0..k-1 di un array di interi."""
+    codes = np.asarray(codes)
+    if len(codes) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    low, high = int(codes.min()), int(codes.max())
+    if high - low < 4 * len(codes) + 1024:
+        # Intervallo limitato: bincount al posto dell'ordinamento di np.unique
+        shifted = codes - low if low else codes
+        present = np.flatnonzero(np.bincount(shifted))
+        lookup = np.zeros(high - low + 1, dtype=np.int64)
+        lookup[present] = np.arange(len(present))
+        return present + low, lookup[shifted]
+    present, dense = np.unique(codes, return_inverse=True)
+    return present, dense.reshape(-1)
+
+
+def _integral(values: np.ndarray) -> bool:
+    """True se tutti i valori (NaN esclusi) sono interi fra 0 e MAX_SCORE."""
+    values = values[~np.isnan(values)]
+    return bool(((values >= 0) & (values <= MAX_SCORE) & (values == np.round(values))).all())
+
+
+def _group_stats(values: np.ndarray, group_ids: np.ndarray, n_groups: int,
+                 quantiles: Dict[str, Optional[float]], integral: bool) -> Dict[str, np.ndarray]:
+    """
+    Statistiche per gruppo di una colonna (NaN esclusi), tutte vettoriali.
+    Con punteggi interi 0-100 (il caso normale) tutto deriva da un unico
+    istogramma per gruppo; altrimenti somme pesate e ordinamento per gruppo.
+    """
+    valid = ~np.isnan(values)
+    all_valid = bool(valid.all())
+    ids = group_ids if all_valid else group_ids[valid]
+    vals = values if all_valid else values[valid]
+
+    if integral:
+        width = MAX_SCORE + 1
+        histogram = np.bincount(ids * width + vals.astype(np.intp),
+                                minlength=n_groups * width).reshape(n_groups, width)
+        levels = np.arange(width, dtype=np.float64)
+        counts = histogram.sum(axis=1).astype(np.float64)
+        sums = histogram @ levels
+        squares = histogram @ (levels * levels)
+    else:
+        vals = vals.astype(np.float64)
+        counts = np.bincount(ids, minlength=n_groups).astype(np.float64)
+        sums = np.bincount(ids, weights=vals, minlength=n_groups)
+        squares = np.bincount(ids, weights=vals * vals, minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums / counts
+        var = np.maximum(squares / counts - mean ** 2, 0)
+    out = {"count": counts, "mean": mean, "std": np.sqrt(var)}
+
+    positions = {stat: q for stat, q in quantiles.items() if q is not None}
+    positions.update({stat: q for stat, q in (("min", 0.0), ("max", 1.0)) if stat in quantiles})
+    if not positions:
+        return out
+    last = np.maximum(counts - 1, 0)
+    empty = counts == 0
+
+    if integral:
+        cumulative = np.cumsum(histogram, axis=1)
+
+        def at(position: np.ndarray) -> np.ndarray:
+            lower = np.floor(position)
+            # valore con rango k = numero di livelli con cumulata <= k
+            low = (cumulative <= lower[:, None]).sum(axis=1)
+            high = (cumulative <= np.ceil(position)[:, None]).sum(axis=1)
+            return np.where(empty, np.nan, low + (high - low) * (position - lower))
+    else:
+        # Ordinamento per (gruppo, valore): ogni gruppo è un intervallo contiguo
+        ordered = vals[np.lexsort((vals, ids))]
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+
+        def at(position: np.ndarray) -> np.ndarray:
+            lower = np.floor(position).astype(np.int64)
+            upper = np.ceil(position).astype(np.int64)
+            low = ordered[np.minimum(starts + lower, len(ordered) - 1)]
+            high = ordered[np.minimum(starts + upper, len(ordered) - 1)]
+            return np.where(empty, np.nan, low + (high - low) * (position - lower))
+
+    for stat, q in positions.items():
+        out[stat] = at(q * last)
+    return out
+
+
+def _value(value: float) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+# ------------------------------------------------------------------------------
+# BENCHMARK
+# ------------------------------------------------------------------------------
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    import time
+
+    from storage import MemoryStorage
+
+    parser = argparse.ArgumentParser(description="Benchmark dell'archivio colonnare dei punteggi")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--tenants", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as folder:
+        store = ScoreStore(MemoryStorage(), folder)
+        with store._locked():
+            tenants = [store._code("tenant", f"centro-{i}") for i in range(args.tenants)]
+            zones = [store._code("zone", z) for z in ("Viso", "Collo", "Mani", "Cuoio capelluto", DEFAULT_ZONE)]
+            start = time.perf_counter()
+            store._grow(args.rows)
+            columns = store._columns
+            columns["tenant"][:] = rng.choice(tenants, args.rows)
+            columns["patient"][:] = rng.integers(0, args.rows // 20, args.rows)
+            columns["zone"][:] = rng.choice(zones, args.rows)
+            columns["timestamp"][:] = np.datetime64("2023-01-01T00:00:00") + \
+                rng.integers(0, 3 * 365 * 86400, args.rows).astype("timedelta64[s]")
+            columns["values"][:] = rng.integers(0, 101, (args.rows, len(SKIN_PARAMETERS)))
+            for name, column in _periods(columns["timestamp"][:]).items():
+                columns[name][:] = column
+            store._meta["count"] = args.rows
+            store._meta["tenant_versions"] = {}
+            store._commit()
+            print(f"{args.rows} righe scritte in {time.perf_counter() - start:.2f} s")
+        store._sync = lambda: None  # solo righe sintetiche, nessun tenant reale da rileggere
+
+        queries = {
+            "media Idratazione per centro e mese": dict(parameters=["Idratazione"], group_by=["tenant", "month"]),
+            "distribuzione Pori ostruiti per zona": dict(parameters=["Pori ostruiti"], group_by=["body_zone"],
+                                                          stats=["count", "p10", "p50", "p90"]),
+            "tutti i parametri, un centro, un anno": dict(tenant="centro-0", date_from="2024-01-01",
+                                                          date_to="2024-12-31", stats=["mean", "p50"]),
+        }
+        for name, kwargs in queries.items():
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                result = store.query(**kwargs)
+                timings.append(time.perf_counter() - start)
+            print(f"{name:40} {len(result['gruppi']):5} gruppi  {1000 * min(timings):8.1f} ms "
+                  f"(mediana {1000 * float(np.median(timings)):.1f} ms)")
+        store._columns.clear()
@@ -0,0 +1,57 @@
+"""
+Livello di persistenza condiviso dai servizi. Il backend si sceglie con la
+variabile d'ambiente STORAGE_BACKEND:
+- json (default): users/<username>.json e user_data/<username>/anagrafiche.json
+- sqlite: database unico (STORAGE_SQLITE_PATH, default storage.db)
+- compact: come json, ma anagrafiche nel formato compatto (anagrafiche.acf)
+- wal: anagrafiche come snapshot + write-ahead log con compattazione periodica
+- memory: solo in memoria (test e benchmark)
+"""
+import os
+import threading
+from typing import Optional
+
+from storage.base import Storage
+from storage.compact_backend import CompactStorage
+from storage.json_backend import JsonStorage
+from storage.memory_backend import MemoryStorage
+from storage.sqlite_backend import SqliteStorage
+from storage.wal_backend import WalStorage
+
+BACKENDS = {
+    "json": JsonStorage,
+    "sqlite": lambda: SqliteStorage(os.getenv("STORAGE_SQLITE_PATH", "storage.db")),
+    "memory": MemoryStorage,
+    "wal": WalStorage,
+    "compact": CompactStorage,
+}
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+
+def create_storage(backend: str) -> Storage:
+    try:
+        return BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(f"Backend di storage non supportato: {backend} (ammessi: {', '.join(BACKENDS)})")
+
+
+def get_storage() -> Storage:
+    """Istanza di storage condivisa dal processo (creata al primo uso)."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage(os.getenv("STORAGE_BACKEND", "json"))
+    return _storage
+
+
+def set_storage(storage: Storage):
+    """Sostituisce l'istanza condivisa (benchmark, migrazioni)."""
+    global _storage
+    _storage = storage
+
+
+__all__ = ["Storage", "JsonStorage", "SqliteStorage", "MemoryStorage", "WalStorage", "CompactStorage",
+           "create_storage", "get_storage", "set_storage"]
@@ -0,0 +1,138 @@
+"""
+Benchmark comune dei backend di storage:
+
+    python -m storage --backends json,sqlite,wal,memory --patients 200 --analyses 20
+
+Ogni backend lavora su una cartella temporanea con lo stesso carico
+(creazione pazienti, append di analisi, letture singole e complete) e per
+ogni operazione vengono riportati throughput e latenze p50/p95.
+
+Throughput di import / export massivo (pazienti al secondo):
+
+    python -m storage --import-bench 5000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from storage import CompactStorage, JsonStorage, MemoryStorage, SqliteStorage, Storage, WalStorage
+from agent.parameters import SKIN_PARAMETERS
+
+
+def _make_backend(name: str, folder: str) -> Storage:
+    if name == "json":
+        return JsonStorage(os.path.join(folder, "users"), os.path.join(folder, "user_data"))
+    if name == "sqlite":
+        return SqliteStorage(os.path.join(folder, "storage.db"))
+    if name == "memory":
+        return MemoryStorage()
+    if name == "wal":
+        return WalStorage(os.path.join(folder, "users"), os.path.join(folder, "user_data"), compact_interval=1.0)
+    if name == "compact":
+        return CompactStorage(os.path.join(folder, "users"), os.path.join(folder, "user_data"))
+    raise ValueError(f"Backend sconosciuto: {name}")
+
+
+def _analysis(rng: random.Random) -> dict:
+    result = {name: {"valore": rng.randint(0, 100), "descrizione": "x" * 80} for name in SKIN_PARAMETERS}
+    return {"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "result": result}
+
+
+def _timed(samples: List[float], fn: Callable, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    samples.append(time.perf_counter() - start)
+    return out
+
+
+def run(backend: Storage, tenants: int, patients: int, analyses: int, seed: int = 0) -> Dict[str, List[float]]:
+    rng = random.Random(seed)
+    timings: Dict[str, List[float]] = {op: [] for op in
+                                       ("create_user", "create_patient", "append_analysis", "get_patient",
+                                        "load_patients", "append_login_event")}
+    names = [f"bench_{t}" for t in range(tenants)]
+    for tenant in names:
+        _timed(timings["create_user"], backend.create_user, {"username": tenant, "hashed_password": "", "metadata": {}})
+        for p in range(patients):
+            record = {"id": f"{tenant}-{p}", "nome": "Nome", "cognome": "Cognome", "skin_types": [], "issues": [],
+                      "analysis_history": []}
+            _timed(timings["create_patient"], backend.create_patient, tenant, record)
+
+    for _ in range(analyses * patients):
+        tenant = rng.choice(names)
+        _timed(timings["append_analysis"], backend.append_analysis, tenant,
+               f"{tenant}-{rng.randrange(patients)}", _analysis(rng))
+    for _ in range(patients):
+        tenant = rng.choice(names)
+        _timed(timings["get_patient"], backend.get_patient, tenant, f"{tenant}-{rng.randrange(patients)}")
+        _timed(timings["append_login_event"], backend.append_login_event, tenant, {"timestamp": "-"})
+    for tenant in names:
+        _timed(timings["load_patients"], backend.load_patients, tenant)
+    return timings
+
+
+def import_benchmark(backend: Storage, patients: int) -> Dict[str, float]:
+    """
+    Pazienti al secondo per: creazione uno alla volta (una scrittura per
+    paziente, come /create_anagrafiche), import in blocco (create_patients,
+    come /anagrafiche/import) ed export in streaming NDJSON.
+    """
+    records = [{"id": f"p{p}", "nome": f"Nome {p}", "cognome": "Cognome", "birth_date": "1980-01-01",
+                "address": "Via Roma 1", "peso": 70.0, "altezza": 1.75, "gender": "Donna",
+                "skin_types": ["Pelle mista"], "issues": ["Acne"], "analysis_history": []}
+               for p in range(patients)]
+    rates = {}
+    start = time.perf_counter()
+    for record in records:
+        backend.create_patient("one_by_one", dict(record))
+    rates["create_patient"] = patients / (time.perf_counter() - start)
+    start = time.perf_counter()
+    backend.create_patients("bulk", [dict(record) for record in records])
+    rates["create_patients"] = patients / (time.perf_counter() - start)
+    start = time.perf_counter()
+    exported = sum(1 for patient in backend.iter_patients("bulk") if json.dumps(patient, ensure_ascii=False))
+    rates["export_ndjson"] = exported / (time.perf_counter() - start)
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dei backend di storage")
+    parser.add_argument("--backends", default="json,sqlite,wal,memory")
+    parser.add_argument("--tenants", type=int, default=3)
+    parser.add_argument("--patients", type=int, default=100)
+    parser.add_argument("--analyses", type=int, default=5, help="analisi per paziente (in media)")
+    parser.add_argument("--import-bench", type=int, default=0, metavar="N",
+                        help="solo throughput di import / export con N pazienti")
+    args = parser.parse_args()
+
+    if args.import_bench:
+        print(f"{'backend':8} {'operazione':20} {'pazienti/s':>12}")
+        for name in args.backends.split(","):
+            with tempfile.TemporaryDirectory() as folder:
+                backend = _make_backend(name.strip(), folder)
+                rates = import_benchmark(backend, args.import_bench)
+                backend.close()
+            for op, rate in rates.items():
+                print(f"{name:8} {op:20} {rate:>12.0f}")
+        return
+
+    print(f"{'backend':8} {'operazione':20} {'n':>6} {'op/s':>10} {'p50 ms':>9} {'p95 ms':>9}")
+    for name in args.backends.split(","):
+        with tempfile.TemporaryDirectory() as folder:
+            backend = _make_backend(name.strip(), folder)
+            timings = run(backend, args.tenants, args.patients, args.analyses)
+            backend.close()
+        for op, samples in timings.items():
+            values = np.array(samples) * 1000
+            print(f"{name:8} {op:20} {len(values):>6} {len(values) / (values.sum() / 1000):>10.0f} "
+                  f"{np.percentile(values, 50):>9.3f} {np.percentile(values, 95):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
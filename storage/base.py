@@ -0,0 +1,196 @@
+"""
+Interfaccia comune del livello di persistenza (utenti, anagrafiche pazienti,
+storico analisi, eventi di login) condivisa da users_api, patients_api e
+agent_api.
+
+I metodi granulari hanno un'implementazione di default basata su
+`load_patients` / `save_patients` (lettura-modifica-scrittura dell'intero
+tenant, sotto il lock del tenant); i backend che possono fare di meglio
+(es. SQLite) li ridefiniscono.
+"""
+import copy
+import threading
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+
+def changed_fields(old: dict, new: dict) -> Tuple[dict, List[str]]:
+    """Campi di primo livello da impostare e da rimuovere per passare da `old` a `new`."""
+    updated = {key: value for key, value in new.items() if key not in old or old[key] != value}
+    removed = [key for key in old if key not in new]
+    return updated, removed
+
+
+def apply_fields(record: dict, updated: dict, removed: Iterable[str]) -> dict:
+    record.update(updated)
+    for key in removed:
+        record.pop(key, None)
+    return record
+
+
+class Storage:
+    """Base dei backend di persistenza."""
+
+    name = "base"
+
+    def __init__(self):
+        self._locks: Dict[str, threading.RLock] = {}
+        self._locks_guard = threading.Lock()
+
+    def tenant_lock(self, tenant: str) -> threading.RLock:
+        """Lock (rientrante) per le operazioni lettura-modifica-scrittura di un tenant."""
+        with self._locks_guard:
+            lock = self._locks.get(tenant)
+            if lock is None:
+                lock = self._locks[tenant] = threading.RLock()
+            return lock
+
+    # --------------------------------------------------------------------------
+    # Utenti
+    # --------------------------------------------------------------------------
+    def get_user(self, username: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def save_user(self, user: dict):
+        """Crea o sostituisce l'utente `user["username"]`."""
+        raise NotImplementedError
+
+    def delete_user(self, username: str) -> bool:
+        raise NotImplementedError
+
+    def list_users(self) -> List[str]:
+        raise NotImplementedError
+
+    def create_user(self, user: dict) -> bool:
+        """Crea l'utente solo se non esiste già; ritorna False in caso contrario."""
+        with self.tenant_lock(f"user:{user['username']}"):
+            if self.get_user(user["username"]) is not None:
+                return False
+            self.save_user(user)
+            return True
+
+    def list_user_records(self) -> List[dict]:
+        records = (self.get_user(username) for username in self.list_users())
+        return [record for record in records if record is not None]
+
+    def append_login_event(self, username: str, event: dict) -> bool:
+        with self.tenant_lock(f"user:{username}"):
+            user = self.get_user(username)
+            if user is None:
+                return False
+            user.setdefault("login_history", []).append(event)
+            self.save_user(user)
+            return True
+
+    def list_tenants(self) -> List[str]:
+        """Tenant (utenti registrati) che possono avere anagrafiche."""
+        return sorted(self.list_users())
+
+    # --------------------------------------------------------------------------
+    # Anagrafiche pazienti
+    # --------------------------------------------------------------------------
+    def load_patients(self, tenant: str) -> List[dict]:
+        """Lista pazienti del tenant (copia modificabile dal chiamante)."""
+        raise NotImplementedError
+
+    def save_patients(self, tenant: str, patients: List[dict]):
+        """Sostituisce l'intera lista pazienti del tenant."""
+        raise NotImplementedError
+
+    def tenant_version(self, tenant: str) -> Hashable:
+        """
+        Token che cambia a ogni modifica dei dati del tenant (anche da parte di
+        altri processi): usato dagli indici in memoria per rilevare dati obsoleti.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def stamp(tenant: str, patients: List[dict]) -> List[dict]:
+        for patient in patients:
+            patient["source_user"] = tenant
+        return patients
+
+    def iter_patients(self, tenant: str, skip_history: bool = False) -> Iterator[dict]:
+        """
+        Itera i pazienti del tenant uno alla volta; con skip_history i record
+        non contengono analysis_history (i backend su file evitano di leggerlo).
+        """
+        for patient in self.load_patients(tenant):
+            if skip_history:
+                patient.pop("analysis_history", None)
+            yield patient
+
+    def get_patient(self, tenant: str, patient_id: str) -> Optional[dict]:
+        return next((p for p in self.iter_patients(tenant) if p.get("id") == patient_id), None)
+
+    def create_patient(self, tenant: str, record: dict) -> dict:
+        with self.tenant_lock(tenant):
+            patients = self.load_patients(tenant)
+            patients.append(record)
+            self.save_patients(tenant, patients)
+            return record
+
+    def create_patients(self, tenant: str, records: List[dict]) -> int:
+        """Aggiunge più pazienti con un'unica scrittura (import massivo); ritorna quanti."""
+        with self.tenant_lock(tenant):
+            patients = self.load_patients(tenant)
+            patients.extend(records)
+            self.save_patients(tenant, patients)
+            return len(records)
+
+    def update_patient(self, tenant: str, patient_id: str, record: dict) -> Optional[dict]:
+        """Sostituisce il paziente `patient_id`; ritorna il nuovo record o None se non esiste."""
+        with self.tenant_lock(tenant):
+            patients = self.load_patients(tenant)
+            for pos, patient in enumerate(patients):
+                if patient.get("id") == patient_id:
+                    patients[pos] = record
+                    self.save_patients(tenant, patients)
+                    return record
+            return None
+
+    def patch_patient(self, tenant: str, patient_id: str, patch: Callable[[dict], dict]) -> Optional[dict]:
+        """
+        Modifica parziale: `patch` riceve una copia del paziente attuale e
+        restituisce il nuovo record; viene eseguita nella sezione critica del
+        backend (controlli di versione atomici con la scrittura) e si salvano
+        solo i campi di primo livello cambiati. Un'eccezione di `patch` annulla
+        l'operazione. Ritorna il paziente aggiornato o None se non esiste.
+        """
+        with self.tenant_lock(tenant):
+            patients = self.load_patients(tenant)
+            for pos, patient in enumerate(patients):
+                if patient.get("id") == patient_id:
+                    updated, removed = changed_fields(patient, patch(copy.deepcopy(patient)))
+                    if updated or removed:
+                        apply_fields(patient, updated, removed)
+                        self.save_patients(tenant, patients)
+                    return patient
+            return None
+
+    def delete_patient(self, tenant: str, patient_id: str) -> Optional[dict]:
+        with self.tenant_lock(tenant):
+            patients = self.load_patients(tenant)
+            for pos, patient in enumerate(patients):
+                if patient.get("id") == patient_id:
+                    deleted = patients.pop(pos)
+                    self.save_patients(tenant, patients)
+                    return deleted
+            return None
+
+    def append_analysis(self, tenant: str, patient_id: str, entry: dict) -> Optional[Tuple[int, dict, int]]:
+        """
+        Aggiunge `entry` all'analysis_history del paziente. Ritorna
+        (posizione del paziente, paziente aggiornato, posizione dell'analisi),
+        usati dagli indici incrementali, oppure None se il paziente non esiste.
+        """
+        with self.tenant_lock(tenant):
+            patients = self.load_patients(tenant)
+            for pos, patient in enumerate(patients):
+                if patient.get("id") == patient_id:
+                    patient.setdefault("analysis_history", []).append(entry)
+                    self.save_patients(tenant, patients)
+                    return pos, patient, len(patient["analysis_history"]) - 1
+            return None
+
+    def close(self):
+        pass
@@ -0,0 +1,55 @@
+"""
+Backend JSON con le anagrafiche nel formato compatto (storage/compact_format.py):
+- users/<username>.json (come il backend json)
+- user_data/<tenant>/anagrafiche.acf
+
+Al primo salvataggio di un tenant il file anagrafiche.acf sostituisce, in
+lettura, il vecchio anagrafiche.json, che resta su disco come copia di
+sicurezza (non più aggiornata). Finché l'.acf non esiste si legge il JSON.
+"""
+import os
+from typing import Hashable, Iterator, List
+
+from storage.compact_format import decode_patients, encode_patients
+from storage.json_backend import JsonStorage
+
+COMPACT_FILE = "anagrafiche.acf"
+
+
+class CompactStorage(JsonStorage):
+    name = "compact"
+
+    def compact_file(self, tenant: str) -> str:
+        return os.path.join(self.data_folder, tenant, COMPACT_FILE)
+
+    def load_patients(self, tenant: str) -> List[dict]:
+        try:
+            with open(self.compact_file(tenant), "rb") as f:
+                return decode_patients(f.read())
+        except FileNotFoundError:
+            return super().load_patients(tenant)
+
+    def iter_patients(self, tenant: str, skip_history: bool = False) -> Iterator[dict]:
+        if not os.path.exists(self.compact_file(tenant)):
+            yield from super().iter_patients(tenant, skip_history)
+            return
+        for patient in self.load_patients(tenant):
+            if skip_history:
+                patient.pop("analysis_history", None)
+            yield patient
+
+    def save_patients(self, tenant: str, patients: List[dict]):
+        with self.tenant_lock(tenant):
+            self.patients_file(tenant)  # crea la cartella del tenant se manca
+            path = self.compact_file(tenant)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(encode_patients(self.stamp(tenant, patients)))
+            os.replace(tmp_path, path)
+
+    def tenant_version(self, tenant: str) -> Hashable:
+        try:
+            st = os.stat(self.compact_file(tenant))
+        except OSError:
+            return super().tenant_version(tenant)
+        return COMPACT_FILE, st.st_mtime_ns, st.st_size, st.st_ino
@@ -0,0 +1,418 @@
+"""
+Formato compatto per le anagrafiche di un tenant (file anagrafiche.acf).
+
+Lo storico analisi è quasi tutto testo ripetuto (nomi dei parametri, chiavi,
+descrizioni e consigli) mentre i punteggi occupano pochi byte. Il formato:
+- dizionario di stringhe per tenant: ogni testo è salvato una sola volta e
+  referenziato da un indice intero;
+- punteggi (valore / valore_raw) impacchettati in record numerici a larghezza
+  fissa (analisi x parametri x 2; float64, o int16/int32 se tutti interi)
+  con un array di flag che distingue int, float e campo assente;
+- metadati minificati (orjson se disponibile) e compressione zstd (zlib se
+  zstandard non è installato).
+Il dizionario paga solo quando i testi si ripetono davvero: sugli storici
+prodotti dal modello remoto (testi quasi tutti diversi) JSON minificato e
+compresso è più piccolo, sugli storici dello scoring locale (testi
+dell'albero decisionale) le colonne occupano da 2 a 4 volte meno. Per questo
+`encode_patients` salva il più piccolo dei due (intestazione ACF1 a colonne,
+ACJ1 JSON minificato); `decode_patients` li legge entrambi e restituisce
+esattamente la forma attuale dei record, ordine delle chiavi compreso.
+
+Report della riduzione di spazio sui dati esistenti (--locale-sample aggiunge
+un tenant sintetico analizzato con lo scoring locale):
+    python -m storage.compact_format --report user_data anagrafiche.json --locale-sample
+"""
+import json
+import struct
+import zlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    orjson = None
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    zstandard = None
+
+MAGIC = b"ACF1"
+MAGIC_JSON = b"ACJ1"
+CODEC_ZSTD = b"z"
+CODEC_ZLIB = b"l"
+
+NUMERIC_FIELDS = ("valore", "valore_raw")
+TEXT_FIELDS = ("descrizione", "valutazione_professionale", "consigli")
+
+# Interi oltre 2**53 non sono rappresentabili esattamente in float64
+MAX_EXACT_INT = 2 ** 53
+
+# Flag dei campi numerici
+ABSENT, INT, FLOAT = 0, 1, 2
+
+
+def _dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(data: bytes):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _compress(body: bytes) -> Tuple[bytes, bytes]:
+    if zstandard is not None:
+        return CODEC_ZSTD, zstandard.ZstdCompressor(level=19).compress(body)
+    return CODEC_ZLIB, zlib.compress(body, 9)
+
+
+def _decompress(codec: bytes, data: bytes) -> bytes:
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("File compresso con zstd ma il modulo zstandard non è installato.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    raise ValueError(f"Codec sconosciuto: {codec!r}")
+
+
+class _Strings:
+    def __init__(self):
+        self.values: List[str] = []
+        self._ids: Dict[str, int] = {}
+
+    def id(self, value: str) -> int:
+        index = self._ids.get(value)
+        if index is None:
+            index = self._ids[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+
+def _packable(param) -> bool:
+    """Parametro rappresentabile a colonne: solo campi noti, numeri (non bool) e testi."""
+    if not isinstance(param, dict) or not param:
+        return False
+    for key, value in param.items():
+        if key in NUMERIC_FIELDS:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return False
+            if isinstance(value, int) and abs(value) > MAX_EXACT_INT:
+                return False
+        elif key in TEXT_FIELDS:
+            if not isinstance(value, str):
+                return False
+        else:
+            return False
+    return True
+
+
+def _narrow(numbers: np.ndarray, flags: np.ndarray) -> np.ndarray:
+    if (flags == FLOAT).any():
+        return numbers
+    for dtype in ("<i2", "<i4"):
+        info = np.iinfo(dtype)
+        if numbers.size == 0 or (numbers.min() >= info.min and numbers.max() <= info.max):
+            return numbers.astype(dtype)
+    return numbers
+
+
+def _narrow_ids(ids: np.ndarray, count: int) -> np.ndarray:
+    """Indici nel dizionario (-1 = assente) nel tipo intero più piccolo sufficiente."""
+    for dtype in ("<i1", "<i2"):
+        if count <= np.iinfo(dtype).max:
+            return ids.astype(dtype)
+    return ids
+
+
+def _history(patient: dict):
+    """Storico impacchettabile a colonne (lista di dizionari) oppure None."""
+    history = patient.get("analysis_history")
+    if isinstance(history, list) and all(isinstance(entry, dict) for entry in history):
+        return history
+    return None
+
+
+def encode_patients(patients: List[dict]) -> bytes:
+    """Il più piccolo fra formato a colonne e JSON minificato compresso."""
+    columns = _encode_columns(patients)
+    codec, compressed = _compress(_dumps(patients))
+    if len(MAGIC_JSON) + 1 + len(compressed) < len(columns):
+        return MAGIC_JSON + codec + compressed
+    return columns
+
+
+def _encode_columns(patients: List[dict]) -> bytes:
+    strings = _Strings()
+    entries = [entry for patient in patients for entry in (_history(patient) or [])]
+
+    # Parametri (colonne): chiavi dei risultati con un dizionario impacchettabile
+    params: List[str] = []
+    seen = set()
+    for entry in entries:
+        result = entry.get("result")
+        if not isinstance(result, dict):
+            continue
+        for key, value in result.items():
+            if key not in seen and _packable(value):
+                seen.add(key)
+                params.append(key)
+    column = {name: pos for pos, name in enumerate(params)}
+
+    n, p = len(entries), len(params)
+    numbers = np.zeros((n, p, len(NUMERIC_FIELDS)), dtype="<f8")
+    flags = np.zeros((n, p, len(NUMERIC_FIELDS)), dtype=np.uint8)
+    texts = np.full((n, p, len(TEXT_FIELDS)), -1, dtype="<i4")
+    present = np.zeros((n, p), dtype=np.uint8)
+    timestamps = np.full(n, -1, dtype="<i4")
+    extras = []  # per analisi: campi non impacchettati (o None)
+
+    for row, entry in enumerate(entries):
+        extra = {}
+        for key, value in entry.items():
+            if key == "timestamp" and isinstance(value, str):
+                timestamps[row] = strings.id(value)
+            elif key != "result":
+                extra.setdefault("entry", {})[key] = value
+        # Ordine delle chiavi salvato solo se diverso da quello ricostruito in lettura
+        rebuilt = ["timestamp"] if timestamps[row] >= 0 else []
+        rebuilt += list(extra.get("entry", {})) + (["result"] if "result" in entry else [])
+        if list(entry) != rebuilt:
+            extra["keys"] = list(entry)
+        result = entry.get("result")
+        if result is None or not isinstance(result, dict):
+            if "result" in entry:
+                extra["raw_result"] = result
+            else:
+                extra["no_result"] = True
+        else:
+            order = []
+            for key, value in result.items():
+                order.append(strings.id(key))
+                col = column.get(key)
+                if col is None or not _packable(value):
+                    extra.setdefault("result", {})[key] = value
+                    continue
+                present[row, col] = 1
+                extra.setdefault("param_order", {})[key] = [strings.id(k) for k in value]
+                for f, field in enumerate(NUMERIC_FIELDS):
+                    if field in value:
+                        numbers[row, col, f] = value[field]
+                        flags[row, col, f] = INT if isinstance(value[field], int) else FLOAT
+                for f, field in enumerate(TEXT_FIELDS):
+                    if field in value:
+                        texts[row, col, f] = strings.id(value[field])
+            extra["order"] = order
+        extras.append(extra)
+
+    # L'ordine delle chiavi coincide quasi sempre con quello del primo risultato:
+    # si salva solo quando differisce
+    default_order = extras[0].get("order") if extras else None
+    default_param_order = [strings.id(k) for k in (*NUMERIC_FIELDS[:1], *TEXT_FIELDS)]
+    for extra in extras:
+        if extra.get("order") == default_order:
+            extra.pop("order", None)
+        param_order = extra.get("param_order", {})
+        for key in [k for k, order in param_order.items() if order == default_param_order]:
+            del param_order[key]
+        if not param_order:
+            extra.pop("param_order", None)
+
+    meta = {
+        "version": 1,
+        "strings": strings.values,
+        "params": params,
+        "default_order": default_order,
+        "default_param_order": default_param_order,
+        # Lo storico impacchettato diventa il numero di analisi, nella stessa posizione fra le chiavi
+        "patients": [
+            {("__history__" if k == "analysis_history" and _history(patient) is not None else k):
+             (len(v) if k == "analysis_history" and _history(patient) is not None else v)
+             for k, v in patient.items()}
+            for patient in patients
+        ],
+        "extras": [extra or None for extra in extras],
+        "n": n,
+    }
+    # Larghezza fissa ma minima: interi piccoli (il caso tipico dei punteggi)
+    # e indici del dizionario occupano 1-2 byte invece di 8/4
+    numbers = _narrow(numbers, flags)
+    texts = _narrow_ids(texts, len(strings.values))
+    timestamps = _narrow_ids(timestamps, len(strings.values))
+    arrays = [timestamps, present, flags, numbers, texts]
+    meta["dtypes"] = [a.dtype.str for a in arrays]
+    meta_bytes = _dumps(meta)
+    body = struct.pack("<I", len(meta_bytes)) + meta_bytes + b"".join(a.tobytes() for a in arrays)
+    codec, compressed = _compress(body)
+    return MAGIC + codec + compressed
+
+
+def decode_patients(data: bytes) -> List[dict]:
+    if data[:4] == MAGIC_JSON:
+        return _loads(_decompress(data[4:5], data[5:]))
+    if data[:4] != MAGIC:
+        raise ValueError("Formato compatto non riconosciuto.")
+    body = _decompress(data[4:5], data[5:])
+    meta_length = struct.unpack_from("<I", body, 0)[0]
+    meta = _loads(body[4:4 + meta_length])
+    strings = meta["strings"]
+    n, p = meta["n"], len(meta["params"])
+    nf, tf = len(NUMERIC_FIELDS), len(TEXT_FIELDS)
+
+    offset = 4 + meta_length
+    shapes = [(n,), (n, p), (n, p, nf), (n, p, nf), (n, p, tf)]
+    arrays = []
+    for dtype, shape in zip(meta["dtypes"], shapes):
+        count = int(np.prod(shape))
+        array = np.frombuffer(body, dtype=dtype, count=count, offset=offset).reshape(shape)
+        offset += array.nbytes
+        # Liste Python: l'accesso per elemento è molto più rapido che sugli scalari numpy
+        arrays.append(array.tolist())
+    timestamps, present, flags, numbers, texts = arrays
+    column = {name: pos for pos, name in enumerate(meta["params"])}
+    fields = {**{field: ("n", f) for f, field in enumerate(NUMERIC_FIELDS)},
+              **{field: ("t", f) for f, field in enumerate(TEXT_FIELDS)}}
+
+    def _number(value, flag) -> float:
+        return int(value) if flag == INT else float(value)
+
+    def param_dict(row: int, col: int, order: List[int]) -> dict:
+        out = {}
+        for key_id in order:
+            kind, f = fields[strings[key_id]]
+            if kind == "n":
+                if flags[row][col][f] == ABSENT:
+                    continue
+                out[strings[key_id]] = _number(numbers[row][col][f], flags[row][col][f])
+            elif texts[row][col][f] >= 0:
+                out[strings[key_id]] = strings[texts[row][col][f]]
+        # Campi presenti ma non nell'ordine predefinito (es. valore_raw)
+        for f, field in enumerate(NUMERIC_FIELDS):
+            if field not in out and flags[row][col][f] != ABSENT:
+                out[field] = _number(numbers[row][col][f], flags[row][col][f])
+        for f, field in enumerate(TEXT_FIELDS):
+            if field not in out and texts[row][col][f] >= 0:
+                out[field] = strings[texts[row][col][f]]
+        return out
+
+    def entry(row: int) -> dict:
+        extra = meta["extras"][row] or {}
+        out = {}
+        if timestamps[row] >= 0:
+            out["timestamp"] = strings[timestamps[row]]
+        out.update(extra.get("entry", {}))
+        if extra.get("no_result"):
+            return _ordered(out, extra)
+        if "raw_result" in extra:
+            out["result"] = extra["raw_result"]
+            return _ordered(out, extra)
+        result_extra = extra.get("result", {})
+        param_orders = extra.get("param_order", {})
+        result = {}
+        for key_id in extra.get("order", meta["default_order"]) or []:
+            key = strings[key_id]
+            col = column.get(key)
+            if key in result_extra or col is None or not present[row][col]:
+                result[key] = result_extra.get(key)
+            else:
+                result[key] = param_dict(row, col, param_orders.get(key, meta["default_param_order"]))
+        out["result"] = result
+        return _ordered(out, extra)
+
+    patients, row = [], 0
+    for record in meta["patients"]:
+        if record.get("__history__") is None:
+            record.pop("__history__", None)  # file scritti prima che lo storico restasse al suo posto
+        else:
+            count = record["__history__"]
+            history = [entry(r) for r in range(row, row + count)]
+            row += count
+            record = {("analysis_history" if k == "__history__" else k): (history if k == "__history__" else v)
+                      for k, v in record.items()}
+        patients.append(record)
+    return patients
+
+
+def _ordered(out: dict, extra: dict) -> dict:
+    keys = extra.get("keys")
+    return {key: out[key] for key in keys} if keys else out
+
+
+# ------------------------------------------------------------------------------
+# REPORT SU DATI ESISTENTI
+# ------------------------------------------------------------------------------
+def _locale_sample(patients: int = 200, analyses: int = 10) -> List[dict]:
+    """Tenant sintetico con storico dello scoring locale (testi dall'albero decisionale)."""
+    import random
+
+    from agent.decision_tree import enrich_result
+    from agent.local_scorer import _synthetic_image, score_images
+
+    rng = random.Random(0)
+    image_rng = np.random.default_rng(0)
+    scored = [score_images([_synthetic_image(image_rng, 320, 240)]) for _ in range(12)]
+    records = []
+    for i in range(patients):
+        history = []
+        for k in range(analyses):
+            result = json.loads(json.dumps(rng.choice(scored)))
+            for param in result.values():
+                if isinstance(param, dict) and "valore" in param:
+                    param["valore"] = rng.randint(0, 100)
+            result = enrich_result(result, rng.choice(["Viso", "Collo", "Schiena"]), ["Secca"], ["Acne"],
+                                   overwrite=True)
+            result["engine"] = "locale"
+            history.append({"timestamp": f"2025-01-{k % 28 + 1:02d} 10:00:00", "result": result})
+        records.append({"id": f"p{i}", "nome": "Nome", "cognome": "Cognome", "analysis_history": history})
+    return records
+
+
+def _report(paths: List[str], locale_sample: bool = False):
+    import glob
+    import os
+
+    sources = []
+    for path in paths:
+        files = sorted(glob.glob(os.path.join(path, "*", "anagrafiche.json"))) if os.path.isdir(path) else [path]
+        for name in files:
+            with open(name, "rb") as f:
+                original = f.read()
+            sources.append((name, len(original), json.loads(original)))
+    if locale_sample:
+        patients = _locale_sample()
+        sources.append(("scoring locale (sintetico)", len(json.dumps(patients, indent=4)), patients))
+
+    codec = "zstd" if zstandard is not None else "zlib"
+    print(f"{'file':40} {'originale':>10} {'minificato':>11} {'min+' + codec:>10} {'colonne':>9} "
+          f"{'salvato':>9} {'riduzione':>10}")
+    totals = np.zeros(5)
+    for name, original, patients in sources:
+        minified = _dumps(patients)
+        saved = encode_patients(patients)
+        # Confronto sul testo JSON: anche l'ordine delle chiavi deve coincidere
+        assert _dumps(decode_patients(saved)) == minified, f"round-trip non riuscito per {name}"
+        sizes = np.array([original, len(minified), len(_compress(minified)[1]) + len(MAGIC_JSON) + 1,
+                          len(_encode_columns(patients)), len(saved)])
+        totals += sizes
+        layout = "colonne" if saved[:4] == MAGIC else "json"
+        print(f"{name:40} {sizes[0]:>10} {sizes[1]:>11} {sizes[2]:>10} {sizes[3]:>9} "
+              f"{sizes[4]:>9} {1 - sizes[4] / sizes[0]:>9.1%} ({layout})")
+    if len(sources) > 1:
+        print(f"{'totale':40} {totals[0]:>10.0f} {totals[1]:>11.0f} {totals[2]:>10.0f} {totals[3]:>9.0f} "
+              f"{totals[4]:>9.0f} {1 - totals[4] / totals[0]:>9.1%}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Formato compatto delle anagrafiche")
+    parser.add_argument("--report", nargs="*", metavar="PATH",
+                        help="cartelle user_data o file anagrafiche.json da misurare")
+    parser.add_argument("--locale-sample", action="store_true",
+                        help="aggiunge al report un tenant sintetico analizzato con lo scoring locale")
+    args = parser.parse_args()
+    if args.report is not None or args.locale_sample:
+        _report(args.report or [], args.locale_sample)
@@ -0,0 +1,100 @@
+"""
+Backend su file JSON (formato storico del progetto):
+- users/<username>.json
+- user_data/<username>/anagrafiche.json
+Le scritture sono atomiche (file temporaneo + os.replace).
+"""
+import json
+import os
+from typing import Hashable, Iterator, List, Optional
+
+from storage.base import Storage
+from storage.json_stream import iter_json_array
+
+
+def write_json_atomic(path: str, data, **dump_kwargs):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **dump_kwargs)
+    os.replace(tmp_path, path)
+
+
+class JsonStorage(Storage):
+    name = "json"
+
+    def __init__(self, users_folder: str = "users", data_folder: str = "user_data"):
+        super().__init__()
+        self.users_folder = users_folder
+        self.data_folder = data_folder
+        os.makedirs(self.users_folder, exist_ok=True)
+
+    # --------------------------------------------------------------------------
+    # Utenti
+    # --------------------------------------------------------------------------
+    def user_file(self, username: str) -> str:
+        return os.path.join(self.users_folder, f"{username}.json")
+
+    def get_user(self, username: str) -> Optional[dict]:
+        try:
+            with open(self.user_file(username), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save_user(self, user: dict):
+        write_json_atomic(self.user_file(user["username"]), user, indent=4, ensure_ascii=False)
+
+    def delete_user(self, username: str) -> bool:
+        try:
+            os.remove(self.user_file(username))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def list_users(self) -> List[str]:
+        if not os.path.isdir(self.users_folder):
+            return []
+        return sorted(f[:-len(".json")] for f in os.listdir(self.users_folder) if f.endswith(".json"))
+
+    # --------------------------------------------------------------------------
+    # Anagrafiche
+    # --------------------------------------------------------------------------
+    def patients_file(self, tenant: str) -> str:
+        """user_data/<tenant>/anagrafiche.json (la cartella viene creata se manca)."""
+        folder = os.path.join(self.data_folder, tenant)
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, "anagrafiche.json")
+
+    def load_patients(self, tenant: str) -> List[dict]:
+        try:
+            with open(self.patients_file(tenant), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+
+    def iter_patients(self, tenant: str, skip_history: bool = False) -> Iterator[dict]:
+        """Lettura incrementale del file: in memoria c'è un solo paziente alla volta."""
+        path = os.path.join(self.data_folder, tenant, "anagrafiche.json")
+        try:
+            yield from iter_json_array(path, skip_keys=("analysis_history",) if skip_history else ())
+        except FileNotFoundError:
+            return
+        except ValueError:
+            # File malformato: stesso comportamento di load_patients (nessun paziente)
+            return
+
+    def get_patient(self, tenant: str, patient_id: str) -> Optional[dict]:
+        # La scansione si ferma al primo paziente con l'id cercato
+        return next((p for p in self.iter_patients(tenant) if p.get("id") == patient_id), None)
+
+    def save_patients(self, tenant: str, patients: List[dict]):
+        with self.tenant_lock(tenant):
+            write_json_atomic(self.patients_file(tenant), self.stamp(tenant, patients), indent=4,
+                              ensure_ascii=False)
+
+    def tenant_version(self, tenant: str) -> Hashable:
+        try:
+            st = os.stat(os.path.join(self.data_folder, tenant, "anagrafiche.json"))
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
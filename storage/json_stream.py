@@ -0,0 +1,177 @@
+"""
+Lettura incrementale di un array JSON di oggetti (es. anagrafiche.json) con
+memoria limitata: il file viene letto a blocchi e ogni elemento è decodificato
+singolarmente, quindi in memoria c'è al più un record alla volta. Le chiavi
+indicate in `skip_keys` (es. analysis_history) vengono saltate durante la
+scansione senza mai essere decodificate.
+
+Benchmark di RSS di picco in funzione della dimensione del file:
+    python -m storage.json_stream --benchmark
+"""
+import json
+import re
+from typing import Iterable, Iterator
+
+CHUNK_SIZE = 64 * 1024
+
+# Caratteri strutturali fuori dalle stringhe / fine stringa o escape dentro
+_OUTSIDE = re.compile(rb'[\[\]{}",:]')
+_INSIDE = re.compile(rb'["\\]')
+
+
+def iter_json_array(path: str, skip_keys: Iterable[str] = (), chunk_size: int = CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Itera gli oggetti di primo livello dell'array JSON in `path`.
+    Le chiavi di primo livello degli oggetti presenti in `skip_keys` non
+    compaiono nei record restituiti.
+    """
+    skip = {key.encode("utf-8") for key in skip_keys}
+    depth = 0
+    in_string = escape = False
+    capturing = skipping = False
+    expect_key = key_capture = False
+    key = bytearray()
+    last_key = b""
+    out = bytearray()
+
+    with open(path, "rb") as f:
+        while True:
+            buf = f.read(chunk_size)
+            if not buf:
+                return
+            i, n = 0, len(buf)
+            seg_start = 0
+            if escape:
+                escape = False
+                i = 1
+            while i < n:
+                if in_string:
+                    m = _INSIDE.search(buf, i)
+                    if m is None:
+                        if key_capture:
+                            key += buf[i:n]
+                        i = n
+                        break
+                    j = m.start()
+                    if buf[j] == 0x5C:  # backslash: salta il carattere successivo
+                        if key_capture:
+                            key += buf[i:j + 2]
+                        if j + 1 >= n:
+                            escape = True
+                        i = j + 2
+                        continue
+                    if key_capture:
+                        key += buf[i:j]
+                        last_key, key_capture = bytes(key), False
+                    in_string = False
+                    i = j + 1
+                    continue
+
+                m = _OUTSIDE.search(buf, i)
+                if m is None:
+                    break
+                j = m.start()
+                c = buf[j]
+                if c == 0x22:  # "
+                    in_string = True
+                    if depth == 2 and expect_key and capturing:
+                        key_capture = True
+                        key = bytearray()
+                elif c in (0x7B, 0x5B):  # { [
+                    if depth == 1:
+                        capturing, seg_start, out = True, j, bytearray()
+                    depth += 1
+                    if depth == 2:
+                        expect_key = c == 0x7B
+                elif c in (0x7D, 0x5D):  # } ]
+                    if depth == 2 and skipping:
+                        skipping, seg_start = False, j
+                    depth -= 1
+                    if depth == 1 and capturing:
+                        out += buf[seg_start:j + 1]
+                        capturing = False
+                        record = json.loads(out)
+                        for name in skip_keys:
+                            record.pop(name, None)
+                        yield record
+                    elif depth == 0:
+                        return
+                elif c == 0x3A:  # :
+                    if depth == 2 and capturing and not skipping:
+                        expect_key = False
+                        if last_key in skip:
+                            out += buf[seg_start:j + 1]
+                            out += b"null"
+                            skipping = True
+                elif c == 0x2C:  # ,
+                    if depth == 2:
+                        if skipping:
+                            skipping, seg_start = False, j
+                        expect_key = True
+                i = j + 1
+            if capturing and not skipping:
+                out += buf[seg_start:n]
+
+
+# ------------------------------------------------------------------------------
+# BENCHMARK
+# ------------------------------------------------------------------------------
+def _measure(mode: str, path: str):
+    """Eseguito in un processo separato: legge il file e stampa l'RSS di picco (KB)."""
+    import resource
+
+    if mode == "json.load":
+        with open(path, "r", encoding="utf-8") as f:
+            count = len(json.load(f))
+    elif mode == "stream":
+        count = sum(1 for _ in iter_json_array(path))
+    else:
+        count = sum(1 for _ in iter_json_array(path, skip_keys=("analysis_history",)))
+    print(count, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def _benchmark(sizes_mb):
+    import os
+    import subprocess
+    import sys
+    import tempfile
+    import time
+
+    result = {f"Parametro {i}": {"valore": i * 10, "descrizione": "Descrizione dettagliata " * 8,
+                                 "valutazione_professionale": "Valutazione " * 10} for i in range(9)}
+    print(f"{'file MB':>8} {'modalità':10} {'pazienti':>9} {'RSS picco MB':>13} {'tempo s':>8}")
+    for size_mb in sizes_mb:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "anagrafiche.json")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("[")
+                written, pid = 0, 0
+                while written < size_mb * 1024 * 1024:
+                    patient = {"id": f"p{pid}", "nome": "Nome", "cognome": "Cognome",
+                               "analysis_history": [{"timestamp": "2025-01-01 10:00:00", "result": result}] * 20}
+                    text = ("," if pid else "") + json.dumps(patient, indent=4, ensure_ascii=False)
+                    f.write(text)
+                    written += len(text)
+                    pid += 1
+                f.write("]")
+            actual_mb = os.path.getsize(path) / 1024 / 1024
+            for mode in ("json.load", "stream", "skip"):
+                start = time.perf_counter()
+                out = subprocess.run([sys.executable, "-m", "storage.json_stream", "--measure", mode, path],
+                                     capture_output=True, text=True, check=True).stdout.split()
+                elapsed = time.perf_counter() - start
+                print(f"{actual_mb:>8.1f} {mode:10} {out[0]:>9} {int(out[1]) / 1024:>13.1f} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Lettura incrementale di array JSON")
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--sizes", default="5,20,80", help="dimensioni dei file di prova in MB")
+    parser.add_argument("--measure", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        _measure(*args.measure)
+    if args.benchmark:
+        _benchmark([float(size) for size in args.sizes.split(",")])
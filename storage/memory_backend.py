@@ -0,0 +1,72 @@
+"""
+Backend in memoria (test, benchmark, sviluppo). I dati vengono copiati in
+lettura e scrittura, così il chiamante ha la stessa semantica dei backend
+persistenti (le modifiche valgono solo dopo il salvataggio).
+"""
+import copy
+import itertools
+from typing import Dict, Hashable, List, Optional
+
+from storage.base import Storage
+
+
+class MemoryStorage(Storage):
+    name = "memory"
+
+    def __init__(self):
+        super().__init__()
+        self._users: Dict[str, dict] = {}
+        self._patients: Dict[str, List[dict]] = {}
+        self._versions: Dict[str, int] = {}
+        self._counter = itertools.count(1)
+
+    def get_user(self, username: str) -> Optional[dict]:
+        user = self._users.get(username)
+        return copy.deepcopy(user) if user is not None else None
+
+    def save_user(self, user: dict):
+        self._users[user["username"]] = copy.deepcopy(user)
+
+    def delete_user(self, username: str) -> bool:
+        return self._users.pop(username, None) is not None
+
+    def list_users(self) -> List[str]:
+        return sorted(self._users)
+
+    def load_patients(self, tenant: str) -> List[dict]:
+        return copy.deepcopy(self._patients.get(tenant, []))
+
+    def save_patients(self, tenant: str, patients: List[dict]):
+        with self.tenant_lock(tenant):
+            self._patients[tenant] = copy.deepcopy(self.stamp(tenant, patients))
+            self._versions[tenant] = next(self._counter)
+
+    def tenant_version(self, tenant: str) -> Hashable:
+        return self._versions.get(tenant)
+
+    def get_patient(self, tenant: str, patient_id: str) -> Optional[dict]:
+        patient = next((p for p in self._patients.get(tenant, []) if p.get("id") == patient_id), None)
+        return copy.deepcopy(patient) if patient is not None else None
+
+    def create_patient(self, tenant: str, record: dict) -> dict:
+        with self.tenant_lock(tenant):
+            record["source_user"] = tenant
+            self._patients.setdefault(tenant, []).append(copy.deepcopy(record))
+            self._versions[tenant] = next(self._counter)
+            return record
+
+    def create_patients(self, tenant: str, records: List[dict]) -> int:
+        with self.tenant_lock(tenant):
+            self._patients.setdefault(tenant, []).extend(copy.deepcopy(self.stamp(tenant, records)))
+            self._versions[tenant] = next(self._counter)
+            return len(records)
+
+    def append_analysis(self, tenant: str, patient_id: str, entry: dict):
+        with self.tenant_lock(tenant):
+            patients = self._patients.get(tenant, [])
+            for pos, patient in enumerate(patients):
+                if patient.get("id") == patient_id:
+                    patient.setdefault("analysis_history", []).append(copy.deepcopy(entry))
+                    self._versions[tenant] = next(self._counter)
+                    return pos, copy.deepcopy(patient), len(patient["analysis_history"]) - 1
+            return None
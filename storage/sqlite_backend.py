@@ -0,0 +1,230 @@
+"""
+Backend SQLite (file unico, modalità WAL). Utenti e pazienti sono salvati
+come documenti JSON per riga; le operazioni granulari (append di un'analisi,
+modifica di un paziente) riscrivono solo la riga interessata invece
+dell'intero tenant. La colonna `version` di `tenants` è il token di versione
+usato dagli indici in memoria, valido anche fra processi diversi.
+"""
+import json
+import sqlite3
+import threading
+from typing import Callable, Hashable, List, Optional, Tuple
+
+from storage.base import Storage, apply_fields, changed_fields
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS patients (
+    tenant TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    id TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (tenant, position)
+);
+CREATE INDEX IF NOT EXISTS patients_by_id ON patients (tenant, id);
+CREATE TABLE IF NOT EXISTS tenants (
+    tenant TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+
+def _dumps(data) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class SqliteStorage(Storage):
+    name = "sqlite"
+
+    def __init__(self, path: str = "storage.db"):
+        super().__init__()
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.RLock()
+
+    def _transaction(self):
+        return _Transaction(self._conn, self._lock)
+
+    def _bump(self, tenant: str):
+        self._conn.execute(
+            "INSERT INTO tenants (tenant, version) VALUES (?, 1) "
+            "ON CONFLICT(tenant) DO UPDATE SET version = version + 1", (tenant,))
+
+    # --------------------------------------------------------------------------
+    # Utenti
+    # --------------------------------------------------------------------------
+    def get_user(self, username: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM users WHERE username = ?", (username,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_user(self, user: dict):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO users (username, data) VALUES (?, ?)",
+                               (user["username"], _dumps(user)))
+
+    def create_user(self, user: dict) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("INSERT OR IGNORE INTO users (username, data) VALUES (?, ?)",
+                                        (user["username"], _dumps(user)))
+        return cursor.rowcount == 1
+
+    def delete_user(self, username: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM users WHERE username = ?", (username,))
+        return cursor.rowcount == 1
+
+    def list_users(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT username FROM users ORDER BY username")]
+
+    def list_user_records(self) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM users ORDER BY username").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def append_login_event(self, username: str, event: dict) -> bool:
+        with self._transaction():
+            row = self._conn.execute("SELECT data FROM users WHERE username = ?", (username,)).fetchone()
+            if row is None:
+                return False
+            user = json.loads(row[0])
+            user.setdefault("login_history", []).append(event)
+            self._conn.execute("UPDATE users SET data = ? WHERE username = ?", (_dumps(user), username))
+            return True
+
+    # --------------------------------------------------------------------------
+    # Anagrafiche
+    # --------------------------------------------------------------------------
+    def load_patients(self, tenant: str) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM patients WHERE tenant = ? ORDER BY position",
+                                      (tenant,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def save_patients(self, tenant: str, patients: List[dict]):
+        self.stamp(tenant, patients)
+        with self._transaction():
+            self._conn.execute("DELETE FROM patients WHERE tenant = ?", (tenant,))
+            self._conn.executemany(
+                "INSERT INTO patients (tenant, position, id, data) VALUES (?, ?, ?, ?)",
+                [(tenant, pos, p.get("id"), _dumps(p)) for pos, p in enumerate(patients)])
+            self._bump(tenant)
+
+    def tenant_version(self, tenant: str) -> Hashable:
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM tenants WHERE tenant = ?", (tenant,)).fetchone()
+        return row[0] if row else None
+
+    def _find(self, tenant: str, patient_id: str) -> Optional[Tuple[int, dict]]:
+        row = self._conn.execute(
+            "SELECT position, data FROM patients WHERE tenant = ? AND id = ? ORDER BY position LIMIT 1",
+            (tenant, patient_id)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def get_patient(self, tenant: str, patient_id: str) -> Optional[dict]:
+        with self._lock:
+            found = self._find(tenant, patient_id)
+        return found[1] if found else None
+
+    def create_patient(self, tenant: str, record: dict) -> dict:
+        record["source_user"] = tenant
+        with self._transaction():
+            position = self._conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM patients WHERE tenant = ?",
+                                          (tenant,)).fetchone()[0]
+            self._conn.execute("INSERT INTO patients (tenant, position, id, data) VALUES (?, ?, ?, ?)",
+                               (tenant, position, record.get("id"), _dumps(record)))
+            self._bump(tenant)
+        return record
+
+    def create_patients(self, tenant: str, records: List[dict]) -> int:
+        self.stamp(tenant, records)
+        with self._transaction():
+            start = self._conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM patients WHERE tenant = ?",
+                                       (tenant,)).fetchone()[0]
+            self._conn.executemany(
+                "INSERT INTO patients (tenant, position, id, data) VALUES (?, ?, ?, ?)",
+                [(tenant, start + pos, p.get("id"), _dumps(p)) for pos, p in enumerate(records)])
+            self._bump(tenant)
+        return len(records)
+
+    def update_patient(self, tenant: str, patient_id: str, record: dict) -> Optional[dict]:
+        record["source_user"] = tenant
+        with self._transaction():
+            found = self._find(tenant, patient_id)
+            if found is None:
+                return None
+            self._conn.execute("UPDATE patients SET id = ?, data = ? WHERE tenant = ? AND position = ?",
+                               (record.get("id"), _dumps(record), tenant, found[0]))
+            self._bump(tenant)
+        return record
+
+    def patch_patient(self, tenant: str, patient_id: str, patch: Callable[[dict], dict]) -> Optional[dict]:
+        with self._transaction():
+            found = self._find(tenant, patient_id)
+            if found is None:
+                return None
+            position, patient = found
+            updated, removed = changed_fields(patient, patch(json.loads(_dumps(patient))))
+            if updated or removed:
+                apply_fields(patient, updated, removed)
+                self._conn.execute("UPDATE patients SET id = ?, data = ? WHERE tenant = ? AND position = ?",
+                                   (patient.get("id"), _dumps(patient), tenant, position))
+                self._bump(tenant)
+        return patient
+
+    def delete_patient(self, tenant: str, patient_id: str) -> Optional[dict]:
+        with self._transaction():
+            found = self._find(tenant, patient_id)
+            if found is None:
+                return None
+            self._conn.execute("DELETE FROM patients WHERE tenant = ? AND position = ?", (tenant, found[0]))
+            self._bump(tenant)
+        return found[1]
+
+    def append_analysis(self, tenant: str, patient_id: str, entry: dict):
+        with self._transaction():
+            found = self._find(tenant, patient_id)
+            if found is None:
+                return None
+            position, patient = found
+            patient.setdefault("analysis_history", []).append(entry)
+            patient["source_user"] = tenant
+            self._conn.execute("UPDATE patients SET data = ? WHERE tenant = ? AND position = ?",
+                               (_dumps(patient), tenant, position))
+            self._bump(tenant)
+            # Le posizioni possono avere buchi dopo una cancellazione: l'indice
+            # nella lista ordinata è il numero di pazienti che precedono
+            patient_pos = self._conn.execute("SELECT COUNT(*) FROM patients WHERE tenant = ? AND position < ?",
+                                             (tenant, position)).fetchone()[0]
+        return patient_pos, patient, len(patient["analysis_history"]) - 1
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE / COMMIT (o ROLLBACK) sotto il lock della connessione."""
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.RLock):
+        self._conn = conn
+        self._lock = lock
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self._lock.release()
+        return False
@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+# I moduli dei servizi stanno nella radice del repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Servizi importati dai test: storage in memoria e database ausiliari in una cartella temporanea
+_folder = tempfile.mkdtemp(prefix="tests-")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("CHANGE_LOG_PATH", os.path.join(_folder, "changes.db"))
+os.environ.setdefault("IDEMPOTENCY_PATH", os.path.join(_folder, "idempotency.db"))
+os.environ.setdefault("SCORE_STORE_FOLDER", os.path.join(_folder, "score_store"))
+os.environ.setdefault("ANALYSIS_WARMUP", "0")
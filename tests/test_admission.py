@@ -0,0 +1,79 @@
+"""Controllo di ammissione: posti e coda restano coerenti con le richieste cancellate."""
+import asyncio
+
+from admission import AdmissionController
+
+
+def controller() -> AdmissionController:
+    return AdmissionController(capacity=1, rate=100.0, burst=100.0, max_in_flight=1,
+                               target_wait=60.0, max_queue=10, weights={})
+
+
+def test_cancelled_waiter_before_release_does_not_leak_a_slot():
+    async def scenario():
+        admission = controller()
+        await admission.acquire("a")
+        queued = asyncio.ensure_future(admission.acquire("b"))
+        await asyncio.sleep(0)
+        assert admission.stats()["queued"] == 1
+
+        # Cancellazione e rilascio del posto prima che l'handler della cancellazione giri
+        queued.cancel()
+        admission.release("a")
+        try:
+            await queued
+        except asyncio.CancelledError:
+            pass
+
+        stats = admission.stats()
+        assert (stats["in_flight"], stats["queued"]) == (0, 0)
+        assert stats["tenants"]["b"]["in_flight"] == 0
+        # Il posto è di nuovo disponibile
+        await asyncio.wait_for(admission.acquire("c"), 1.0)
+        assert admission.stats()["in_flight"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_is_skipped_for_the_next_in_queue():
+    async def scenario():
+        admission = controller()
+        await admission.acquire("a")
+        cancelled = asyncio.ensure_future(admission.acquire("b"))
+        waiting = asyncio.ensure_future(admission.acquire("c"))
+        await asyncio.sleep(0)
+
+        cancelled.cancel()
+        admission.release("a")
+        await asyncio.wait_for(waiting, 1.0)
+        try:
+            await cancelled
+        except asyncio.CancelledError:
+            pass
+
+        stats = admission.stats()
+        assert (stats["in_flight"], stats["queued"]) == (1, 0)
+        assert stats["tenants"]["c"]["in_flight"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_granted_then_cancelled_waiter_returns_its_slot():
+    async def scenario():
+        admission = controller()
+        await admission.acquire("a")
+        queued = asyncio.ensure_future(admission.acquire("b"))
+        await asyncio.sleep(0)
+
+        # Posto assegnato, poi la richiesta viene cancellata prima di riprendere
+        admission.release("a")
+        queued.cancel()
+        try:
+            await queued
+        except asyncio.CancelledError:
+            pass
+
+        stats = admission.stats()
+        assert (stats["in_flight"], stats["queued"]) == (0, 0)
+
+    asyncio.run(scenario())
@@ -0,0 +1,59 @@
+"""Funzioni di agent_api su storage in memoria (vedi conftest.py)."""
+import pytest
+
+import agent_api
+from agent.parameters import DENSITY_PARAMETER
+from change_log import change_log
+from storage import get_storage
+
+TENANT = "centro-sessioni"
+
+
+def analysis(session_id, raw, timestamp="2025-01-01 10:00:00"):
+    return {"timestamp": timestamp,
+            "result": {"session_id": session_id, DENSITY_PARAMETER: {"valore": raw / 100, "valore_raw": raw}}}
+
+
+@pytest.fixture
+def tenant():
+    storage = get_storage()
+    storage.save_patients(TENANT, [
+        {"id": "p1", "analysis_history": [analysis("s1", 40), analysis("altra", 10), analysis("s1", 70)]},
+        {"id": "p2", "analysis_history": [analysis("altra", 20)]},
+        {"id": "p3", "analysis_history": [analysis("s1", 100)]},
+    ])
+    agent_api.session_index.invalidate(TENANT)
+    return storage
+
+
+def test_renormalize_session_updates_only_the_session(tenant):
+    since = change_log.current_seq(TENANT)
+    result = agent_api.renormalize_session(TENANT, "s1", None, [DENSITY_PARAMETER])
+
+    assert result["analyses_updated"] == 3
+    assert result["min_raw"] == {DENSITY_PARAMETER: 40.0}
+    values = {p["id"]: [e["result"][DENSITY_PARAMETER]["valore"] for e in p["analysis_history"]]
+              for p in tenant.load_patients(TENANT)}
+    assert values == {"p1": [0.0, 0.1, 0.5], "p2": [0.2], "p3": [1.0]}
+
+    delta = change_log.delta(tenant, TENANT, since)
+    assert sorted((a["patient_id"], a["index"]) for a in delta["analyses"]) == \
+        [("p1", 0), ("p1", 2), ("p3", 0)]
+
+
+def test_renormalize_session_for_one_patient(tenant):
+    result = agent_api.renormalize_session(TENANT, "s1", "p1", [DENSITY_PARAMETER])
+
+    assert result["analyses_updated"] == 2
+    p1, _, p3 = tenant.load_patients(TENANT)
+    assert [e["result"][DENSITY_PARAMETER]["valore"] for e in p1["analysis_history"]] == [0.0, 0.1, 0.5]
+    assert p3["analysis_history"][0]["result"][DENSITY_PARAMETER]["valore"] == 1.0
+
+
+def test_trend_percentile_compares_with_other_patients_only(tenant):
+    get_storage().save_patients(TENANT, [
+        {"id": "p1", "analysis_history": [analysis("s1", 90)]},
+        {"id": "p2", "analysis_history": [analysis("s1", 10)]},
+    ])
+    trends = agent_api.patient_trends(TENANT, "p1", None, 3, 30)
+    assert trends["parametri"][DENSITY_PARAMETER]["percentile_centro"] == 100.0
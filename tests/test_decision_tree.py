@@ -0,0 +1,18 @@
+"""Testi dell'albero decisionale per i risultati del modello."""
+from agent.decision_tree import enrich_result
+
+
+def test_string_scores_get_texts_like_numbers():
+    from_string = enrich_result({"Idratazione": {"valore": "72"}, "Tonalità": {"valore": "40,5"}}, "Viso")
+    from_number = enrich_result({"Idratazione": {"valore": 72}, "Tonalità": {"valore": 40.5}}, "Viso")
+
+    for parameter in ("Idratazione", "Tonalità"):
+        assert from_string[parameter]["consigli"] == from_number[parameter]["consigli"]
+        assert from_string[parameter]["valutazione_professionale"]
+    # Il valore salvato resta quello del modello: lo converte la normalizzazione
+    assert from_string["Idratazione"]["valore"] == "72"
+
+
+def test_non_numeric_scores_are_left_alone():
+    result = enrich_result({"Cheratina": {"valore": "n/d"}}, "Viso")
+    assert result == {"Cheratina": {"valore": "n/d"}}
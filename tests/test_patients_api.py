@@ -0,0 +1,104 @@
+"""Endpoint delle anagrafiche (storage in memoria, vedi conftest.py)."""
+import json
+
+import bcrypt
+import pytest
+from fastapi.testclient import TestClient
+
+import patients_api
+from storage import get_storage
+
+USER = {"username": "medico", "password": "segreta"}
+PATIENT = {"id": "p1", "nome": "Anna", "cognome": "Rossi", "birth_date": "1980-01-01", "address": "Via Roma 1",
+           "peso": 60.0, "altezza": 170.0, "gender": "F", "skin_types": ["Secca"], "issues": []}
+
+
+@pytest.fixture
+def client():
+    storage = get_storage()
+    storage.save_user({"username": USER["username"],
+                       "hashed_password": bcrypt.hashpw(USER["password"].encode(), bcrypt.gensalt(4)).decode()})
+    storage.save_patients(USER["username"], [])
+    storage.create_patient(USER["username"], dict(PATIENT, analysis_history=[]))
+    with TestClient(patients_api.app) as client:
+        yield client
+
+
+def test_put_keeps_analyses_appended_after_the_get(client):
+    response = client.get("/anagrafiche/p1", params=USER)
+    etag, record = response.headers["ETag"], response.json()
+
+    # Analisi aggiunta (come da /analyze_skin) fra la lettura del client e la sua PUT
+    get_storage().append_analysis(USER["username"], "p1", {"timestamp": "2025-01-01 10:00:00", "result": {}})
+
+    record["address"] = "Via Milano 2"
+    response = client.put("/anagrafiche/p1", params=USER, json=record, headers={"If-Match": etag})
+    assert response.status_code == 200
+    stored = get_storage().get_patient(USER["username"], "p1")
+    assert stored["address"] == "Via Milano 2"
+    assert [entry["timestamp"] for entry in stored["analysis_history"]] == ["2025-01-01 10:00:00"]
+
+
+def test_put_with_stale_etag_is_rejected(client):
+    etag = client.get("/anagrafiche/p1", params=USER).headers["ETag"]
+    client.patch("/anagrafiche/p1", params=USER, json={"cognome": "Bianchi"})
+
+    response = client.put("/anagrafiche/p1", params=USER, json=dict(PATIENT, nome="Anna Maria"),
+                          headers={"If-Match": etag})
+    assert response.status_code == 412
+    assert get_storage().get_patient(USER["username"], "p1")["nome"] == "Anna"
+
+
+def ndjson(*records) -> bytes:
+    return b"".join(json.dumps(record).encode() + b"\n" for record in records)
+
+
+def test_import_writes_in_bounded_chunks(client, monkeypatch):
+    monkeypatch.setattr(patients_api, "IMPORT_WRITE_CHUNK", 2)
+    writes = []
+    create_patients = get_storage().create_patients
+    monkeypatch.setattr(get_storage(), "create_patients",
+                        lambda tenant, records: writes.append(len(records)) or create_patients(tenant, records))
+
+    body = ndjson(*(dict(PATIENT, id=f"n{i}") for i in range(5)))
+    response = client.post("/anagrafiche/import", params=USER, content=body)
+    assert response.status_code == 200
+    assert response.json()["imported"] == 5
+    assert writes == [2, 2, 1]
+    assert len(get_storage().load_patients(USER["username"])) == 6
+
+
+def test_import_rejects_long_lines_per_line(client, monkeypatch):
+    monkeypatch.setattr(patients_api, "IMPORT_MAX_LINE_BYTES", 400)
+    long_line = dict(PATIENT, id="lunga", address="x" * 1000)
+    body = ndjson(dict(PATIENT, id="n1"), long_line, dict(PATIENT, id="n2"))
+
+    response = client.post("/anagrafiche/import", params=USER, content=body)
+    assert response.status_code == 422
+    assert [error["line"] for error in response.json()["detail"]["errors"]] == [2]
+    assert len(get_storage().load_patients(USER["username"])) == 1
+
+    response = client.post("/anagrafiche/import", params=dict(USER, skip_invalid="true"), content=body)
+    assert response.json()["imported"] == 2
+    assert response.json()["skipped"] == 1
+
+
+def test_import_with_duplicate_ids_writes_nothing(client):
+    body = ndjson(dict(PATIENT, id="n1"), dict(PATIENT, id="p1"), dict(PATIENT, id="n1"))
+    response = client.post("/anagrafiche/import", params=USER, content=body)
+    assert response.status_code == 422
+    assert [error["line"] for error in response.json()["detail"]["errors"]] == [2, 3]
+    assert [p["id"] for p in get_storage().load_patients(USER["username"])] == ["p1"]
+
+
+def test_import_discards_long_lines_while_streaming(client, monkeypatch):
+    monkeypatch.setattr(patients_api, "IMPORT_MAX_LINE_BYTES", 400)
+    body = ndjson(dict(PATIENT, id="n1"), dict(PATIENT, id="lunga", address="x" * 5000), dict(PATIENT, id="n2"))
+
+    def chunks():
+        for start in range(0, len(body), 64):
+            yield body[start:start + 64]
+
+    response = client.post("/anagrafiche/import", params=dict(USER, skip_invalid="true"), content=chunks())
+    assert response.json() == {"message": "Import completato", "imported": 2, "skipped": 1,
+                               "errors": [{"line": 2, "error": "Riga oltre 400 byte."}]}
@@ -1,12 +1,14 @@
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import os
-import json
 import bcrypt
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict
 from datetime import datetime
 
+from metrics import instrument_app, instrument_storage
+from storage import get_storage
+from utils import check_password, verify_admin_credentials, paginate_items
+
 app = FastAPI(root_path="/api4")
 
 # Configurazione CORS (aperta, modificabile in base alle necessità)
@@ -17,13 +19,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Metriche delle richieste e GET /metrics (METRICS_ENABLED=0 per disattivarle)
+instrument_app(app, "users")
 
-# Cartella in cui salvare i file utente
-USERS_FOLDER = "users"
-
-# Assicuriamoci che la cartella esista
-if not os.path.exists(USERS_FOLDER):
-    os.makedirs(USERS_FOLDER)
+# Persistenza condivisa con gli altri servizi (backend scelto con STORAGE_BACKEND),
+# con i tempi delle chiamate nelle metriche (stage "storage.<metodo>")
+storage = instrument_storage(get_storage())
 
 
 # -----------------------------
@@ -51,74 +52,26 @@ class UpdateUserRequest(BaseModel):
 # -----------------------------
 # Helper Functions
 # -----------------------------
-def get_user_file_path(username: str) -> str:
-    """
-    Ritorna il path del file JSON di un utente a partire dallo username.
-    """
-    return os.path.join(USERS_FOLDER, f"{username}.json")
-
-
 def load_user_data(username: str) -> dict:
     """
-    Carica i dati di un utente dal file corrispondente.
+    Carica i dati di un utente.
     Solleva HTTPException(404) se l'utente non esiste.
     """
-    file_path = get_user_file_path(username)
-    if not os.path.isfile(file_path):
+    user_data = storage.get_user(username)
+    if user_data is None:
         raise HTTPException(status_code=404, detail="Utente non trovato.")
-    with open(file_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return user_data
 
 
 def save_user_data(user_data: dict):
     """
-    Salva i dati di un utente nel file nominato in base allo username.
-    """
-    username = user_data["username"]
-    file_path = get_user_file_path(username)
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(user_data, f, indent=4)
-
-
-def verify_admin_credentials(admin_username: str, admin_password: str):
-    """
-    Verifica autorizzazione admin.
-    Accetta username admin in forma case-insensitive ma usa l'account admin di sistema.
+    Salva i dati di un utente (identificato dallo username).
     """
-    if admin_username.upper() != "ADMIN":
-        raise HTTPException(status_code=403, detail="Accesso non autorizzato.")
-
-    try:
-        admin_data = load_user_data("admin")
-    except HTTPException:
-        raise HTTPException(status_code=401, detail="Credenziali admin non valide.")
-
-    if not bcrypt.checkpw(admin_password.encode("utf-8"), admin_data["hashed_password"].encode("utf-8")):
-        raise HTTPException(status_code=401, detail="Credenziali admin non valide.")
-
-
-def paginate_items(items: List[Any], page: int, page_size: int) -> dict:
-    total_items = len(items)
-    total_pages = (total_items + page_size - 1) // page_size if total_items > 0 else 0
-
-    start = (page - 1) * page_size
-    end = start + page_size
-
-    return {
-        "page": page,
-        "page_size": page_size,
-        "total_items": total_items,
-        "total_pages": total_pages,
-        "items": items[start:end]
-    }
+    storage.save_user(user_data)
 
 
 def append_login_history(username: str):
-    user_data = load_user_data(username)
-    login_history = user_data.get("login_history", [])
-    login_history.append({"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
-    user_data["login_history"] = login_history
-    save_user_data(user_data)
+    storage.append_login_event(username, {"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
 
 
 # -----------------------------
@@ -128,13 +81,11 @@ def append_login_history(username: str):
 def register_user(user: UserCreate):
     """
     Registra un nuovo utente.
-    - Crea un file JSON nominato <username>.json
     - Salva l'hash della password e i metadati
+    - Fallisce con 409 se lo username esiste già (controllo e creazione atomici)
     """
-    file_path = get_user_file_path(user.username)
-
     # 1. Verifica che l'utente non esista già
-    if os.path.exists(file_path):
+    if storage.get_user(user.username) is not None:
         raise HTTPException(
             status_code=409,
             detail="Username già esistente. Scegli un username diverso."
@@ -143,13 +94,17 @@ def register_user(user: UserCreate):
     # 2. Hash della password
     hashed_password = bcrypt.hashpw(user.password.encode("utf-8"), bcrypt.gensalt())
 
-    # 3. Salva il file
+    # 3. Salva l'utente
     user_data = {
         "username": user.username,
         "hashed_password": hashed_password.decode("utf-8"),
         "metadata": user.metadata
     }
-    save_user_data(user_data)
+    if not storage.create_user(user_data):
+        raise HTTPException(
+            status_code=409,
+            detail="Username già esistente. Scegli un username diverso."
+        )
 
     return {"message": "Registrazione avvenuta con successo."}
 
@@ -172,8 +127,7 @@ def login_user(credentials: LoginRequest):
         raise HTTPException(status_code=401, detail="Username o password non validi.")
 
     # 2. Verifica l'hash della password
-    hashed_password = user_data["hashed_password"].encode("utf-8")
-    if bcrypt.checkpw(credentials.password.encode("utf-8"), hashed_password):
+    if check_password(credentials.username, credentials.password, user_data["hashed_password"]):
         append_login_history(credentials.username)
         return {"message": "Login effettuato con successo."}
     else:
@@ -232,18 +186,8 @@ def admin_change_password(target_username: str, req: AdminChangePasswordRequest)
       - admin_password: password corrente dell'admin (verificata tramite hash)
       - new_password: la nuova password da assegnare all'utente target
     """
-    # Verifica che l'utente che richiede l'operazione sia "admin"
-    if req.admin_username != "admin":
-        raise HTTPException(status_code=403, detail="Accesso non autorizzato.")
-
-    # Verifica le credenziali dell'admin
-    try:
-        admin_data = load_user_data(req.admin_username)
-    except HTTPException:
-        raise HTTPException(status_code=401, detail="Credenziali admin non valide.")
-
-    if not bcrypt.checkpw(req.admin_password.encode("utf-8"), admin_data["hashed_password"].encode("utf-8")):
-        raise HTTPException(status_code=401, detail="Credenziali admin non valide.")
+    # Verifica che l'utente che richiede l'operazione sia "admin" e le sue credenziali
+    verify_admin_credentials(req.admin_username, req.admin_password, exact=True)
 
     # Carica i dati dell'utente target
     try:
@@ -270,13 +214,7 @@ def get_all_accounts(admin_username: str, admin_password: str):
     """
     verify_admin_credentials(admin_username, admin_password)
 
-    # Leggi tutti i file utente nella cartella USERS_FOLDER
-    accounts = []
-    for filename in os.listdir(USERS_FOLDER):
-        if filename.endswith(".json"):
-            with open(os.path.join(USERS_FOLDER, filename), "r", encoding="utf-8") as f:
-                user_info = json.load(f)
-                accounts.append(user_info)
+    accounts = storage.list_user_records()
 
     return {"accounts": accounts}
 
@@ -324,26 +262,12 @@ def admin_delete_user(target_username: str, admin_username: str, admin_password:
     if target_username == "admin":
         raise HTTPException(status_code=403, detail="L'admin non può eliminare se stesso.")
 
-    # Verifica che chi effettua la richiesta sia "admin"
-    if admin_username != "admin":
-        raise HTTPException(status_code=403, detail="Accesso non autorizzato.")
+    # Verifica che chi effettua la richiesta sia "admin" e le sue credenziali
+    verify_admin_credentials(admin_username, admin_password, exact=True)
 
-    # Verifica le credenziali dell'admin
-    try:
-        admin_data = load_user_data(admin_username)
-    except HTTPException:
-        raise HTTPException(status_code=401, detail="Credenziali admin non valide.")
-
-    if not bcrypt.checkpw(admin_password.encode("utf-8"), admin_data["hashed_password"].encode("utf-8")):
-        raise HTTPException(status_code=401, detail="Credenziali admin non valide.")
-
-    # Verifica che l'utente target esista
-    file_path = get_user_file_path(target_username)
-    if not os.path.exists(file_path):
+    # Elimina l'utente target (404 se non esiste)
+    if not storage.delete_user(target_username):
         raise HTTPException(status_code=404, detail="Utente di destinazione non trovato.")
-
-    # Elimina il file corrispondente all'utente target
-    os.remove(file_path)
     return {"message": f"Utente '{target_username}' eliminato con successo."}
 
 
@@ -363,8 +287,7 @@ def get_own_data(username: str, password: str):
         raise HTTPException(status_code=404, detail="Utente non trovato.")
 
     # Verifica le credenziali
-    hashed_password = user_data["hashed_password"].encode("utf-8")
-    if not bcrypt.checkpw(password.encode("utf-8"), hashed_password):
+    if not check_password(username, password, user_data["hashed_password"]):
         raise HTTPException(status_code=401, detail="Credenziali non valide.")
 
     # Rimuove il campo hashed_password dalla risposta (opzionale)
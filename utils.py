@@ -1,22 +1,122 @@
+import hashlib
 import os
-import json
+import threading
+import time
+from collections import OrderedDict
+
 import bcrypt
 from fastapi import HTTPException
+from typing import Any, List
+
+from metrics import inc, span
+from storage import get_storage
+
+# Verifiche bcrypt riuscite tenute in cache per CREDENTIALS_CACHE_TTL secondi
+# (0 = disattivata). La cache è per processo: con il gateway è condivisa da
+# tutti i servizi montati.
+CREDENTIALS_CACHE_TTL = float(os.getenv("CREDENTIALS_CACHE_TTL", "300"))
+CREDENTIALS_CACHE_SIZE = int(os.getenv("CREDENTIALS_CACHE_SIZE", "4096"))
+
+
+class CredentialCache:
+    """
+    Cache LRU delle coppie username/password già verificate. La chiave è un
+    digest che include l'hash bcrypt salvato: se la password dell'utente
+    cambia, le voci precedenti non corrispondono più. I tentativi falliti non
+    vengono memorizzati (ogni errore costa sempre un checkpw).
+    """
+
+    def __init__(self, ttl: float = CREDENTIALS_CACHE_TTL, max_entries: int = CREDENTIALS_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(username: str, password: str, hashed_password: str) -> bytes:
+        return hashlib.sha256("\0".join((username, password, hashed_password)).encode("utf-8")).digest()
+
+    def check(self, username: str, password: str, hashed_password: str) -> bool:
+        key = self._key(username, password, hashed_password)
+        now = time.monotonic()
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is not None and expires > now:
+                self._entries.move_to_end(key)
+                inc("credential_checks_total", result="cache_hit")
+                return True
+        with span("auth.bcrypt"):
+            valid = bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8"))
+        inc("credential_checks_total", result="bcrypt_ok" if valid else "bcrypt_fail")
+        if not valid:
+            return False
+        if self.ttl > 0:
+            with self._lock:
+                self._entries[key] = now + self.ttl
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+credential_cache = CredentialCache()
+
+
+def check_password(username: str, password: str, hashed_password: str) -> bool:
+    """Confronta la password con l'hash bcrypt salvato (passando dalla cache condivisa)."""
+    return credential_cache.check(username, password, hashed_password)
 
-USERS_FOLDER = "users"  # cartella dove sono i file <username>.json
 
 def verify_credentials(username: str, password: str) -> bool:
     """
     Verifica che l'utente esista e che la password sia corretta.
     Ritorna True o False.
     """
-    user_file = os.path.join(USERS_FOLDER, f"{username}.json")
-    if not os.path.isfile(user_file):
+    user_data = get_storage().get_user(username)
+    if not user_data:
         return False
     try:
-        with open(user_file, "r", encoding="utf-8") as f:
-            user_data = json.load(f)
-        hashed_pw = user_data["hashed_password"].encode("utf-8")
-        return bcrypt.checkpw(password.encode("utf-8"), hashed_pw)
+        return check_password(username, password, user_data["hashed_password"])
     except:
-        return False
\ No newline at end of file
+        return False
+
+
+def verify_admin_credentials(admin_username: str, admin_password: str, exact: bool = False):
+    """
+    Verifica autorizzazione admin.
+    Accetta username admin in forma case-insensitive ma usa l'account admin di sistema.
+    Con exact=True (operazioni distruttive di users_api) lo username deve essere esattamente "admin".
+    """
+    if (admin_username != "admin") if exact else (admin_username.upper() != "ADMIN"):
+        raise HTTPException(status_code=403, detail="Accesso non autorizzato.")
+
+    admin_data = get_storage().get_user("admin")
+    if not admin_data:
+        raise HTTPException(status_code=401, detail="Credenziali admin non valide.")
+
+    try:
+        valid = check_password("admin", admin_password, admin_data.get("hashed_password", ""))
+    except ValueError:
+        valid = False
+    if not valid:
+        raise HTTPException(status_code=401, detail="Credenziali admin non valide.")
+
+
+def paginate_items(items: List[Any], page: int, page_size: int) -> dict:
+    total_items = len(items)
+    total_pages = (total_items + page_size - 1) // page_size if total_items > 0 else 0
+
+    start = (page - 1) * page_size
+    end = start + page_size
+
+    return {
+        "page": page,
+        "page_size": page_size,
+        "total_items": total_items,
+        "total_pages": total_pages,
+        "items": items[start:end],
+    }